@@ -1,26 +1,45 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-import pandas as pd
 import json
-import math
-from recipe_loader import load_recipes, save_recipe
-from matching_engine import RecipeMatcher, CookingTimePredictor
+import logging
+import time
+from metrics import REGISTRY, configure_logging, sampled, stage
+from recipe_loader import load_recipes, save_recipe, read_new_recipes
+from recipe_importer import DIFFICULTIES, parse_minutes
+from recipe_log import RECIPE_LOG_PATH
+from matching_engine import RecipeMatcher, CookingTimePredictor, StreamingTfidf
+from index_artifacts import artifact_path
+from lexicon import Lexicon
+from response_cache import EncodedResponse, ResponseCache
+from caching import LRUCache, SQLiteCache
+from nutrient_table import NutrientTable
 from gpt_generator import GPTRecipeGenerator
 from nutrition_analyzer import NutritionAnalyzer, MealPlanner
+from pipeline import Pipeline, Stage
+from sharded_matcher import ShardedMatcher
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 import os
+import threading
+
+# LOG_LEVEL sets the log level; LOG_SAMPLE_RATE the share of per-request
+# messages (search requests and results) that are logged at all
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO').upper(), float(os.environ.get('LOG_SAMPLE_RATE', 1.0)))
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 
 # Replace your existing CORS setup with this:
+CORS_ORIGINS = [
+    "https://recipe-ai-project.vercel.app",
+    "https://*.vercel.app"
+]
 if os.environ.get('FLASK_ENV') == 'production':
     # Production - allow your Vercel domain
     CORS(app, resources={
         r"/api/*": {
-            "origins": [
-                "https://recipe-ai-project.vercel.app",
-                "https://*.vercel.app"
-            ],
+            "origins": CORS_ORIGINS,
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
             "allow_headers": ["Content-Type", "Authorization"]
         }
@@ -30,20 +49,108 @@ else:
     CORS(app)
 
 # Initialize components
-print("Loading recipes...")
-recipes_df = load_recipes()
-print(f"Loaded {len(recipes_df)} recipes")
+logger.info("Loading recipes...")
+# Ingredient names are normalised (synonyms, plurals, regional names) before
+# indexing and searching; LEXICON_PATH points at a custom lexicon file
+lexicon = Lexicon(os.environ['LEXICON_PATH']) if os.environ.get('LEXICON_PATH') else Lexicon()
+def recipe_log_state():
+    """(inode, size) of the recipe log, or None before it exists"""
+    try:
+        stat = os.stat(RECIPE_LOG_PATH)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size
+
+# Without a prebuilt artefact the index is fitted chunk by chunk as recipes load
+log_state = recipe_log_state()
+index_path = artifact_path(RECIPE_LOG_PATH, lexicon=lexicon)
+prefit = None if index_path and os.path.isdir(index_path) else StreamingTfidf(lexicon=lexicon)
+recipe_store, catalogue_position = load_recipes(on_chunk=prefit.add_rows if prefit else None)
+# Hash the log again only if loading created it (first start) or compacted it
+if recipe_log_state() != log_state:
+    index_path = artifact_path(RECIPE_LOG_PATH, lexicon=lexicon)
+logger.info("Loaded %d recipes", len(recipe_store))
 
-print("Initializing recipe matcher...")
-matcher = RecipeMatcher(recipes_df)
+logger.info("Initializing recipe matcher...")
+nutrient_table = NutrientTable()
+# Repeat searches are served from an in-process LRU; set QUERY_CACHE_PATH to
+# a local SQLite file to share results between gunicorn workers
+query_cache_ttl = float(os.environ.get('QUERY_CACHE_TTL', 600))
+query_cache = LRUCache(
+    max_entries=int(os.environ.get('QUERY_CACHE_SIZE', 2048)),
+    ttl=query_cache_ttl,
+    backend=SQLiteCache(os.environ['QUERY_CACHE_PATH'], ttl=query_cache_ttl) if os.environ.get('QUERY_CACHE_PATH') else None
+)
+# DENSE_RETRIEVAL=1 adds the 'dense' and 'hybrid' retrieval modes, backed by
+# ingredient embeddings and an IVF index; DENSE_PROBE trades recall for latency
+dense_options = None
+if os.environ.get('DENSE_RETRIEVAL', '').lower() in ('1', 'true', 'yes'):
+    dense_options = {
+        'dim': int(os.environ.get('DENSE_DIM', 64)),
+        'n_lists': int(os.environ['DENSE_LISTS']) if os.environ.get('DENSE_LISTS') else None,
+        'n_probe': int(os.environ.get('DENSE_PROBE', 8)),
+    }
+# CLUSTER_COUNT fixes the number of discovery clusters; by default it is
+# picked from a sample of the catalogue
+cluster_count = int(os.environ['CLUSTER_COUNT']) if os.environ.get('CLUSTER_COUNT') else None
+matcher = RecipeMatcher(
+    recipe_store, artifact_path=index_path,
+    query_cache=query_cache, nutrient_table=nutrient_table, prefit=prefit,
+    dense=dense_options, cluster_count=cluster_count, lexicon=lexicon
+)
+# MATCHER_SHARDS=N scores searches across N processes per worker; each
+# gunicorn worker starts its own, so do not combine it with --preload.
+# Shard processes import the main module, so serve with gunicorn, not python app.py
+searcher = matcher
+if int(os.environ.get('MATCHER_SHARDS', 0)) > 1:
+    searcher = ShardedMatcher(matcher, int(os.environ['MATCHER_SHARDS']))
+    atexit.register(searcher.close)
 
-print("Initializing other services...")
+logger.info("Initializing other services...")
 cooking_predictor = CookingTimePredictor()
 gpt_generator = GPTRecipeGenerator()
-nutrition_analyzer = NutritionAnalyzer()
+nutrition_analyzer = NutritionAnalyzer(nutrient_table=nutrient_table)
 meal_planner = MealPlanner(matcher)
 
-print("All services initialized!")
+# Encoded GET payloads, rebuilt only when the catalogue version changes
+response_cache = ResponseCache()
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_BATCH_QUERIES = 500
+# Seconds a generation request waits on each stage before using its fallback
+GENERATION_TIMEOUT = float(os.environ.get('GENERATION_TIMEOUT', 30))
+NUTRITION_TIMEOUT = float(os.environ.get('NUTRITION_TIMEOUT', 8))
+
+# Shared by every generation request's pipeline stages
+enrichment_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ENRICHMENT_WORKERS', 16)))
+
+# Recipes saved by any worker are picked up by the others on their next
+# request that reads the catalogue, by reading the recipe log from where
+# this worker left off; health checks and metrics scrapes never touch it
+catalogue_lock = threading.Lock()
+CATALOGUE_ENDPOINTS = {
+    'get_all_recipes', 'find_recipes', 'find_recipes_batch', 'analyze_nutrition',
+    'create_meal_plan', 'get_clusters', 'get_cluster',
+}
+
+# Cache hit and miss totals, read from the caches' own counters at scrape time
+def cache_requests():
+    caches = {
+        'query': query_cache.stats(),
+        'response': response_cache.stats(),
+        'generation': gpt_generator.cache.stats(),
+        'nutrition': nutrition_analyzer.cache.stats(),
+        'ingredient_name': lexicon.cache.stats(),
+    }
+    counts = {}
+    for name, stats in caches.items():
+        counts[(('cache', name), ('result', 'hit'))] = stats['hits']
+        counts[(('cache', name), ('result', 'miss'))] = stats['misses']
+    return counts
+
+REGISTRY.counter('cache_requests_total', "Cache lookups by cache and result", callback=cache_requests)
+
+logger.info("All services initialized!")
 
 @app.errorhandler(404)
 def not_found(error):
@@ -61,6 +168,22 @@ def not_found(error):
 def internal_error(error):
     return jsonify({"error": "Internal server error"}), 500
 @app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    started = g.get('request_started')
+    if started is not None:
+        # Route templates rather than paths keep the label set bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REGISTRY.observe(
+            'http_request_duration_seconds', time.perf_counter() - started,
+            route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+@app.before_request
 def handle_preflight():
     if request.method == "OPTIONS":
         response = jsonify({"status": "success"})
@@ -68,6 +191,32 @@ def handle_preflight():
         response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
         response.headers.add("Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS")
         return response
+
+@app.before_request
+def sync_saved_recipes():
+    """Index recipes that other workers saved since this worker last checked"""
+    if request.endpoint not in CATALOGUE_ENDPOINTS:
+        return
+    added = index_saved_recipes()
+    if added:
+        logger.info("Indexed %d recipes saved by other workers", added)
+
+def index_saved_recipes():
+    """Index the recipe log past this worker's position; returns how many were added
+    
+    Reading and indexing happen under one lock, so every worker, the saving
+    one included, adds rows in log order and indexes each id once.
+    """
+    global catalogue_position
+    added = 0
+    with catalogue_lock:
+        recipes, catalogue_position = read_new_recipes(catalogue_position)
+        for recipe in recipes:
+            try:
+                added += searcher.add_recipe(recipe)
+            except Exception as e:
+                logger.error("Skipping saved recipe %s: %s", recipe.get('id'), e)
+    return added
     
 @app.route('/')
 def home():
@@ -75,22 +224,50 @@ def home():
         "message": "PantryAI API is running!",
         "endpoints": {
             "/api/recipes": "POST - Find recipes by ingredients",
+            "/api/recipes/batch": "POST - Find recipes for many ingredient queries",
             "/api/generate-recipe": "POST - Generate new recipe with AI",
+            "/api/generate-recipe/stream": "GET/POST - Stream a generated recipe as Server-Sent Events",
             "/api/analyze-nutrition": "POST - Analyze recipe nutrition",
             "/api/meal-plan": "POST - Generate weekly meal plan",
             "/api/recipes": "GET - Get all recipes",
-            "/api/clusters": "GET - Get recipe clusters"
+            "/api/clusters": "GET - Get recipe cluster summaries",
+            "/api/clusters/<id>": "GET - Get one page of a cluster's recipes",
+            "/api/metrics": "GET - Latency histograms and cache counters (Prometheus)"
         }
     })
 
 @app.route('/api/recipes', methods=['GET'])
 def get_all_recipes():
-    """Get all available recipes"""
-    recipes_list = recipes_df.to_dict('records')
-    return jsonify({
-        "recipes": recipes_list,
-        "total": len(recipes_list)
-    })
+    """Get all available recipes, or one page of them with ?cursor=&limit="""
+    version, total = matcher.catalogue_state()
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    
+    if cursor is None and limit is None:
+        # Recipes are stored pre-serialised, so the body is assembled from bytes
+        def build():
+            return EncodedResponse(
+                b'{"recipes":' + recipe_store.json_array(0, total) + b',"total":' + str(total).encode() + b'}'
+            )
+        return response_cache.get(('recipes',), version, build).to_response()
+    
+    try:
+        # The cursor is the last recipe id served. Row offsets would differ
+        # between workers that have not indexed the same saves yet; ids do not
+        start = min(total, recipe_store.row_after_id(int(cursor))) if cursor else 0
+        limit = min(MAX_PAGE_SIZE, max(1, int(limit or DEFAULT_PAGE_SIZE)))
+    except (ValueError, OverflowError):
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    
+    def build_page():
+        stop = min(start + limit, total)
+        next_cursor = json.dumps(str(recipe_store.ids[stop - 1]) if start < stop < total else None).encode()
+        return EncodedResponse(
+            b'{"recipes":' + recipe_store.json_array(start, stop) +
+            b',"total":' + str(total).encode() +
+            b',"next_cursor":' + next_cursor + b'}'
+        )
+    return response_cache.get(('recipes', start, limit), version, build_page).to_response()
 
 @app.route('/api/recipes', methods=['POST'])
 def find_recipes():
@@ -99,37 +276,36 @@ def find_recipes():
     ingredients = data.get('ingredients', [])
     diet_filter = data.get('diet_filter')
     top_n = data.get('top_n', 5)
+    # e.g. {"calories": {"max": 600}, "protein": {"min": 30}} and {"protein": 0.5}
+    nutrition = data.get('nutrition')
+    nutrition_weights = data.get('nutrition_weights')
+    # 'sparse' (default), 'dense' or 'hybrid'
+    retrieval = data.get('retrieval')
     
-    print(f"Received search request: {ingredients}, diet: {diet_filter}")
+    sampled(logger, logging.INFO, "Received search request: %s, diet: %s", ingredients, diet_filter)
     
     if not ingredients:
         return jsonify({"recipes": [], "error": "No ingredients provided"}), 400
+    try:
+        matcher.nutrient_bounds(nutrition)
+        matcher.nutrient_weights(nutrition_weights)
+        matcher.retrieval_mode(retrieval)
+    except ValueError as e:
+        return jsonify({"recipes": [], "error": str(e)}), 400
     
     try:
-        recipes = matcher.find_similar_recipes(ingredients, top_n, diet_filter)
-        
-        # Ensure proper JSON serialization
-        recipes_list = []
-        for recipe in recipes:
-            # Handle any serialization issues
-            recipe_dict = {}
-            for key, value in recipe.items():
-                # Convert NaN to None for JSON serialization
-                if isinstance(value, float) and math.isnan(value):
-                    recipe_dict[key] = None
-                else:
-                    recipe_dict[key] = value
-            recipes_list.append(recipe_dict)
+        recipes_list = searcher.find_similar_recipes(ingredients, top_n, diet_filter, nutrition, nutrition_weights, retrieval)
         
-        print(f"Returning {len(recipes_list)} recipes")
+        sampled(logger, logging.INFO, "Returning %d recipes", len(recipes_list))
         
-        return jsonify({
-            "recipes": recipes_list,
-            "ingredients_searched": ingredients,
-            "count": len(recipes_list)
-        })
+        with stage('serialise'):
+            return jsonify({
+                "recipes": recipes_list,
+                "ingredients_searched": ingredients,
+                "count": len(recipes_list)
+            })
     except Exception as e:
-        print(f"Error in recipe search: {e}")
+        logger.error("Error in recipe search: %s", e)
         return jsonify({
             "recipes": [],
             "error": str(e),
@@ -137,6 +313,95 @@ def find_recipes():
             "count": 0
         }), 500
 
+@app.route('/api/recipes/batch', methods=['POST'])
+def find_recipes_batch():
+    """Find recipes for many ingredient queries in one call"""
+    data = request.get_json()
+    queries = data.get('queries', [])
+    
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"results": [], "error": "No queries provided"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"results": [], "error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+    if not all(isinstance(query, dict) and query.get('ingredients') for query in queries):
+        return jsonify({"results": [], "error": "Every query needs ingredients"}), 400
+    try:
+        for query in queries:
+            matcher.nutrient_bounds(query.get('nutrition'))
+            matcher.nutrient_weights(query.get('nutrition_weights'))
+            matcher.retrieval_mode(query.get('retrieval'))
+    except ValueError as e:
+        return jsonify({"results": [], "error": str(e)}), 400
+    
+    try:
+        batch = searcher.find_similar_recipes_batch(queries)
+        with stage('serialise'):
+            return jsonify({
+                "results": [
+                    {
+                        "recipes": recipes,
+                        "ingredients_searched": query['ingredients'],
+                        "count": len(recipes)
+                    }
+                    for query, recipes in zip(queries, batch)
+                ],
+                "count": len(batch)
+            })
+    except Exception as e:
+        logger.error("Error in batch recipe search: %s", e)
+        return jsonify({"results": [], "error": str(e)}), 500
+
+def predict_cooking_time(values):
+    recipe = values['recipe']
+    if 'cooking_time' in recipe:
+        return recipe['cooking_time']
+    ingredient_names = [ing['name'] if isinstance(ing, dict) else ing for ing in recipe.get('ingredients', [])]
+    return cooking_predictor.predict_time(ingredient_names, recipe.get('difficulty', 'medium'))
+
+def analyze_generated_nutrition(values):
+    recipe = values['recipe']
+    return nutrition_analyzer.analyze_recipe(
+        recipe.get('title', 'Generated Recipe'), recipe.get('ingredients', []), values.get('prefetched')
+    )
+
+def estimate_generated_nutrition(values):
+    nutrition = nutrient_table.estimate(values['recipe'].get('ingredients', []))
+    nutrition['source'] = "estimated"
+    return nutrition
+
+# Cooking time and nutrition for a finished recipe, run side by side
+ENRICHMENT_STAGES = [
+    Stage('cooking_time', predict_cooking_time, after=('recipe',)),
+    Stage('nutrition', analyze_generated_nutrition, after=('recipe', 'prefetched'),
+          timeout=NUTRITION_TIMEOUT, default=estimate_generated_nutrition),
+]
+enrichment_pipeline = Pipeline(ENRICHMENT_STAGES, enrichment_executor)
+
+def fallback_generated_recipe(values):
+    return gpt_generator.fallback_recipe(values['ingredients'], values['diet'], values['cuisine'])
+
+# Nutrition for the user's own ingredients is fetched while the model is
+# still writing, so the nutrition stage only fetches the lines it adds
+PREFETCH_STAGE = Stage('prefetched', lambda values: nutrition_analyzer.prefetch(values['ingredients']),
+                       timeout=GENERATION_TIMEOUT, default={})
+generation_pipeline = Pipeline([
+    PREFETCH_STAGE,
+    Stage('recipe', lambda values: gpt_generator.generate_recipe(values['ingredients'], values['diet'], values['cuisine']),
+          timeout=GENERATION_TIMEOUT, default=fallback_generated_recipe),
+] + ENRICHMENT_STAGES, enrichment_executor)
+
+def enrich_recipe(recipe, result):
+    """Copy pipeline results into the recipe, noting stages that fell back"""
+    if result['cooking_time'] is not None:
+        recipe['cooking_time'] = result['cooking_time']
+    recipe['nutrition'] = result['nutrition']
+    if result.partial:
+        recipe['partial'] = sorted(result.errors)
+    return recipe
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.route('/api/generate-recipe', methods=['POST'])
 def generate_recipe():
     """Generate a new recipe using AI"""
@@ -149,41 +414,82 @@ def generate_recipe():
         return jsonify({"error": "No ingredients provided"}), 400
     
     try:
-        # Generate recipe
-        generated_recipe = gpt_generator.generate_recipe(ingredients, diet, cuisine)
-        
-        # Predict cooking time if not provided
-        if 'cooking_time' not in generated_recipe:
-            ingredient_names = [ing['name'] if isinstance(ing, dict) else ing for ing in generated_recipe.get('ingredients', [])]
-            generated_recipe['cooking_time'] = cooking_predictor.predict_time(
-                ingredient_names, 
-                generated_recipe.get('difficulty', 'medium')
-            )
-        
-        # Analyze nutrition
-        nutrition_data = nutrition_analyzer.analyze_recipe(
-            generated_recipe['title'],
-            generated_recipe['ingredients'] if isinstance(generated_recipe['ingredients'][0], dict) else [{'name': ing, 'amount': '1 portion'} for ing in generated_recipe['ingredients']]
-        )
-        generated_recipe['nutrition'] = nutrition_data
+        result = generation_pipeline.run(ingredients=ingredients, diet=diet, cuisine=cuisine)
+        generated_recipe = enrich_recipe(result['recipe'], result)
         
         return jsonify({
             "recipe": generated_recipe,
             "ingredients_used": ingredients
         })
     except Exception as e:
-        print(f"Error generating recipe: {e}")
+        logger.error("Error generating recipe: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/generate-recipe/stream', methods=['GET', 'POST'])
+def generate_recipe_stream():
+    """Generate a recipe as Server-Sent Events, sending each part as soon as it is written
+    
+    Events: title, ingredient, instruction and field while the model writes,
+    then enrichment (cooking time and nutrition) and finally done with the
+    complete recipe. GET takes ?ingredients=a,b&diet=&cuisine= for EventSource.
+    """
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        ingredients = data.get('ingredients', [])
+        diet = data.get('diet', '')
+        cuisine = data.get('cuisine', '')
+    else:
+        ingredients = [ing.strip() for ing in request.args.get('ingredients', '').split(',') if ing.strip()]
+        diet = request.args.get('diet', '')
+        cuisine = request.args.get('cuisine', '')
+    
+    if not ingredients:
+        return jsonify({"error": "No ingredients provided"}), 400
+    
+    def events():
+        recipe = None
+        prefetch = enrichment_executor.submit(nutrition_analyzer.prefetch, ingredients)
+        try:
+            for event, data in gpt_generator.stream_recipe(ingredients, diet, cuisine):
+                if event == 'recipe':
+                    recipe = data
+                else:
+                    yield sse_event(event, data)
+            
+            # An unfinished prefetch is not waited for; nutrition fetches what it needs
+            prefetched = prefetch.result() if prefetch.done() and not prefetch.exception() else {}
+            enrich_recipe(recipe, enrichment_pipeline.run(recipe=recipe, prefetched=prefetched))
+            yield sse_event('enrichment', {key: recipe[key] for key in ('cooking_time', 'nutrition', 'partial') if key in recipe})
+            yield sse_event('done', {"recipe": recipe, "ingredients_used": ingredients})
+        except Exception as e:
+            logger.error("Error streaming recipe: %s", e)
+            yield sse_event('error', {"error": str(e)})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        # Stop proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/analyze-nutrition', methods=['POST'])
 def analyze_nutrition():
     """Analyze nutrition for a recipe"""
     data = request.get_json()
     recipe_title = data.get('title', 'Generated Recipe')
     ingredients = data.get('ingredients', [])
+    recipe_id = data.get('recipe_id')
     
     try:
-        nutrition_data = nutrition_analyzer.analyze_recipe(recipe_title, ingredients)
+        # Catalogue recipes have their estimate precomputed
+        nutrition_data = None
+        if recipe_id is not None and not ingredients:
+            row = recipe_store.row_of(recipe_id)
+            nutrition_data = matcher.get_nutrition(row) if row is not None else None
+            if nutrition_data is None:
+                return jsonify({"error": f"Unknown recipe {recipe_id}"}), 404
+        if nutrition_data is None:
+            nutrition_data = nutrition_analyzer.analyze_recipe(recipe_title, ingredients)
         return jsonify({
             "nutrition": nutrition_data,
             "recipe_title": recipe_title
@@ -208,36 +514,123 @@ def create_meal_plan():
             'error': str(e)
         }), 500
 
+def encode_cluster(summary):
+    """A cluster summary as JSON bytes, representatives as their stored recipes"""
+    head = {key: summary[key] for key in ('id', 'size', 'top_terms')}
+    representatives = summary.get('representatives')
+    if representatives is None:
+        return json.dumps(head).encode()
+    return json.dumps(head)[:-1].encode() + b',"representatives":[' + b','.join(
+        recipe_store.get_json(row) for row in representatives
+    ) + b']}'
+
 @app.route('/api/clusters', methods=['GET'])
 def get_clusters():
-    """Get recipe clusters for discovery"""
+    """Cluster summaries for discovery: size, top terms and representative recipes"""
     try:
-        clusters = matcher.get_recipe_clusters()
-        return jsonify(clusters)
+        version, _ = matcher.catalogue_state()
+        
+        def build():
+            summaries = matcher.cluster_summaries()
+            if summaries is None:
+                return EncodedResponse(json.dumps({"error": "Not enough recipes for clustering"}).encode())
+            return EncodedResponse(
+                b'{"clusters":[' + b','.join(encode_cluster(summary) for summary in summaries) +
+                b'],"count":' + str(len(summaries)).encode() + b'}'
+            )
+        return response_cache.get(('clusters',), version, build).to_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/clusters/<int:cluster_id>', methods=['GET'])
+def get_cluster(cluster_id):
+    """One cluster's summary and a page of its recipes with ?cursor=&limit="""
+    version, _ = matcher.catalogue_state()
+    try:
+        # Members only ever get appended until the next refit, so an offset is a stable cursor
+        start = max(0, int(request.args.get('cursor') or 0))
+        limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get('limit') or DEFAULT_PAGE_SIZE)))
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    
+    def build_page():
+        page = matcher.cluster_page(cluster_id, start, limit)
+        if page is None:
+            return None
+        summary, rows = page
+        stop = start + len(rows)
+        next_cursor = json.dumps(str(stop) if stop < summary['size'] else None).encode()
+        return EncodedResponse(
+            b'{"cluster":' + encode_cluster({key: summary[key] for key in ('id', 'size', 'top_terms')}) +
+            b',"recipes":[' + b','.join(recipe_store.get_json(row) for row in rows) + b']' +
+            b',"total":' + str(summary['size']).encode() +
+            b',"next_cursor":' + next_cursor + b'}'
+        )
+    encoded = response_cache.get(('cluster', cluster_id, start, limit), version, build_page)
+    if encoded is None:
+        return jsonify({"error": f"No cluster {cluster_id}"}), 404
+    return encoded.to_response()
+
+def recipe_to_save(recipe):
+    """A client's recipe in the catalogue's format; ValueError if it cannot be stored
+    
+    Every worker indexes saved recipes from the log, so nothing reaches it
+    that the store cannot read back.
+    """
+    if not isinstance(recipe, dict):
+        raise ValueError("recipe must be an object")
+    title = recipe.get('title')
+    if title is not None and not isinstance(title, str):
+        raise ValueError("title must be a string")
+    ingredients = recipe.get('ingredients', [])
+    if not isinstance(ingredients, list):
+        raise ValueError("ingredients must be a list")
+    ingredients = [ing.get('name') if isinstance(ing, dict) else ing for ing in ingredients]
+    if not all(isinstance(name, str) and name for name in ingredients):
+        raise ValueError("every ingredient needs a name")
+    instructions = recipe.get('instructions', [])
+    dietary_tags = recipe.get('dietary_tags', [])
+    if not isinstance(instructions, list) or not isinstance(dietary_tags, list):
+        raise ValueError("instructions and dietary_tags must be lists")
+    # Numbers and text such as '20 minutes' or 'PT20M' are accepted
+    cooking_time = recipe.get('cooking_time')
+    try:
+        minutes = 30 if cooking_time is None else parse_minutes(cooking_time)
+    except (OverflowError, ValueError):
+        minutes = None
+    if minutes is None or not 0 < minutes < 100000:
+        raise ValueError(f"Invalid cooking_time {cooking_time!r}")
+    difficulty = str(recipe.get('difficulty', 'medium')).lower()
+    if difficulty not in DIFFICULTIES:
+        raise ValueError(f"difficulty must be one of {sorted(DIFFICULTIES)}")
+    return {
+        "title": title,
+        "ingredients": ingredients,
+        "instructions": instructions,
+        "cooking_time": minutes,
+        "difficulty": difficulty,
+        "dietary_tags": dietary_tags
+    }
+
 @app.route('/api/save-recipe', methods=['POST'])
 def save_user_recipe():
     """Save a generated recipe"""
-    data = request.get_json()
-    recipe = data.get('recipe')
+    data = request.get_json(silent=True)
+    recipe = data.get('recipe') if isinstance(data, dict) else None
     
     if not recipe:
         return jsonify({"error": "No recipe provided"}), 400
+    try:
+        saved_recipe = recipe_to_save(recipe)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
-        # Convert to standard format
-        saved_recipe = {
-            "title": recipe.get('title'),
-            "ingredients": [ing['name'] if isinstance(ing, dict) else ing for ing in recipe.get('ingredients', [])],
-            "instructions": recipe.get('instructions', []),
-            "cooking_time": recipe.get('cooking_time', 30),
-            "difficulty": recipe.get('difficulty', 'medium'),
-            "dietary_tags": recipe.get('dietary_tags', [])
-        }
-        
         saved_recipe = save_recipe(saved_recipe)
+        if saved_recipe:
+            # Searchable in this worker right away, read back from the log
+            # like any other worker's save; the others pick it up the same way
+            index_saved_recipes()
         
         return jsonify({
             "message": "Recipe saved successfully",
@@ -246,9 +639,20 @@ def save_user_recipe():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/metrics')
+def metrics():
+    """Request and stage latency histograms and cache counters, in Prometheus text format"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/health')
 def health_check():
-    return jsonify({"status": "healthy", "recipes_loaded": len(recipes_df)})
+    return jsonify({
+        "status": "healthy",
+        "recipes_loaded": matcher.num_recipes,
+        "query_cache": query_cache.stats(),
+        "ingredient_name_cache": lexicon.cache.stats(),
+        "generation_cache": gpt_generator.stats()
+    })
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
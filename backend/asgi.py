@@ -0,0 +1,261 @@
+"""ASGI entry point serving the same API as wsgi.py
+
+Recipe generation waits on OpenAI for seconds at a time, which under
+`gunicorn app:app` ties up a whole sync worker per request. Here the
+generation routes run natively on the event loop, so one worker holds many
+of them at once while they wait upstream:
+
+    POST     /api/generate-recipe          async pipeline (see app.py)
+    GET/POST /api/generate-recipe/stream   async Server-Sent Events
+
+Every other route is the Flask app, run on a bounded thread pool. Matching
+is CPU-bound, so that pool is sized to the cores rather than the traffic.
+Routes that mostly wait on Edamam run on the larger I/O pool instead.
+
+Run with
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2 --limit-concurrency 512
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+
+Concurrency settings, per worker process:
+
+    WSGI_THREADS         Flask routes (search, meal plans) in parallel; default: CPU count
+    ENRICHMENT_WORKERS   threads for Edamam lookups and other blocking I/O; default 16
+    GENERATION_TIMEOUT   seconds to wait for the model before the fallback recipe; default 30
+    NUTRITION_TIMEOUT    seconds to wait for Edamam before the local estimate; default 8
+
+--limit-concurrency caps open connections per worker (excess requests get
+503) and is what bounds memory under a burst of generation requests. Each
+worker loads its own copy of the catalogue and index, so add workers for
+matching throughput, not for generation capacity.
+"""
+import asyncio
+import fnmatch
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as flask_app
+from app import (
+    GENERATION_TIMEOUT, PREFETCH_STAGE, ENRICHMENT_STAGES, enrichment_executor, enrichment_pipeline,
+    enrich_recipe, fallback_generated_recipe, gpt_generator, nutrition_analyzer, sse_event
+)
+from metrics import REGISTRY
+from pipeline import Pipeline, Stage
+
+logger = logging.getLogger(__name__)
+
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', os.cpu_count() or 4))
+# Flask routes that spend their time waiting on Edamam rather than computing
+IO_ROUTES = {'/api/analyze-nutrition'}
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+async def agenerate(values):
+    return await gpt_generator.agenerate_recipe(values['ingredients'], values['diet'], values['cuisine'])
+
+# generation_pipeline with the model call on the event loop
+async_generation_pipeline = Pipeline([
+    PREFETCH_STAGE,
+    Stage('recipe', agenerate, timeout=GENERATION_TIMEOUT, default=fallback_generated_recipe),
+] + ENRICHMENT_STAGES, enrichment_executor)
+
+def cors_headers(headers):
+    """Access-Control-Allow-Origin as flask-cors would set it for this request"""
+    if os.environ.get('FLASK_ENV') != 'production':
+        return [(b'access-control-allow-origin', b'*')]
+    origin = headers.get(b'origin', b'').decode('latin-1')
+    if any(fnmatch.fnmatch(origin, pattern) for pattern in flask_app.CORS_ORIGINS):
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    return []
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def send_json(send, status, payload, extra_headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(extra_headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def generation_inputs(method, query_string, body):
+    """(ingredients, diet, cuisine) from a JSON body or, for GET, the query string"""
+    if method == 'GET':
+        args = parse_qs(query_string.decode('latin-1'))
+        ingredients = [ing.strip() for ing in args.get('ingredients', [''])[0].split(',') if ing.strip()]
+        return ingredients, args.get('diet', [''])[0], args.get('cuisine', [''])[0]
+    data = json.loads(body or b'{}') or {}
+    # Valid JSON that is not an object is as unusable as invalid JSON
+    if not isinstance(data, dict) or not isinstance(data.get('ingredients', []), list):
+        raise ValueError("Expected a JSON object with an ingredients list")
+    return data.get('ingredients', []), data.get('diet', ''), data.get('cuisine', '')
+
+async def generate_recipe(scope, receive, send, headers):
+    try:
+        ingredients, diet, cuisine = generation_inputs('POST', b'', await read_body(receive))
+    except ValueError:
+        return await send_json(send, 400, {"error": "Invalid JSON body"}, headers)
+    if not ingredients:
+        return await send_json(send, 400, {"error": "No ingredients provided"}, headers)
+
+    try:
+        result = await async_generation_pipeline.arun(ingredients=ingredients, diet=diet, cuisine=cuisine)
+        generated_recipe = enrich_recipe(result['recipe'], result)
+        await send_json(send, 200, {"recipe": generated_recipe, "ingredients_used": ingredients}, headers)
+    except Exception as e:
+        logger.error("Error generating recipe: %s", e)
+        await send_json(send, 500, {"error": str(e)}, headers)
+
+async def generate_recipe_stream(scope, receive, send, headers):
+    try:
+        ingredients, diet, cuisine = generation_inputs(scope['method'], scope.get('query_string', b''), await read_body(receive))
+    except ValueError:
+        return await send_json(send, 400, {"error": "Invalid JSON body"}, headers)
+    if not ingredients:
+        return await send_json(send, 400, {"error": "No ingredients provided"}, headers)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ] + headers,
+    })
+
+    async def emit(event, data):
+        await send({'type': 'http.response.body', 'body': sse_event(event, data).encode('utf-8'), 'more_body': True})
+
+    loop = asyncio.get_running_loop()
+    prefetch = loop.run_in_executor(enrichment_executor, nutrition_analyzer.prefetch, ingredients)
+    recipe = None
+    try:
+        async for event, data in gpt_generator.astream_recipe(ingredients, diet, cuisine):
+            if event == 'recipe':
+                recipe = data
+            else:
+                await emit(event, data)
+
+        prefetched = prefetch.result() if prefetch.done() and not prefetch.exception() else {}
+        enrich_recipe(recipe, await enrichment_pipeline.arun(recipe=recipe, prefetched=prefetched))
+        await emit('enrichment', {key: recipe[key] for key in ('cooking_time', 'nutrition', 'partial') if key in recipe})
+        await emit('done', {"recipe": recipe, "ingredients_used": ingredients})
+    except Exception as e:
+        logger.error("Error streaming recipe: %s", e)
+        await emit('error', {"error": str(e)})
+    await send({'type': 'http.response.body', 'body': b''})
+
+NATIVE_ROUTES = {
+    ('POST', '/api/generate-recipe'): generate_recipe,
+    ('GET', '/api/generate-recipe/stream'): generate_recipe_stream,
+    ('POST', '/api/generate-recipe/stream'): generate_recipe_stream,
+}
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI carries the raw path bytes as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def run_wsgi(environ):
+    """Status, headers and buffered body of the Flask app's response"""
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    result = flask_app.app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+async def call_wsgi(scope, receive, send):
+    body = await read_body(receive)
+    executor = enrichment_executor if scope['path'] in IO_ROUTES else wsgi_executor
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(executor, run_wsgi, wsgi_environ(scope, body))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler = NATIVE_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        # Preflights and everything else keep Flask's behaviour, CORS included
+        return await call_wsgi(scope, receive, send)
+
+    # Flask times its own routes; native ones are timed here, streams to the last event
+    started = time.perf_counter()
+    status = {}
+
+    async def send_recording(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_recording, cors_headers(dict(scope['headers'])))
+    finally:
+        REGISTRY.observe(
+            'http_request_duration_seconds', time.perf_counter() - started,
+            route=scope['path'], method=scope['method'], status=status.get('code', 500)
+        )
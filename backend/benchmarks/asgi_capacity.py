@@ -0,0 +1,165 @@
+"""Concurrent generation requests one worker can hold: gunicorn sync vs ASGI
+
+Starts a local stub standing in for OpenAI and Edamam that answers after a
+fixed delay, then runs each server with a single worker process pointed at
+it and fires POST /api/generate-recipe at increasing concurrency.
+
+    cd backend && python benchmarks/asgi_capacity.py --llm-delay 1.0 --concurrency 1 8 32 64
+
+A sync worker serves one request at a time, so its throughput stays near
+1 / llm-delay whatever the concurrency; the ASGI worker's should grow with
+it until --limit-concurrency or the I/O pool is reached.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'gunicorn-sync': ['gunicorn', 'app:app', '--workers', '1', '--timeout', '300', '--bind', '127.0.0.1:{port}'],
+    'uvicorn-asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', '1', '--log-level', 'warning',
+                     '--host', '127.0.0.1', '--port', '{port}'],
+}
+
+STUB_RECIPE = {
+    "title": "Stub Stir Fry",
+    "ingredients": [{"name": "chicken", "amount": "200 g"}, {"name": "rice", "amount": "1 cup"}],
+    "instructions": ["Cook", "Serve"],
+    "cooking_time": 20,
+    "difficulty": "easy",
+    "servings": 2
+}
+
+def stub_handler(llm_delay, nutrition_delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            # Chat completions
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(llm_delay)
+            self.reply({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": json.dumps(STUB_RECIPE)}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+            })
+
+        def do_GET(self):
+            # Edamam nutrition-data
+            time.sleep(nutrition_delay)
+            self.reply({"calories": 250, "totalNutrients": {"PROCNT": {"quantity": 12}, "FAT": {"quantity": 8}}})
+
+    return StubHandler
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+def fire(url, concurrency, rounds, run_id):
+    """Throughput and latency percentiles for concurrency * rounds requests"""
+    def one(i):
+        # Distinct ingredients defeat the generation cache
+        payload = {"ingredients": ["chicken", "rice", f"spice {run_id}-{i}"]}
+        started = time.perf_counter()
+        response = requests.post(f"{url}/api/generate-recipe", json=payload, timeout=600)
+        return time.perf_counter() - started, response.status_code
+
+    total = concurrency * rounds
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status != 200)
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--llm-delay', type=float, default=1.0, help="seconds the stub takes per completion")
+    parser.add_argument('--nutrition-delay', type=float, default=0.2, help="seconds the stub takes per Edamam line")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--rounds', type=int, default=2, help="requests per client at each level")
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), stub_handler(args.llm_delay, args.nutrition_delay))
+    stub.daemon_threads = True
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='stub', OPENAI_BASE_URL=f"{stub_url}/v1",
+        EDAMAM_APP_ID='stub', EDAMAM_APP_KEY='stub', EDAMAM_BASE_URL=stub_url,
+        # Every request should reach the stub
+        GENERATION_CACHE_PATH='', NUTRITION_CACHE_PATH='',
+    )
+
+    results = {}
+    for name in args.servers:
+        port = free_port()
+        command = [part.format(port=port) for part in SERVERS[name]]
+        process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            wait_until_up(url, process)
+            results[name] = {}
+            for concurrency in args.concurrency:
+                row = fire(url, concurrency, args.rounds, f"{name}-{concurrency}")
+                results[name][concurrency] = row
+                print(f"{name:14} concurrency={concurrency:<4} {row['throughput_rps']:8.2f} req/s  "
+                      f"p50={row['p50_ms']:8.1f}ms  p95={row['p95_ms']:8.1f}ms  errors={row['errors']}")
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    stub.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"llm_delay": args.llm_delay, "nutrition_delay": args.nutrition_delay, "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
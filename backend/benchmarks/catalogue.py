@@ -0,0 +1,163 @@
+"""Seeded synthetic recipe catalogues built from the sample catalogue
+
+Every synthetic recipe is a variation on one of the recipes in
+data/sample_recipes.json: it keeps most of that recipe's ingredients,
+swaps a few for ingredients of other recipes sharing a dietary tag (so
+cuisines stay coherent), adds pantry staples by how common they are, and
+now and then spells an ingredient the way another author might (singular
+instead of plural, a synonym from data/lexicon.json). Titles, instructions, times, difficulty
+and tags follow the template recipe, so diet filters, clustering and
+nutrition estimates see realistic input at any size.
+
+The same seed always gives the same catalogue:
+
+    cd backend && python -m benchmarks.catalogue --recipes 100000 --out /tmp/recipes.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from recipe_log import RecipeLog
+
+SAMPLE_RECIPES = os.path.join(BACKEND_DIR, 'data', 'sample_recipes.json')
+LEXICON = os.path.join(BACKEND_DIR, 'data', 'lexicon.json')
+MIN_INGREDIENTS, MAX_INGREDIENTS = 5, 12
+# Per ingredient: chance of being swapped for one from a related recipe,
+# and of being written as a singular or synonym
+SWAP_RATE = 0.25
+VARIANT_RATE = 0.05
+TITLE_MODIFIERS = [
+    '', '', '', 'Quick', 'Spicy', 'Classic', 'Home-style', 'Easy', 'Smoky', 'Creamy',
+    'Weeknight', 'Rustic', 'Festive', 'Light', 'Hearty', 'Crispy', 'Tangy', 'Street-style',
+]
+# Catalogue write batch; each is one write and one fsync
+WRITE_BATCH = 10000
+
+class Vocabulary:
+    """Templates, ingredient frequencies and spelling variants from the sample data"""
+
+    def __init__(self, recipes_path=SAMPLE_RECIPES, lexicon_path=LEXICON):
+        with open(recipes_path, 'r', encoding='utf-8') as f:
+            self.templates = json.load(f)
+        counts = Counter(name.lower() for recipe in self.templates for name in recipe['ingredients'])
+        self.ingredients = [name for name, _ in counts.most_common()]
+        self.weights = [counts[name] for name in self.ingredients]
+        # Ingredients of the recipes sharing each tag
+        self.related = {}
+        for recipe in self.templates:
+            for tag in recipe.get('dietary_tags', []):
+                self.related.setdefault(tag, set()).update(name.lower() for name in recipe['ingredients'])
+        self.related = {tag: sorted(names) for tag, names in self.related.items()}
+
+        self.variants = {}
+        try:
+            with open(lexicon_path, 'r', encoding='utf-8') as f:
+                synonyms = json.load(f).get('synonyms', {})
+        except (OSError, ValueError):
+            synonyms = {}
+        for canonical, variants in synonyms.items():
+            self.variants.setdefault(canonical, []).extend(variants)
+
+    def spelling(self, name, rng):
+        """name as written by some recipe author: a synonym, the singular, or as is"""
+        singular = name[:-1] if name.endswith('s') and not name.endswith('ss') else name
+        options = self.variants.get(name, []) + self.variants.get(singular, [])
+        if name != singular:
+            options.append(singular)
+        return rng.choice(options) if options else name
+
+def synthetic_recipes(n_recipes, seed=0, vocabulary=None):
+    """Yield n_recipes recipe dicts (ids 1..n) deterministically for a seed"""
+    vocabulary = vocabulary or Vocabulary()
+    rng = random.Random(seed)
+    templates = vocabulary.templates
+    for i in range(n_recipes):
+        template = templates[rng.randrange(len(templates))]
+        tags = template.get('dietary_tags', [])
+        names = [name.lower() for name in template['ingredients']]
+        count = rng.randint(MIN_INGREDIENTS, MAX_INGREDIENTS)
+
+        ingredients = []
+        for name in rng.sample(names, min(len(names), count)):
+            if rng.random() < SWAP_RATE and tags:
+                name = rng.choice(vocabulary.related[rng.choice(tags)])
+            ingredients.append(name)
+        while len(ingredients) < count:
+            ingredients.append(rng.choices(vocabulary.ingredients, vocabulary.weights)[0])
+        ingredients = list(dict.fromkeys(ingredients))
+        ingredients = [
+            vocabulary.spelling(name, rng) if rng.random() < VARIANT_RATE else name
+            for name in ingredients
+        ]
+
+        modifier = rng.choice(TITLE_MODIFIERS)
+        recipe = {
+            "id": i + 1,
+            "title": f"{modifier} {template['title']}".strip(),
+            "ingredients": ingredients,
+            "instructions": list(template.get('instructions', [])),
+            "cooking_time": max(5, int(template.get('cooking_time', 30) * rng.uniform(0.7, 1.4))),
+            "difficulty": template.get('difficulty', 'medium'),
+            "dietary_tags": list(tags),
+        }
+        if template.get('cuisine'):
+            recipe['cuisine'] = template['cuisine']
+        yield recipe
+
+def sample_queries(n_queries, seed=0, vocabulary=None):
+    """Seeded search queries: a few ingredients of a template, sometimes misspelt or with a diet"""
+    vocabulary = vocabulary or Vocabulary()
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        template = vocabulary.templates[rng.randrange(len(vocabulary.templates))]
+        names = [name.lower() for name in template['ingredients']]
+        ingredients = rng.sample(names, min(len(names), rng.randint(2, 4)))
+        longest = max(range(len(ingredients)), key=lambda j: len(ingredients[j]))
+        if rng.random() < 0.1 and len(ingredients[longest]) > 5:
+            # Drop one letter of the longest ingredient, as a typo would
+            word = ingredients[longest]
+            cut = rng.randrange(1, len(word))
+            ingredients[longest] = word[:cut] + word[cut + 1:]
+        queries.append({
+            "ingredients": ingredients,
+            "top_n": 10,
+            "diet_filter": rng.choice([None, None, None, 'vegetarian', 'vegan', 'gluten-free']),
+        })
+    return queries
+
+def write_log(path, n_recipes, seed=0):
+    """Write a fresh recipe log of n_recipes synthetic recipes at path"""
+    if os.path.exists(path):
+        os.remove(path)
+    log = RecipeLog(path)
+    batch = []
+    for recipe in synthetic_recipes(n_recipes, seed):
+        # The log assigns ids in order, which gives the same 1..n
+        recipe.pop('id')
+        batch.append(recipe)
+        if len(batch) == WRITE_BATCH:
+            log.append_many(batch)
+            batch = []
+    if batch:
+        log.append_many(batch)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help="recipe log (JSON Lines) to write")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    write_log(args.out, args.recipes, args.seed)
+    print(f"Wrote {args.recipes} recipes to {args.out} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
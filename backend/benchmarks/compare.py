@@ -0,0 +1,131 @@
+"""Compare benchmark results against a stored baseline
+
+Results are flattened into dotted keys ("micro.10000.find_similar_recipes.p50_ms")
+and each shared key is compared by its suffix: times (_ms, _s, _us) must not
+grow, rates (_per_s, rps) must not shrink, and errors must not increase at
+all. A change beyond the key's threshold is a regression, unless it is
+below NOISE_FLOOR in absolute terms.
+
+Thresholds are fractions keyed by fnmatch patterns, the most specific
+(longest) matching pattern winning. They come from the baseline's
+"thresholds" object, then from --threshold PATTERN=FRACTION.
+
+    cd backend && python -m benchmarks.compare results.json benchmarks/baseline.json --threshold 'http.*=0.3'
+
+Exits with status 1 when anything regressed.
+"""
+import argparse
+import fnmatch
+import json
+import sys
+
+DEFAULT_THRESHOLD = 0.2
+LOWER_IS_BETTER = ('_ms', '_s', '_us')
+HIGHER_IS_BETTER = ('_per_s', 'rps')
+# Differences smaller than this, by unit, are timer and scheduler noise
+NOISE_FLOOR = {'_ms': 0.05, '_us': 50, '_s': 0.05}
+# Sections of a results file that are not measurements
+SKIPPED = ('meta', 'thresholds')
+
+def flatten(results, prefix=''):
+    """{dotted key: number} for every numeric leaf"""
+    flat = {}
+    for key, value in results.items():
+        if not prefix and key in SKIPPED:
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def direction(key):
+    """+1 if larger is better, -1 if smaller is better, 0 if not compared"""
+    leaf = key.rsplit('.', 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER):
+        return -1
+    if leaf == 'errors':
+        return -1
+    return 0
+
+def noise_floor(key):
+    leaf = key.rsplit('.', 1)[-1]
+    for suffix, floor in NOISE_FLOOR.items():
+        if leaf.endswith(suffix) and not leaf.endswith(HIGHER_IS_BETTER):
+            return floor
+    return 0
+
+def threshold_for(key, thresholds):
+    matches = [pattern for pattern in thresholds if fnmatch.fnmatchcase(key, pattern)]
+    return thresholds[max(matches, key=len)] if matches else DEFAULT_THRESHOLD
+
+def compare(results, baseline, thresholds=None):
+    """Rows of (key, baseline, current, relative change, status) for keys in both"""
+    thresholds = dict(baseline.get('thresholds', {}), **(thresholds or {}))
+    current, reference = flatten(results), flatten(baseline)
+    rows = []
+    for key in sorted(current.keys() & reference.keys()):
+        sign = direction(key)
+        if sign == 0:
+            continue
+        old, new = reference[key], current[key]
+        if key.rsplit('.', 1)[-1] == 'errors':
+            status = 'regressed' if new > old else 'ok'
+            rows.append((key, old, new, None, status))
+            continue
+        change = (new - old) / old if old else 0.0
+        limit = threshold_for(key, thresholds)
+        worse = -sign * change
+        if abs(new - old) <= noise_floor(key):
+            status = 'ok'
+        elif worse > limit:
+            status = 'regressed'
+        elif worse < -limit:
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append((key, old, new, change, status))
+    return rows
+
+def report(rows, verbose=False):
+    """Print the comparison; returns the number of regressions"""
+    regressions = 0
+    for key, old, new, change, status in rows:
+        regressions += status == 'regressed'
+        if status == 'ok' and not verbose:
+            continue
+        shown = f"{change:+8.1%}" if change is not None else f"{'':8}"
+        print(f"{status:9} {key:60} {old:>12g} -> {new:<12g} {shown}")
+    print(f"{len(rows)} metrics compared, {regressions} regressed, "
+          f"{sum(row[4] == 'improved' for row in rows)} improved")
+    return regressions
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        pattern, _, fraction = value.rpartition('=')
+        if not pattern:
+            raise argparse.ArgumentTypeError(f"Expected PATTERN=FRACTION, got {value!r}")
+        thresholds[pattern] = float(fraction)
+    return thresholds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('results', help="results JSON from benchmarks.run")
+    parser.add_argument('baseline', help="baseline JSON to compare against")
+    parser.add_argument('--threshold', action='append', metavar='PATTERN=FRACTION',
+                        help="allowed relative regression for matching keys (repeatable)")
+    parser.add_argument('--verbose', action='store_true', help="also list unchanged metrics")
+    args = parser.parse_args()
+    with open(args.results, 'r') as f:
+        results = json.load(f)
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = report(compare(results, baseline, parse_thresholds(args.threshold)), args.verbose)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Recall and latency of the dense IVF index against exact search
+
+Generates a synthetic catalogue at each size, where recipes draw most of
+their ingredients from one of a set of cuisine-like pools, fits the
+co-occurrence embeddings and the IVF index on it, then for each n_probe
+reports recall@k against brute-force search over every recipe vector and
+per-query p50/p99 latency.
+
+    cd backend && python benchmarks/dense_recall.py --sizes 10000 100000 1000000 --n-probe 1 4 8 16 32
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dense_index import EMBEDDING_DIM, IVFIndex, cooccurrence_embeddings, embed_rows, ingredient_idf
+
+TOPICS = 60
+TOPIC_POOL = 80
+# Share of a recipe's ingredients drawn from the whole pantry instead of its topic
+PANTRY_SHARE = 0.2
+MIN_INGREDIENTS, MAX_INGREDIENTS = 5, 12
+QUERY_INGREDIENTS = 3
+
+def zipf_weights(n, exponent=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def synthetic_incidence(n_recipes, n_ingredients, rng):
+    """Binary recipe-by-ingredient CSR matrix with topic structure"""
+    pools = np.array([rng.choice(n_ingredients, TOPIC_POOL, replace=False) for _ in range(TOPICS)])
+    lengths = rng.integers(MIN_INGREDIENTS, MAX_INGREDIENTS + 1, n_recipes)
+    rows = np.repeat(np.arange(n_recipes), lengths)
+    topics = np.repeat(rng.integers(0, TOPICS, n_recipes), lengths)
+    in_topic = pools[topics, rng.choice(TOPIC_POOL, len(rows), p=zipf_weights(TOPIC_POOL))]
+    pantry = rng.choice(n_ingredients, len(rows), p=zipf_weights(n_ingredients))
+    columns = np.where(rng.random(len(rows)) < PANTRY_SHARE, pantry, in_topic)
+    incidence = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(n_recipes, n_ingredients))
+    incidence.data[:] = 1.0
+    return incidence
+
+def query_incidence(incidence, n_queries, rng):
+    """A few ingredients from each of n_queries random recipes"""
+    rows, columns = [], []
+    for i, recipe in enumerate(rng.choice(incidence.shape[0], n_queries, replace=False)):
+        ingredients = incidence.indices[incidence.indptr[recipe]:incidence.indptr[recipe + 1]]
+        chosen = rng.choice(ingredients, min(QUERY_INGREDIENTS, len(ingredients)), replace=False)
+        rows.extend([i] * len(chosen))
+        columns.extend(chosen)
+    return sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(n_queries, incidence.shape[1]))
+
+def exact_search(vectors, query, k):
+    scores = vectors @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+def run_size(n_recipes, args, rng):
+    n_ingredients = max(500, int(40 * np.sqrt(n_recipes)))
+    started = time.perf_counter()
+    incidence = synthetic_incidence(n_recipes, n_ingredients, rng)
+    generated = time.perf_counter()
+
+    idf = ingredient_idf(incidence)
+    embeddings = cooccurrence_embeddings(incidence, args.dim, args.seed)
+    vectors = embed_rows(incidence, embeddings, idf)
+    embedded = time.perf_counter()
+    index = IVFIndex(args.lists, seed=args.seed).fit(vectors)
+    indexed = time.perf_counter()
+    print(f"{n_recipes} recipes, {n_ingredients} ingredients: generated in {generated - started:.1f}s, "
+          f"embedded in {embedded - generated:.1f}s, indexed into {index.n_lists} lists in {indexed - embedded:.1f}s")
+
+    queries = embed_rows(query_incidence(incidence, args.queries, rng), embeddings, idf)
+    exact_latencies, truth = [], []
+    for query in queries:
+        t = time.perf_counter()
+        truth.append(set(exact_search(vectors, query, args.k).tolist()))
+        exact_latencies.append(time.perf_counter() - t)
+    row = {
+        "ingredients": n_ingredients,
+        "lists": index.n_lists,
+        "build_s": round(indexed - generated, 2),
+        "exact": {"p50_ms": percentile_ms(exact_latencies, 50), "p99_ms": percentile_ms(exact_latencies, 99)},
+        "ivf": {},
+    }
+    print(f"  exact          p50={row['exact']['p50_ms']:8.3f}ms  p99={row['exact']['p99_ms']:8.3f}ms")
+
+    for n_probe in args.n_probe:
+        if n_probe > index.n_lists:
+            continue
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            t = time.perf_counter()
+            rows, _ = index.search(query, args.k, n_probe)
+            latencies.append(time.perf_counter() - t)
+            hits += len(expected & set(rows.tolist()))
+        result = {
+            f"recall@{args.k}": round(hits / (args.k * len(queries)), 4),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+        }
+        row["ivf"][n_probe] = result
+        print(f"  n_probe={n_probe:<6} p50={result['p50_ms']:8.3f}ms  p99={result['p99_ms']:8.3f}ms  "
+              f"recall@{args.k}={result[f'recall@{args.k}']:.3f}")
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM)
+    parser.add_argument('--lists', type=int, help="IVF lists; default sqrt(recipes)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = {size: run_size(size, args, rng) for size in args.sizes}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"k": args.k, "dim": args.dim, "queries": args.queries, "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""End-to-end HTTP load scenarios against the running app, fully offline
+
+Writes a synthetic catalogue (benchmarks.catalogue) into a scratch working
+directory, starts the local OpenAI/Edamam stub from asgi_capacity, then
+starts the app from that directory under gunicorn (or uvicorn) pointed at
+the stub, and fires each scenario from a pool of client threads:
+
+- search: POST /api/recipes with seeded queries, some misspelt or diet-filtered
+- search_batch: POST /api/recipes/batch, BATCH_SIZE queries per request
+- recipes_page: GET /api/recipes?cursor=&limit=
+- meal_plan: POST /api/meal-plan
+- clusters: GET /api/clusters
+- analyze_nutrition: POST /api/analyze-nutrition, one stub call per line
+- generate: POST /api/generate-recipe, one stub completion per request
+
+Payloads of the last two are distinct per request so every one reaches the
+stub instead of the app's caches.
+
+    cd backend && python -m benchmarks.http_load --recipes 10000 --requests 500 --concurrency 8
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from benchmarks.asgi_capacity import SERVERS, free_port, stub_handler, wait_until_up
+from benchmarks.catalogue import Vocabulary, sample_queries, write_log
+
+BATCH_SIZE = 16
+PAGE_SIZE = 50
+# Scenarios whose requests wait on the stub get fewer of them
+STUBBED_SHARE = 0.2
+
+def scenarios(queries, n_recipes):
+    """name -> (method, path, payload or query params for request i)"""
+    def query(i):
+        return queries[i % len(queries)]
+
+    return {
+        'search': ('POST', '/api/recipes', lambda i: query(i)),
+        'search_batch': ('POST', '/api/recipes/batch', lambda i: {
+            "queries": [query(i * BATCH_SIZE + j) for j in range(BATCH_SIZE)]
+        }),
+        'recipes_page': ('GET', '/api/recipes', lambda i: {
+            "cursor": (i * PAGE_SIZE) % max(1, n_recipes), "limit": PAGE_SIZE
+        }),
+        'meal_plan': ('POST', '/api/meal-plan', lambda i: {
+            "ingredients": query(i)['ingredients'], "diet_preference": query(i)['diet_filter']
+        }),
+        'clusters': ('GET', '/api/clusters', lambda i: None),
+        'analyze_nutrition': ('POST', '/api/analyze-nutrition', lambda i: {
+            "title": f"Benchmark {i}", "ingredients": [f"{100 + i} g {name}" for name in query(i)['ingredients']]
+        }),
+        'generate': ('POST', '/api/generate-recipe', lambda i: {
+            "ingredients": query(i)['ingredients'] + [f"spice {i}"], "diet": query(i)['diet_filter']
+        }),
+    }
+
+STUBBED = {'analyze_nutrition', 'generate'}
+
+def fire(url, method, path, payload, n_requests, concurrency):
+    """Latency percentiles, throughput and error count of n_requests requests"""
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        body = payload(i)
+        started = time.perf_counter()
+        try:
+            if method == 'GET':
+                response = session.get(url + path, params=body, timeout=120)
+            else:
+                response = session.post(url + path, json=body, timeout=120)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    return {
+        "requests": n_requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "rps": round(n_requests / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+    }
+
+def prepare_workdir(workdir, n_recipes, seed):
+    """Scratch directory laid out like backend/ with a synthetic recipe log"""
+    data = os.path.join(workdir, 'data')
+    os.makedirs(data, exist_ok=True)
+    write_log(os.path.join(data, 'recipes.jsonl'), n_recipes, seed)
+    os.symlink(os.path.join(BACKEND_DIR, 'data', 'nutrients.json'), os.path.join(data, 'nutrients.json'))
+
+def run(n_recipes=10000, n_requests=500, concurrency=8, seed=0, server='gunicorn-sync',
+        only=None, llm_delay=0.05, nutrition_delay=0.01):
+    """Startup time and per-scenario results for one server and catalogue"""
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), stub_handler(llm_delay, nutrition_delay))
+    stub.daemon_threads = True
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+
+    workdir = tempfile.mkdtemp(prefix='pantry-load-')
+    process = None
+    try:
+        prepare_workdir(workdir, n_recipes, seed)
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get('PYTHONPATH')])),
+            OPENAI_API_KEY='stub', OPENAI_BASE_URL=f"{stub_url}/v1",
+            EDAMAM_APP_ID='stub', EDAMAM_APP_KEY='stub', EDAMAM_BASE_URL=stub_url,
+            GENERATION_CACHE_PATH='', NUTRITION_CACHE_PATH='', METRICS_DIR='',
+            LOG_LEVEL='WARNING',
+        )
+        port = free_port()
+        command = [part.format(port=port) for part in SERVERS[server]]
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+        wait_until_up(f"{url}/api/health", process, timeout=1800)
+        results = {"recipes": n_recipes, "server": server, "concurrency": concurrency,
+                   "startup_s": round(time.perf_counter() - started, 2), "scenarios": {}}
+        print(f"{server} up with {n_recipes} recipes in {results['startup_s']:.2f}s")
+
+        queries = sample_queries(max(n_requests, 1000), seed, Vocabulary())
+        for name, (method, path, payload) in scenarios(queries, n_recipes).items():
+            if only and name not in only:
+                continue
+            count = max(concurrency, int(n_requests * STUBBED_SHARE)) if name in STUBBED else n_requests
+            # One untimed request so lazy setup is not counted
+            fire(url, method, path, payload, 1, 1)
+            row = fire(url, method, path, payload, count, concurrency)
+            results['scenarios'][name] = row
+            print(f"{name:18} {row['rps']:9.1f} req/s  p50={row['p50_ms']:8.2f}ms  p95={row['p95_ms']:8.2f}ms  "
+                  f"p99={row['p99_ms']:8.2f}ms  errors={row['errors']}")
+        return results
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=10000, help="synthetic catalogue size")
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads")
+    parser.add_argument('--server', default='gunicorn-sync', choices=list(SERVERS))
+    parser.add_argument('--scenarios', nargs='+', help="run only these scenarios")
+    parser.add_argument('--llm-delay', type=float, default=0.05, help="seconds the stub takes per completion")
+    parser.add_argument('--nutrition-delay', type=float, default=0.01, help="seconds the stub takes per Edamam line")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    results = run(args.recipes, args.requests, args.concurrency, args.seed, args.server,
+                  args.scenarios, args.llm_delay, args.nutrition_delay)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
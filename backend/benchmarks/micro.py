@@ -0,0 +1,158 @@
+"""Micro-benchmarks of the engine methods behind each endpoint
+
+For each catalogue size, builds a synthetic recipe log (benchmarks.catalogue)
+and times, in process and without any network:
+
+- startup: streaming the log into a RecipeStore with the TF-IDF prefit,
+  fitting the matcher, saving its artefact and starting again from it
+- RecipeMatcher.find_similar_recipes with no query cache and with a warm one
+- RecipeMatcher.find_similar_rows_batch
+- RecipeMatcher.preprocess_ingredients and add_recipe
+- MealPlanner.generate_weekly_plan
+- NutritionAnalyzer._estimate_nutrition
+
+    cd backend && python -m benchmarks.micro --sizes 1000 10000 100000 --output /tmp/micro.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from benchmarks.catalogue import Vocabulary, sample_queries, synthetic_recipes, write_log
+from caching import LRUCache
+from lexicon import Lexicon
+from matching_engine import RecipeMatcher, StreamingTfidf
+from nutrient_table import NutrientTable
+from nutrition_analyzer import MealPlanner, NutritionAnalyzer
+from recipe_loader import load_recipes
+
+NUTRIENTS = os.path.join(BACKEND_DIR, 'data', 'nutrients.json')
+BATCH_SIZE = 64
+# Meal plans score a candidate pool per call, so fewer are timed
+PLAN_CALLS = 50
+# Timed passes per method; the fastest is kept, as timeit does, since
+# slower passes measure other load on the machine
+REPEAT = 3
+
+def latency(call, inputs, repeat=REPEAT):
+    """p50/p95 in milliseconds and calls per second of call over inputs, best of repeat passes"""
+    best = None
+    for _ in range(repeat):
+        timings = []
+        started = time.perf_counter()
+        for item in inputs:
+            begun = time.perf_counter()
+            call(item)
+            timings.append(time.perf_counter() - begun)
+        elapsed = time.perf_counter() - started
+        timings = np.array(timings) * 1000
+        row = {
+            "calls": len(inputs),
+            "p50_ms": round(float(np.percentile(timings, 50)), 3),
+            "p95_ms": round(float(np.percentile(timings, 95)), 3),
+            "ops_per_s": round(len(inputs) / elapsed, 1),
+        }
+        if best is None or row['ops_per_s'] > best['ops_per_s']:
+            best = row
+    return best
+
+def timed(call):
+    started = time.perf_counter()
+    value = call()
+    return value, round(time.perf_counter() - started, 3)
+
+def run_size(size, queries, seed, workdir, vocabulary):
+    """Results for one catalogue of size recipes"""
+    log_path = write_log(os.path.join(workdir, f'recipes-{size}.jsonl'), size, seed)
+    artifact_dir = os.path.join(workdir, f'artifact-{size}')
+    lexicon = Lexicon()
+    nutrient_table = NutrientTable(NUTRIENTS)
+    results = {}
+
+    prefit = StreamingTfidf(lexicon=lexicon)
+    (store, _), load_s = timed(lambda: load_recipes(log_path, on_chunk=prefit.add_rows))
+    matcher, fit_s = timed(lambda: RecipeMatcher(store, prefit=prefit, lexicon=lexicon, nutrient_table=nutrient_table))
+    _, save_s = timed(lambda: matcher.save_artifacts(artifact_dir))
+    _, reload_s = timed(lambda: RecipeMatcher(store, artifact_path=artifact_dir, lexicon=Lexicon(), nutrient_table=nutrient_table))
+    results['startup'] = {"load_s": load_s, "fit_s": fit_s, "save_artifact_s": save_s, "load_artifact_s": reload_s}
+
+    def search(query):
+        matcher.find_similar_recipes(query['ingredients'], query['top_n'], query['diet_filter'])
+
+    results['find_similar_recipes'] = latency(search, queries)
+    matcher.query_cache = LRUCache(max_entries=len(queries))
+    for query in queries:
+        search(query)
+    results['find_similar_recipes_cached'] = latency(search, queries)
+    matcher.query_cache = None
+
+    batches = [queries[start:start + BATCH_SIZE] for start in range(0, len(queries), BATCH_SIZE)]
+    batch = latency(matcher.find_similar_rows_batch, batches)
+    batch['queries_per_s'] = round(batch['ops_per_s'] * BATCH_SIZE, 1)
+    results['find_similar_rows_batch'] = batch
+
+    results['preprocess_ingredients'] = latency(matcher.preprocess_ingredients, [query['ingredients'] for query in queries])
+
+    planner = MealPlanner(matcher)
+    plans = queries[:PLAN_CALLS]
+    results['generate_weekly_plan'] = latency(
+        lambda query: planner.generate_weekly_plan(query['ingredients'], query['diet_filter']), plans)
+
+    # A bounded memory cache and no Edamam keys: only the estimate is timed
+    analyzer = NutritionAnalyzer(cache=LRUCache(), nutrient_table=nutrient_table)
+    recipes = [recipe['ingredients'] for recipe in synthetic_recipes(len(queries), seed + 1, vocabulary)]
+    results['estimate_nutrition'] = latency(analyzer._estimate_nutrition, recipes)
+
+    # Never refit while timing the incremental path
+    matcher.refit_threshold = float('inf')
+    added = list(synthetic_recipes(len(queries), seed + 2, vocabulary))
+    for i, recipe in enumerate(added):
+        recipe['id'] = size + i + 1
+    results['add_recipe'] = latency(matcher.add_recipe, added, repeat=1)
+    return results
+
+def run(sizes, n_queries=1000, seed=0, workdir=None):
+    """Micro-benchmark results keyed by catalogue size"""
+    vocabulary = Vocabulary()
+    queries = sample_queries(n_queries, seed, vocabulary)
+    owned = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='pantry-bench-')
+    try:
+        results = {}
+        for size in sizes:
+            results[str(size)] = run_size(size, queries, seed, workdir, vocabulary)
+            startup = results[str(size)]['startup']
+            print(f"{size:>8} recipes  load {startup['load_s']:.2f}s  fit {startup['fit_s']:.2f}s  "
+                  f"artefact load {startup['load_artifact_s']:.2f}s")
+            for name, row in results[str(size)].items():
+                if 'p50_ms' in row:
+                    print(f"{'':8}  {name:28} p50={row['p50_ms']:9.3f}ms  p95={row['p95_ms']:9.3f}ms  "
+                          f"{row['ops_per_s']:10.1f}/s")
+        return results
+    finally:
+        if owned:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="catalogue sizes in recipes")
+    parser.add_argument('--queries', type=int, default=1000, help="queries timed per method")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args.sizes, args.queries, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
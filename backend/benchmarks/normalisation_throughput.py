@@ -0,0 +1,164 @@
+"""Throughput of ingredient normalisation and spelling correction
+
+Three measurements:
+
+- index time: Lexicon.normalise over a Zipf-distributed stream of catalogue
+  and lexicon ingredient names, with the name cache disabled and enabled
+- query time: the same with a SpellingIndex over the catalogue's terms and a
+  share of names carrying one random typo, plus how many typos are undone
+- dictionary size: SpellingIndex.correct latency as the dictionary grows,
+  against a linear scan that computes the edit distance to every word
+
+    cd backend && python benchmarks/normalisation_throughput.py --names 200000 --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lexicon import Lexicon, SpellingIndex, allowed_distance, edit_distance
+
+SAMPLE_RECIPES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sample_recipes.json')
+# Share of query names given a typo
+TYPO_SHARE = 0.3
+
+def ingredient_names(lexicon):
+    """Catalogue ingredient names by frequency, then the lexicon's variants"""
+    with open(SAMPLE_RECIPES, 'r', encoding='utf-8') as f:
+        recipes = json.load(f)
+    counts = Counter(str(name).lower() for recipe in recipes for name in recipe.get('ingredients', []))
+    names = [name for name, _ in counts.most_common()]
+    with open(lexicon.path, 'r', encoding='utf-8') as f:
+        synonyms = json.load(f).get('synonyms', {})
+    names.extend(variant for variants in synonyms.values() for variant in variants if variant not in counts)
+    return names
+
+def zipf_stream(names, n, rng):
+    weights = 1.0 / np.arange(1, len(names) + 1) ** 1.1
+    return [names[i] for i in rng.choice(len(names), n, p=weights / weights.sum())]
+
+def typo(word, rng):
+    """word with one random deletion, insertion, substitution or transposition"""
+    i = int(rng.integers(len(word)))
+    kind = rng.choice(['delete', 'insert', 'substitute', 'transpose'])
+    letter = random.Random(int(rng.integers(1 << 30))).choice(string.ascii_lowercase)
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    if kind == 'insert':
+        return word[:i] + letter + word[i:]
+    if kind == 'substitute':
+        return word[:i] + letter + word[i + 1:]
+    i = min(i, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def misspell(name, rng):
+    """name with a typo in its longest word, when that word is long enough to be corrected"""
+    words = name.split()
+    longest = max(range(len(words)), key=lambda i: len(words[i]))
+    if allowed_distance(len(words[longest]) - 1) == 0:
+        return name
+    words[longest] = typo(words[longest], rng)
+    return ' '.join(words)
+
+def names_per_second(lexicon, stream, speller=None):
+    started = time.perf_counter()
+    for name in stream:
+        lexicon.normalise(name, speller)
+    return round(len(stream) / (time.perf_counter() - started))
+
+def catalogue_speller(lexicon, names):
+    """SpellingIndex over the normalised catalogue terms, as RecipeMatcher builds it"""
+    counts = Counter(token for name in names for token in lexicon.normalise(name).split())
+    return lexicon.speller(list(counts), [max(count, 2) for count in counts.values()])
+
+def random_words(n, rng):
+    lengths = rng.integers(4, 12, n)
+    letters = np.array(list(string.ascii_lowercase))
+    return list({''.join(letters[rng.integers(0, 26, length)]) for length in lengths})
+
+def linear_correct(words, token):
+    limit = allowed_distance(len(token))
+    best = None
+    for word in words:
+        distance = edit_distance(token, word, limit)
+        if distance <= limit and (best is None or distance < best[0]):
+            best = (distance, word)
+    return best and best[1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--names', type=int, default=200000, help="names normalised per measurement")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help="spelling dictionary sizes")
+    parser.add_argument('--queries', type=int, default=2000, help="corrections timed per dictionary size")
+    parser.add_argument('--scan-queries', type=int, default=50, help="corrections timed with the linear scan")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    lexicon = Lexicon()
+    names = ingredient_names(lexicon)
+    stream = zipf_stream(names, args.names, rng)
+    results = {"distinct_names": len(names)}
+
+    results['index'] = {
+        "uncached_names_per_s": names_per_second(Lexicon(cache_size=0), stream),
+        "cached_names_per_s": names_per_second(Lexicon(), stream),
+    }
+    print(f"index time  uncached {results['index']['uncached_names_per_s']:>9} names/s  "
+          f"cached {results['index']['cached_names_per_s']:>9} names/s")
+
+    speller = catalogue_speller(lexicon, names)
+    queries = [misspell(name, rng) if rng.random() < TYPO_SHARE else name for name in stream]
+    results['query'] = {
+        "dictionary_words": len(speller),
+        "uncached_names_per_s": names_per_second(Lexicon(cache_size=0), queries, speller),
+        "cached_names_per_s": names_per_second(Lexicon(), queries, speller),
+    }
+    typos = [(name, misspell(name, rng)) for name in names]
+    typos = [(name, misspelt) for name, misspelt in typos if misspelt != name]
+    fixed = sum(lexicon.normalise(misspelt, speller) == lexicon.normalise(name) for name, misspelt in typos)
+    results['query']['typos_corrected'] = round(fixed / len(typos), 4)
+    print(f"query time  uncached {results['query']['uncached_names_per_s']:>9} names/s  "
+          f"cached {results['query']['cached_names_per_s']:>9} names/s  "
+          f"typos corrected {results['query']['typos_corrected']:.1%} of {len(typos)}")
+
+    results['dictionary'] = {}
+    for size in args.sizes:
+        words = random_words(size, rng)
+        started = time.perf_counter()
+        index = SpellingIndex((word, 1) for word in words)
+        built = time.perf_counter() - started
+        probes = [typo(words[i], rng) for i in rng.integers(0, len(words), args.queries)]
+        started = time.perf_counter()
+        for probe in probes:
+            index.correct(probe)
+        indexed_us = (time.perf_counter() - started) / len(probes) * 1e6
+        started = time.perf_counter()
+        for probe in probes[:args.scan_queries]:
+            linear_correct(words, probe)
+        scan_us = (time.perf_counter() - started) / min(len(probes), args.scan_queries) * 1e6
+        row = {
+            "words": len(words),
+            "deletes": len(index.deletes),
+            "build_s": round(built, 2),
+            "correct_us": round(indexed_us, 1),
+            "linear_scan_us": round(scan_us, 1),
+        }
+        results['dictionary'][size] = row
+        print(f"{len(words):>8} words  {row['deletes']:>9} deletes  built in {row['build_s']:6.2f}s  "
+              f"correct {row['correct_us']:8.1f}us  linear scan {row['linear_scan_us']:10.1f}us")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Run the benchmark suite and optionally check it against a baseline
+
+Runs benchmarks.micro over --sizes and benchmarks.http_load over one
+catalogue of --http-size recipes, writes everything to --output with the
+machine and commit it ran on, and compares it with --baseline (see
+benchmarks.compare). Everything runs offline: catalogues are synthetic and
+OpenAI and Edamam are local stubs.
+
+    cd backend && python -m benchmarks.run --output /tmp/bench.json --baseline benchmarks/baseline.json
+
+Record a new baseline on the machine that will run the comparisons with
+--update-baseline; timings from different machines are not comparable.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from benchmarks import compare, http_load, micro
+
+BASELINE_PATH = os.path.join(BACKEND_DIR, 'benchmarks', 'baseline.json')
+# Run to run, in-process timings on a quiet single-core VM move by up to
+# 30%; wall-clock HTTP figures and the single-pass startup and add_recipe
+# timings by more
+DEFAULT_THRESHOLDS = {
+    '*': 0.35,
+    'http.*': 0.4,
+    'micro.*.startup.*': 0.5,
+    'micro.*.add_recipe.*': 0.5,
+}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def meta(args):
+    return {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "sizes": args.sizes,
+        "queries": args.queries,
+        "http_size": args.http_size,
+        "http_requests": args.requests,
+        "concurrency": args.concurrency,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="micro-benchmark catalogue sizes")
+    parser.add_argument('--queries', type=int, default=1000, help="queries timed per engine method")
+    parser.add_argument('--http-size', type=int, default=10000, help="catalogue size for the HTTP scenarios; 0 skips them")
+    parser.add_argument('--requests', type=int, default=500, help="requests per HTTP scenario")
+    parser.add_argument('--concurrency', type=int, default=8, help="HTTP client threads")
+    parser.add_argument('--server', default='gunicorn-sync', choices=list(http_load.SERVERS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare results with this baseline JSON")
+    parser.add_argument('--threshold', action='append', metavar='PATTERN=FRACTION',
+                        help="override a regression threshold (repeatable)")
+    parser.add_argument('--update-baseline', action='store_true', help=f"write the results to {BASELINE_PATH}")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {"meta": meta(args)}
+    results['micro'] = micro.run(args.sizes, args.queries, args.seed)
+    if args.http_size:
+        results['http'] = http_load.run(args.http_size, args.requests, args.concurrency, args.seed, args.server)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        previous = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, 'r') as f:
+                previous = json.load(f)
+        # Keep thresholds tuned by hand across re-recordings
+        results['thresholds'] = previous.get('thresholds', DEFAULT_THRESHOLDS)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {BASELINE_PATH}")
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('platform') != results['meta']['platform']:
+            print("Baseline was recorded on a different platform; expect timing differences")
+        rows = compare.compare(results, baseline, compare.parse_thresholds(args.threshold))
+        if compare.report(rows):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Search latency and throughput of ShardedMatcher from 1 to N shards
+
+Builds a synthetic catalogue, fits one RecipeMatcher on it, then answers
+the same queries with the plain matcher and with ShardedMatcher at each
+shard count: single queries for p50/p99 latency and batches for
+throughput. Every sharded answer is checked against the matcher's.
+
+    cd backend && python benchmarks/sharded_scaling.py --recipes 1000000 --shards 1 2 4 8
+
+Shards only run in parallel on as many cores as the machine has, so
+counts beyond os.cpu_count() show the cost of the extra processes.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from matching_engine import RecipeMatcher
+from recipe_store import RecipeStore
+from sharded_matcher import ShardedMatcher
+
+BASES = [
+    'chicken', 'beef', 'pork', 'lamb', 'tofu', 'paneer', 'shrimp', 'salmon', 'cod', 'egg',
+    'rice', 'pasta', 'noodle', 'quinoa', 'couscous', 'potato', 'tomato', 'onion', 'garlic', 'ginger',
+    'spinach', 'kale', 'cabbage', 'carrot', 'pepper', 'chili', 'lentil', 'chickpea', 'bean', 'pea',
+    'mushroom', 'zucchini', 'eggplant', 'corn', 'squash', 'cheese', 'yogurt', 'cream', 'butter', 'milk',
+    'basil', 'cilantro', 'mint', 'parsley', 'cumin', 'turmeric', 'paprika', 'oregano', 'thyme', 'lemon',
+]
+MODIFIERS = [
+    '', 'fresh', 'dried', 'smoked', 'roasted', 'ground', 'red', 'green', 'baby', 'wild',
+    'sweet', 'spicy', 'pickled', 'frozen', 'organic', 'black', 'white', 'toasted', 'chopped', 'sliced',
+]
+TOPICS = 40
+TOPIC_POOL = 60
+
+def synthetic_recipes(n_recipes, seed):
+    """Seeded recipes whose ingredients mostly come from one of TOPICS pools"""
+    rng = random.Random(seed)
+    names = [f"{modifier} {base}".strip() for modifier in MODIFIERS for base in BASES]
+    pools = [rng.sample(names, TOPIC_POOL) for _ in range(TOPICS)]
+    for i in range(n_recipes):
+        pool = pools[rng.randrange(TOPICS)]
+        count = rng.randint(5, 12)
+        ingredients = rng.sample(pool, count - 2) + rng.sample(names, 2)
+        yield {
+            "id": i + 1,
+            "title": f"Recipe {i + 1}",
+            "ingredients": ingredients,
+            "instructions": ["Cook"],
+            "cooking_time": rng.randint(10, 90),
+            "difficulty": "medium",
+        }, names
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+def measure(searcher, queries, batch_size):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        searcher.find_similar_rows(query['ingredients'], query['top_n'], query['diet_filter'])
+        latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        searcher.find_similar_rows_batch(queries[start:start + batch_size])
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "single_qps": round(len(queries) / sum(latencies), 1),
+        "batch_qps": round(len(queries) / elapsed, 1),
+    }
+
+def agrees(matcher, sharded, queries):
+    """Whether sharded scores equal the matcher's, rows included above any tie at the cut-off"""
+    for query in queries:
+        args = (query['ingredients'], query['top_n'], query['diet_filter'])
+        rows, scores = matcher.find_similar_rows(*args)
+        sharded_rows, sharded_scores = sharded.find_similar_rows(*args)
+        strict = scores > scores[-1] if len(scores) else scores > 0
+        if not (np.allclose(scores, sharded_scores) and np.array_equal(rows[strict], sharded_rows[strict])):
+            return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=1000000)
+    parser.add_argument('--shards', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=64, help="queries per find_similar_rows_batch call")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = RecipeStore()
+    names = None
+    for recipe, names in synthetic_recipes(args.recipes, args.seed):
+        store.append(recipe)
+    loaded = time.perf_counter()
+    matcher = RecipeMatcher(store)
+    fitted = time.perf_counter()
+    print(f"{args.recipes} recipes: generated in {loaded - started:.1f}s, fitted in {fitted - loaded:.1f}s "
+          f"on {os.cpu_count()} cores")
+
+    rng = random.Random(args.seed + 1)
+    queries = [
+        {"ingredients": rng.sample(names, rng.randint(2, 4)), "top_n": 10,
+         "diet_filter": rng.choice([None, None, 'vegetarian', 'vegan'])}
+        for _ in range(args.queries)
+    ]
+
+    results = {"unsharded": measure(matcher, queries, args.batch)}
+    row = results['unsharded']
+    print(f"{'unsharded':10} p50={row['p50_ms']:8.2f}ms  p99={row['p99_ms']:8.2f}ms  "
+          f"single={row['single_qps']:8.1f} q/s  batch={row['batch_qps']:8.1f} q/s")
+    for n_shards in args.shards:
+        sharded = ShardedMatcher(matcher, n_shards)
+        try:
+            row = measure(sharded, queries, args.batch)
+            row['agrees'] = agrees(matcher, sharded, queries[:50])
+        finally:
+            sharded.close()
+        results[n_shards] = row
+        print(f"{n_shards:>3} shards  p50={row['p50_ms']:8.2f}ms  p99={row['p99_ms']:8.2f}ms  "
+              f"single={row['single_qps']:8.1f} q/s  batch={row['batch_qps']:8.1f} q/s  agrees={row['agrees']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"recipes": args.recipes, "cores": os.cpu_count(), "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
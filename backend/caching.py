@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import sampled
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Thread-safe in-process cache with size- and TTL-based eviction
+
+    Entries can carry a version; a lookup with a different version is a miss,
+    which lets callers invalidate everything by bumping the version. An
+    optional shared backend (e.g. SQLiteCache) is consulted on local misses
+    and written through on every set, so several processes can share results.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    def get(self, key, version=None):
+        """Cached value for key at version, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_version, value = entry
+                if entry_version == version and (expires_at is None or expires_at > now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.backend is not None:
+            value = self.backend.get(key, version)
+            if value is not None:
+                self._store(key, value, version)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, version=None):
+        self._store(key, value, version)
+        if self.backend is not None:
+            self.backend.set(key, value, version)
+
+    def _store(self, key, value, version):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+class SQLiteCache:
+    """Cache shared between processes through a local SQLite file in WAL mode
+
+    Values must be JSON-serialisable. Expired rows and rows beyond
+    max_entries (oldest first) are pruned every prune_every writes.
+    """
+
+    def __init__(self, path, max_entries=100000, ttl=None, prune_every=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, version TEXT, expires_at REAL, stored_at REAL, value TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, version=None):
+        try:
+            row = self._connection().execute(
+                "SELECT version, expires_at, value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            sampled(logger, logging.WARNING, "Shared cache read failed: %s", e)
+            return None
+        if row is None:
+            return None
+        entry_version, expires_at, value = row
+        if entry_version != _version_text(version) or (expires_at is not None and expires_at <= time.time()):
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, version=None):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, version, expires_at, stored_at, value) VALUES (?, ?, ?, ?, ?)",
+                    (key, _version_text(version), expires_at, now, json.dumps(value))
+                )
+        except sqlite3.Error as e:
+            sampled(logger, logging.WARNING, "Shared cache write failed: %s", e)
+            return
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows and the oldest rows beyond max_entries"""
+        try:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            sampled(logger, logging.WARNING, "Shared cache prune failed: %s", e)
+
+def _version_text(version):
+    return None if version is None else str(version)
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines sharing one event loop
+
+    Waiters await the leader's task instead of blocking a thread. Cancelling
+    a waiter does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Fail fast after repeated errors from an upstream service
+
+    After failure_threshold consecutive failures the breaker opens and
+    allow() returns False for reset_timeout seconds. It then lets a single
+    trial call through; success closes it again, failure re-opens it.
+    Callers that fan out several calls under one allow() should make just
+    one while probing is True.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    @property
+    def probing(self):
+        """Whether the single trial call of a half-open breaker is in flight"""
+        with self._lock:
+            return self._trial_running
+
+    def allow(self):
+        """Whether a call may be attempted now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuit opened after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_running = False
@@ -0,0 +1,214 @@
+"""Recipe clusters for discovery
+
+Recipes are clustered on their L2-normalised TF-IDF rows with a spherical
+mini-batch k-means: centroids are unit vectors and points join the centroid
+with the highest cosine similarity. Each step only reads a sampled batch of
+rows, so fitting cost depends on the number of steps rather than the
+catalogue size, and partial_fit() folds new recipes in one at a time.
+
+RecipeClusters keeps what /api/clusters serves precomputed: the members of
+each cluster ordered by closeness to its centroid, the top terms of each
+centroid and its most representative recipes.
+"""
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import kmeans_plusplus
+from sklearn.metrics import silhouette_score
+
+MIN_CLUSTERS = 2
+MAX_CLUSTERS = 200
+BATCH_SIZE = 2048
+# Mini-batch steps are about this many passes over the catalogue, capped
+EPOCHS = 3
+MAX_STEPS = 300
+# Rows used to compare candidate cluster counts when none is configured
+AUTO_K_SAMPLE = 4000
+TOP_TERMS = 8
+REPRESENTATIVES = 5
+# Rows scored against the centroids per step when assigning the catalogue
+ASSIGN_CHUNK = 20000
+
+def default_cluster_count(n_rows):
+    """sqrt(n / 2), the usual rule of thumb, within [MIN_CLUSTERS, MAX_CLUSTERS]"""
+    return int(np.clip(round(np.sqrt(n_rows / 2)), MIN_CLUSTERS, MAX_CLUSTERS))
+
+class SphericalMiniBatchKMeans:
+    """k-means on unit-length rows by cosine similarity, trained on mini-batches
+
+    Centroids move towards each batch's members with a per-centroid rate of
+    1 / (points seen), as in Sculley's mini-batch k-means, and are renormalised
+    after every step. counts carries over to partial_fit(), so a recipe added
+    later moves its centroid as much as any one recipe did during fit().
+    """
+
+    def __init__(self, n_clusters, batch_size=BATCH_SIZE, seed=42):
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.seed = seed
+        self.centers = None
+        self.counts = None
+
+    def fit(self, X):
+        rng = np.random.default_rng(self.seed)
+        n = X.shape[0]
+        sample = X[rng.choice(n, min(n, max(10 * self.n_clusters, self.batch_size)), replace=False)]
+        centers, _ = kmeans_plusplus(sample, self.n_clusters, random_state=self.seed)
+        self.centers = self._normalise(np.asarray(centers, dtype=np.float32))
+        self.counts = np.zeros(self.n_clusters, dtype=np.float64)
+
+        steps = min(MAX_STEPS, max(10, EPOCHS * -(-n // self.batch_size)))
+        for _ in range(steps):
+            self._update(X[rng.choice(n, min(n, self.batch_size), replace=False)])
+        return self
+
+    def partial_fit(self, X):
+        """Move the centroids towards X; returns X's (labels, similarities) before the move"""
+        return self._update(X)
+
+    def _normalise(self, centers):
+        norms = np.linalg.norm(centers, axis=1, keepdims=True)
+        return centers / np.maximum(norms, 1e-12)
+
+    def _update(self, X):
+        labels, similarities = self.predict(X)
+        batch_counts = np.bincount(labels, minlength=self.n_clusters)
+        touched = np.flatnonzero(batch_counts)
+        # Sum of the batch's rows per touched centroid, as one sparse product
+        membership = sp.csr_matrix(
+            (np.ones(len(labels), dtype=np.float32), (np.searchsorted(touched, labels), np.arange(len(labels)))),
+            shape=(len(touched), X.shape[0])
+        )
+        sums = membership @ X
+        sums = sums.toarray() if sp.issparse(sums) else np.asarray(sums)
+
+        self.counts[touched] += batch_counts[touched]
+        rates = (batch_counts[touched] / self.counts[touched])[:, None]
+        means = sums / batch_counts[touched][:, None]
+        self.centers[touched] = self._normalise((1 - rates) * self.centers[touched] + rates * means)
+        return labels, similarities
+
+    def predict(self, X):
+        """(nearest centroid, cosine similarity to it) for each row of X"""
+        labels = np.empty(X.shape[0], dtype=np.int32)
+        similarities = np.empty(X.shape[0], dtype=np.float32)
+        for start in range(0, X.shape[0], ASSIGN_CHUNK):
+            scores = np.asarray(X[start:start + ASSIGN_CHUNK] @ self.centers.T)
+            labels[start:start + ASSIGN_CHUNK] = scores.argmax(axis=1)
+            similarities[start:start + ASSIGN_CHUNK] = scores.max(axis=1)
+        return labels, similarities
+
+def choose_cluster_count(X, seed=42):
+    """The candidate around default_cluster_count with the best silhouette on a sample"""
+    n = X.shape[0]
+    base = default_cluster_count(n)
+    rng = np.random.default_rng(seed)
+    sample = X[rng.choice(n, min(n, AUTO_K_SAMPLE), replace=False)]
+    best, best_score = base, -1.0
+    for k in sorted({max(MIN_CLUSTERS, base // 2), base, min(MAX_CLUSTERS, base * 2)}):
+        if k >= sample.shape[0]:
+            continue
+        labels, _ = SphericalMiniBatchKMeans(k, seed=seed).fit(sample).predict(sample)
+        if len(np.unique(labels)) < 2:
+            continue
+        score = silhouette_score(sample, labels, metric='cosine', random_state=seed)
+        if score > best_score:
+            best, best_score = k, score
+    return best
+
+class RecipeClusters:
+    """Fitted clusters of catalogue rows plus the payloads served about them
+
+    terms maps TF-IDF columns to terms, for the top terms of each centroid.
+    """
+
+    def __init__(self, model, labels, similarities, terms):
+        self.model = model
+        self.terms = terms
+        self.labels = labels
+        self.similarities = similarities
+        self._index()
+
+    @classmethod
+    def fit(cls, vectors, terms, n_clusters=None, seed=42):
+        """Cluster the rows of vectors; n_clusters None picks the count from a sample"""
+        n_clusters = min(n_clusters or choose_cluster_count(vectors, seed), vectors.shape[0])
+        model = SphericalMiniBatchKMeans(n_clusters, seed=seed).fit(vectors)
+        labels, similarities = model.predict(vectors)
+        return cls(model, labels, similarities, terms)
+
+    @classmethod
+    def from_arrays(cls, arrays, terms):
+        """Clusters saved by arrays(), or None if the artefact has none"""
+        if arrays.get('cluster_centers') is None or arrays.get('cluster_counts') is None:
+            return None
+        model = SphericalMiniBatchKMeans(len(arrays['cluster_centers']))
+        # partial_fit writes to both, so they are copied out of the mapping
+        model.centers = np.array(arrays['cluster_centers'], dtype=np.float32)
+        model.counts = np.array(arrays['cluster_counts'], dtype=np.float64)
+        return cls(model, arrays['recipe_clusters'], arrays['cluster_similarities'], terms)
+
+    def arrays(self):
+        return {
+            'recipe_clusters': self.labels,
+            'cluster_similarities': self.similarities,
+            'cluster_centers': self.model.centers,
+            'cluster_counts': self.model.counts,
+        }
+
+    @property
+    def n_clusters(self):
+        return self.model.n_clusters
+
+    def _index(self):
+        """Group the fitted rows by cluster, closest to the centroid first"""
+        labels = np.asarray(self.labels)
+        order = np.lexsort((-np.asarray(self.similarities), labels))
+        self.member_rows = order
+        self.member_offsets = np.zeros(self.n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=self.n_clusters), out=self.member_offsets[1:])
+        # Rows added since the fit, per cluster, in the order they came
+        self.added_members = {}
+        self.top_terms = [self._top_terms(cluster) for cluster in range(self.n_clusters)]
+
+    def _top_terms(self, cluster):
+        center = self.model.centers[cluster]
+        count = min(TOP_TERMS, int((center > 0).sum()))
+        if count == 0:
+            return []
+        top = np.argpartition(-center, count - 1)[:count]
+        return [self.terms[column] for column in top[np.argsort(-center[top])]]
+
+    def add(self, row, vector):
+        """Assign a row added after the fit (vector holds only fitted columns) and fold it in"""
+        labels, similarities = self.model.partial_fit(vector)
+        cluster = int(labels[0])
+        self.labels = np.append(self.labels, cluster)
+        self.similarities = np.append(self.similarities, similarities[0])
+        self.added_members.setdefault(cluster, []).append(row)
+        self.top_terms[cluster] = self._top_terms(cluster)
+        return cluster
+
+    def size(self, cluster):
+        fitted = self.member_offsets[cluster + 1] - self.member_offsets[cluster]
+        return int(fitted) + len(self.added_members.get(cluster, ()))
+
+    def members(self, cluster, start, stop):
+        """Rows [start, stop) of a cluster: fitted members by closeness, then added ones"""
+        begin, end = self.member_offsets[cluster], self.member_offsets[cluster + 1]
+        fitted = self.member_rows[begin + min(start, end - begin):begin + min(stop, end - begin)]
+        added = self.added_members.get(cluster, [])[max(0, start - (end - begin)):max(0, stop - (end - begin))]
+        return np.concatenate([fitted, np.asarray(added, dtype=np.int64)]).astype(np.int64)
+
+    def summary(self, cluster):
+        """Size, top terms and representative rows of one cluster"""
+        return {
+            'id': cluster,
+            'size': self.size(cluster),
+            'top_terms': self.top_terms[cluster],
+            'representatives': self.members(cluster, 0, REPRESENTATIVES),
+        }
+
+    def summaries(self):
+        """summary() of every non-empty cluster, largest first"""
+        clusters = sorted(range(self.n_clusters), key=lambda cluster: (-self.size(cluster), cluster))
+        return [self.summary(cluster) for cluster in clusters if self.size(cluster)]
@@ -0,0 +1,347 @@
+"""Dense ingredient embeddings and an approximate nearest-neighbour index
+
+Embeddings come from the catalogue itself: a PPMI-weighted ingredient
+co-occurrence matrix is factorised with a truncated SVD, so ingredients
+used in the same kinds of recipes ("prawns" and "shrimp") end up close
+together even though they never share a TF-IDF term. A recipe is the
+idf-weighted mean of its ingredients' embeddings.
+
+Recipe vectors are searched with an inverted-file (IVF) index: spherical
+k-means splits them into n_lists cells and a query only scans the n_probe
+cells whose centroids are closest. n_probe is the recall/latency trade-off;
+n_probe == n_lists is an exact search.
+"""
+import numpy as np
+import scipy.sparse as sp
+from sklearn.utils.extmath import randomized_svd
+
+from recipe_store import grow_array
+
+EMBEDDING_DIM = 64
+DEFAULT_N_PROBE = 8
+# k-means trains on this many sampled vectors per list, not the whole catalogue
+TRAIN_POINTS_PER_LIST = 32
+KMEANS_ITERATIONS = 10
+# Vectors scored per step when assigning them to lists
+ASSIGN_CHUNK = 16384
+
+def normalise_rows(matrix):
+    """L2-normalise the rows of a dense matrix; zero rows stay zero"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def ingredient_idf(incidence):
+    """Smoothed idf per ingredient column of a binary recipe-by-ingredient matrix"""
+    n_rows = incidence.shape[0]
+    document_frequency = np.bincount(incidence.indices, minlength=incidence.shape[1])
+    return np.log((1 + n_rows) / (1 + document_frequency)) + 1
+
+def cooccurrence_embeddings(incidence, dim=EMBEDDING_DIM, seed=0):
+    """Unit-length ingredient embeddings from a binary recipe-by-ingredient CSR matrix
+
+    Pairs are counted over recipes, reweighted by positive pointwise mutual
+    information and factorised; rows are U * sqrt(S) of the truncated SVD.
+    Ingredients that never share a recipe with another get a zero vector.
+    """
+    n_ingredients = incidence.shape[1]
+    counts = (incidence.T @ incidence).tocoo()
+    off_diagonal = counts.row != counts.col
+    rows, columns, values = counts.row[off_diagonal], counts.col[off_diagonal], counts.data[off_diagonal].astype(np.float64)
+    embeddings = np.zeros((n_ingredients, dim), dtype=np.float32)
+    if not len(values):
+        return embeddings
+
+    marginals = np.bincount(rows, weights=values, minlength=n_ingredients)
+    # Context counts smoothed as in word2vec, which damps rare-ingredient PMI
+    contexts = marginals ** 0.75
+    pmi = np.log(values * contexts.sum() / (marginals[rows] * contexts[columns]))
+    keep = pmi > 0
+    ppmi = sp.csr_matrix((pmi[keep], (rows[keep], columns[keep])), shape=(n_ingredients, n_ingredients))
+
+    components = min(dim, n_ingredients - 1)
+    if components < 1 or ppmi.nnz == 0:
+        return embeddings
+    u, s, _ = randomized_svd(ppmi, components, random_state=seed)
+    embeddings[:, :components] = u * np.sqrt(s)
+    return normalise_rows(embeddings).astype(np.float32)
+
+def embed_rows(incidence, embeddings, idf):
+    """Unit-length idf-weighted mean embedding of each incidence row"""
+    weighted = incidence @ sp.diags(idf)
+    return normalise_rows(np.asarray(weighted @ embeddings, dtype=np.float32))
+
+def spherical_kmeans(vectors, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Unit-length centroids of unit-length vectors, clustered by cosine similarity"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.flatnonzero(~sums.any(axis=1))
+        # Reseed empty cells with random vectors rather than losing them
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalise_rows(sums).astype(vectors.dtype)
+    return centroids
+
+class IVFIndex:
+    """Inverted-file index over unit-length vectors, scored by inner product
+
+    Vectors are stored grouped by list, so probing a list scans one
+    contiguous block. Rows added after fit() go to a small buffer that every
+    search scans in full, the same way the matcher treats recipes added
+    since its last fit.
+    """
+
+    def __init__(self, n_lists=None, n_probe=DEFAULT_N_PROBE, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        # Vectors of list l are list_vectors[list_offsets[l]:list_offsets[l + 1]]
+        self.list_offsets = None
+        self.list_rows = None
+        self.list_vectors = None
+        self._reset_added()
+
+    def _reset_added(self):
+        self.added_rows = np.empty(0, dtype=np.int64)
+        self.added_vectors = None
+        # Buffers behind added_rows and added_vectors, grown geometrically
+        self._row_buffer = self.added_rows
+        self._vector_buffer = None
+        self._positions = None
+
+    def __len__(self):
+        fitted = 0 if self.list_rows is None else len(self.list_rows)
+        return fitted + len(self.added_rows)
+
+    def fit(self, vectors):
+        """Cluster vectors (row i is row i of the catalogue) and build the lists"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        n_lists = min(n, self.n_lists or max(1, int(round(np.sqrt(n)))))
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[rng.choice(n, min(n, n_lists * TRAIN_POINTS_PER_LIST), replace=False)]
+        centroids = spherical_kmeans(sample, n_lists, seed=self.seed) if n_lists else np.empty((0, vectors.shape[1]), dtype=np.float32)
+
+        labels = np.empty(n, dtype=np.int64)
+        for start in range(0, n, ASSIGN_CHUNK):
+            labels[start:start + ASSIGN_CHUNK] = np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        self.set_lists(centroids, offsets, order, vectors[order])
+        return self
+
+    def set_lists(self, centroids, list_offsets, list_rows, list_vectors):
+        """Adopt fitted lists, e.g. memory-mapped from an artefact"""
+        self.centroids = centroids
+        self.n_lists = len(centroids)
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.list_vectors = list_vectors
+        self._reset_added()
+
+    def add(self, row, vector):
+        """Make one more row searchable without refitting"""
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        size = len(self.added_rows)
+        if self._vector_buffer is None:
+            self._vector_buffer = np.empty((0, len(vector)), dtype=np.float32)
+        self._row_buffer = grow_array(self._row_buffer, size + 1)
+        self._vector_buffer = grow_array(self._vector_buffer, size + 1)
+        self._row_buffer[size] = row
+        self._vector_buffer[size] = vector
+        self.added_rows = self._row_buffer[:size + 1]
+        self.added_vectors = self._vector_buffer[:size + 1]
+
+    def vectors_of(self, rows):
+        """Stored vectors of the given rows, in that order"""
+        if self._positions is None:
+            # Position of each fitted row inside list_vectors
+            positions = np.empty(len(self.list_rows), dtype=np.int64)
+            positions[self.list_rows] = np.arange(len(self.list_rows))
+            self._positions = positions
+        rows = np.asarray(rows, dtype=np.int64)
+        fitted = len(self.list_rows)
+        result = np.zeros((len(rows), self.list_vectors.shape[1]), dtype=np.float32)
+        in_lists = rows < fitted
+        result[in_lists] = self.list_vectors[self._positions[rows[in_lists]]]
+        if self.added_vectors is not None and not in_lists.all():
+            lookup = {int(row): i for i, row in enumerate(self.added_rows)}
+            for i in np.flatnonzero(~in_lists):
+                position = lookup.get(int(rows[i]))
+                if position is not None:
+                    result[i] = self.added_vectors[position]
+        return result
+
+    def search(self, query, k, n_probe=None, allowed=None):
+        """(rows, scores) of the k best rows by inner product, best first
+
+        allowed is an optional boolean mask over rows; rows outside it are
+        skipped while scanning, so filtered searches still return k results
+        when the probed lists hold that many.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        n_probe = min(self.n_lists, n_probe or self.n_probe)
+        if n_probe < self.n_lists:
+            probe = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        else:
+            probe = range(self.n_lists)
+
+        row_blocks, score_blocks = [], []
+        for cell in probe:
+            start, end = self.list_offsets[cell], self.list_offsets[cell + 1]
+            if start == end:
+                continue
+            rows = self.list_rows[start:end]
+            vectors = self.list_vectors[start:end]
+            if allowed is not None:
+                keep = allowed[rows]
+                rows, vectors = rows[keep], vectors[keep]
+            row_blocks.append(rows)
+            score_blocks.append(vectors @ query)
+        if self.added_vectors is not None:
+            rows, vectors = self.added_rows, self.added_vectors
+            if allowed is not None:
+                keep = allowed[rows]
+                rows, vectors = rows[keep], vectors[keep]
+            row_blocks.append(rows)
+            score_blocks.append(vectors @ query)
+
+        if not row_blocks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(row_blocks)
+        scores = np.concatenate(score_blocks)
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.lexsort((rows, -scores))
+        return rows[order], scores[order]
+
+class DenseRetriever:
+    """Co-occurrence embeddings for a RecipeStore plus an IVF index of its recipes
+
+    Ingredient names are matched case-insensitively, after normalise (e.g.
+    Lexicon.normalise) when one is given; queries are expected to be
+    normalised the same way. Recipes added after fitting are embedded from
+    the ingredients the fit already knows.
+    """
+
+    def __init__(self, store, dim=EMBEDDING_DIM, n_lists=None, n_probe=DEFAULT_N_PROBE, seed=0, normalise=None):
+        self.store = store
+        self.normalise = normalise
+        self.dim = dim
+        self.seed = seed
+        self.index = IVFIndex(n_lists, n_probe, seed)
+        self.vocabulary = {}
+        # Store ingredient id -> embedding column, -1 for names first seen after the fit
+        self.columns = np.empty(0, dtype=np.int64)
+        self.embeddings = None
+        self.idf = None
+
+    def _name_key(self, name):
+        key = str(name).strip().lower()
+        return self.normalise(key) if self.normalise is not None else key
+
+    def _map_names(self):
+        columns = [
+            self.vocabulary.setdefault(self._name_key(name), len(self.vocabulary))
+            for name in self.store.ingredient_names
+        ]
+        self.columns = np.array(columns, dtype=np.int64)
+
+    def incidence(self, start, stop):
+        """Binary recipe-by-ingredient matrix of store rows [start, stop)"""
+        offsets = self.store.ingredient_offsets[start:stop + 1]
+        ids = self.store.ingredient_ids[offsets[0]:offsets[-1]]
+        columns = np.full(len(ids), -1, dtype=np.int64)
+        known = ids < len(self.columns)
+        columns[known] = self.columns[ids[known]]
+        row_of = np.repeat(np.arange(stop - start), np.diff(offsets))
+        keep = columns >= 0
+        matrix = sp.csr_matrix(
+            (np.ones(int(keep.sum()), dtype=np.float32), (row_of[keep], columns[keep])),
+            shape=(stop - start, len(self.vocabulary))
+        )
+        # Repeated ingredients count once
+        matrix.data[:] = 1.0
+        return matrix
+
+    def fit(self, n_rows):
+        """Embed ingredients and recipes of store rows [0, n_rows) and index them"""
+        self._map_names()
+        incidence = self.incidence(0, n_rows)
+        self.idf = ingredient_idf(incidence)
+        self.embeddings = cooccurrence_embeddings(incidence, self.dim, self.seed)
+        self.index.fit(embed_rows(incidence, self.embeddings, self.idf))
+        return self
+
+    def arrays(self):
+        """Fitted state as named arrays for the index artefact"""
+        return {
+            'dense_columns': self.columns,
+            'dense_embeddings': self.embeddings,
+            'dense_idf': self.idf,
+            'dense_centroids': self.index.centroids,
+            'dense_list_offsets': self.index.list_offsets,
+            'dense_list_rows': self.index.list_rows,
+            'dense_list_vectors': self.index.list_vectors,
+        }
+
+    def load(self, arrays):
+        """Adopt state saved by arrays(); False if any array is missing or the wrong shape"""
+        if any(arrays.get(name) is None for name in self.arrays()):
+            return False
+        if arrays['dense_embeddings'].shape[1] != self.dim:
+            return False
+        self.columns = np.asarray(arrays['dense_columns'])
+        self.vocabulary = {}
+        for name, column in zip(self.store.ingredient_names, self.columns):
+            self.vocabulary.setdefault(self._name_key(name), int(column))
+        self.embeddings = arrays['dense_embeddings']
+        self.idf = arrays['dense_idf']
+        self.index.set_lists(
+            arrays['dense_centroids'], arrays['dense_list_offsets'],
+            arrays['dense_list_rows'], arrays['dense_list_vectors']
+        )
+        return True
+
+    def add_row(self, row):
+        self.index.add(row, embed_rows(self.incidence(row, row + 1), self.embeddings, self.idf)[0])
+
+    def _ingredient_columns(self, ingredient):
+        """Embedding columns for one query ingredient
+
+        The whole name if the catalogue uses it, else each word of it that
+        is an ingredient on its own ("boneless chicken thighs" -> chicken),
+        trying a trailing plural s both ways.
+        """
+        name = ingredient.strip().lower()
+        for candidate in (name, name[:-1] if name.endswith('s') else name + 's'):
+            if candidate in self.vocabulary:
+                return [self.vocabulary[candidate]]
+        columns = []
+        for word in name.split():
+            for candidate in (word, word[:-1] if word.endswith('s') else word + 's'):
+                if candidate in self.vocabulary:
+                    columns.append(self.vocabulary[candidate])
+                    break
+        return columns
+
+    def encode_query(self, ingredients):
+        """Unit-length query vector for a list of ingredient names; zero if none are known"""
+        columns = sorted({column for ingredient in ingredients for column in self._ingredient_columns(ingredient)})
+        if not columns:
+            return np.zeros(self.dim, dtype=np.float32)
+        vector = self.idf[columns] @ self.embeddings[columns]
+        norm = np.linalg.norm(vector)
+        return (vector / norm).astype(np.float32) if norm > 0 else np.zeros(self.dim, dtype=np.float32)
+
+    def search(self, query_vector, k, n_probe=None, allowed=None):
+        return self.index.search(query_vector, k, n_probe, allowed)
+
+    def similarities(self, query_vector, rows):
+        """Exact cosine similarity of query_vector to each of rows"""
+        return self.index.vectors_of(rows) @ query_vector
@@ -1,46 +1,338 @@
+import asyncio
 import openai
 import os
+import copy
+import hashlib
 import json
+import logging
+import threading
+import time
+from caching import AsyncSingleFlight, LRUCache, SQLiteCache, SingleFlight
+from metrics import stage, REGISTRY
+from stream_parser import IncrementalRecipeParser
 from dotenv import load_dotenv
 
 load_dotenv()
 
+MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "You are a creative chef that generates practical, delicious recipes. Always respond with valid JSON."
+GENERATION_PARAMS = {'temperature': 0.7, 'max_tokens': 800}
+GENERATION_CACHE_PATH = 'data/generation_cache.sqlite'
+GENERATION_CACHE_TTL = 24 * 3600
+GENERATION_CACHE_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+class OpenAIChatClient:
+    """Chat completions through whichever OpenAI SDK is installed
+
+    Anything with the same complete() method can stand in for it, which is
+    how tests run without network access. acomplete() and astream() are the
+    non-blocking equivalents used by the ASGI app. Every call is timed as
+    the 'llm' stage, streams from the first request to the last delta.
+    """
+    
+    def __init__(self, api_key):
+        if hasattr(openai, 'OpenAI'):
+            self._client = openai.OpenAI(api_key=api_key)
+            self._async_client = openai.AsyncOpenAI(api_key=api_key)
+        else:
+            # Pre-1.0 SDKs only have the module-level API
+            openai.api_key = api_key
+            self._client = None
+            self._async_client = None
+    
+    def complete(self, messages, **params):
+        """Text of the first choice for a chat completion"""
+        with stage('llm'):
+            if self._client is not None:
+                response = self._client.chat.completions.create(messages=messages, **params)
+            else:
+                response = openai.ChatCompletion.create(messages=messages, **params)
+        return response.choices[0].message.content
+    
+    def stream(self, messages, **params):
+        """Yield the text deltas of a streamed chat completion"""
+        started = time.perf_counter()
+        try:
+            if self._client is not None:
+                for chunk in self._client.chat.completions.create(messages=messages, stream=True, **params):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            else:
+                for chunk in openai.ChatCompletion.create(messages=messages, stream=True, **params):
+                    content = chunk.choices[0].delta.get('content')
+                    if content:
+                        yield content
+        finally:
+            REGISTRY.observe('stage_duration_seconds', time.perf_counter() - started, stage='llm')
+    
+    async def acomplete(self, messages, **params):
+        with stage('llm'):
+            if self._async_client is not None:
+                response = await self._async_client.chat.completions.create(messages=messages, **params)
+            else:
+                response = await openai.ChatCompletion.acreate(messages=messages, **params)
+        return response.choices[0].message.content
+    
+    async def astream(self, messages, **params):
+        started = time.perf_counter()
+        try:
+            if self._async_client is not None:
+                async for chunk in await self._async_client.chat.completions.create(messages=messages, stream=True, **params):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            else:
+                async for chunk in await openai.ChatCompletion.acreate(messages=messages, stream=True, **params):
+                    content = chunk.choices[0].delta.get('content')
+                    if content:
+                        yield content
+        finally:
+            REGISTRY.observe('stage_duration_seconds', time.perf_counter() - started, stage='llm')
+
+def normalise_inputs(ingredients, diet_restrictions, cuisine_type):
+    """Lowercased, trimmed and deduplicated inputs, so equivalent requests share a cache key"""
+    clean = lambda text: ' '.join(str(text or '').lower().split())
+    ingredients = sorted({clean(ing) for ing in ingredients if clean(ing)})
+    return ingredients, clean(diet_restrictions), clean(cuisine_type)
+
 class GPTRecipeGenerator:
-    def __init__(self):
+    def __init__(self, client=None, cache=None):
         self.api_key = os.getenv('OPENAI_API_KEY')
-        if self.api_key:
-            openai.api_key = self.api_key
-            self.available = True
-        else:
-            self.available = False
-            print("OpenAI API key not found. Using fallback recipe generation.")
+        if client is None and self.api_key:
+            client = OpenAIChatClient(self.api_key)
+        self.client = client
+        self.available = client is not None
+        if not self.available:
+            logger.warning("OpenAI API key not found. Using fallback recipe generation.")
+        
+        if cache is None:
+            cache_path = os.getenv('GENERATION_CACHE_PATH', GENERATION_CACHE_PATH)
+            backend = None
+            if cache_path:
+                try:
+                    backend = SQLiteCache(cache_path, max_entries=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL)
+                except Exception as e:
+                    logger.warning("Generation cache unavailable, using memory only: %s", e)
+            cache = LRUCache(max_entries=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL, backend=backend)
+        self.cache = cache
+        # Identical requests arriving together share one upstream call
+        self._inflight = SingleFlight()
+        self._async_inflight = AsyncSingleFlight()
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self._counter_lock = threading.Lock()
+    
+    def _count(self, failed=False):
+        """Count an upstream call, or with failed=True an upstream error"""
+        with self._counter_lock:
+            if failed:
+                self.upstream_errors += 1
+            else:
+                self.upstream_calls += 1
     
     def generate_recipe(self, ingredients, diet_restrictions="", cuisine_type=""):
         """Generate a recipe using GPT API or fallback"""
+        if self.available:
+            key = self._cache_key(ingredients, diet_restrictions, cuisine_type)
+            try:
+                recipe = self.cache.get(key)
+                if recipe is None:
+                    recipe = self._inflight.do(key, lambda: self._generate_and_cache(key, ingredients, diet_restrictions, cuisine_type))
+                # Callers enrich the recipe in place, so never hand out the cached object
+                return copy.deepcopy(recipe)
+            except Exception as e:
+                logger.warning("GPT API failed: %s. Using fallback.", e)
         
-        if self.available and self.api_key:
+        return self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type)
+    
+    async def agenerate_recipe(self, ingredients, diet_restrictions="", cuisine_type=""):
+        """generate_recipe without blocking the event loop on the upstream call"""
+        if self.available:
+            key = self._cache_key(ingredients, diet_restrictions, cuisine_type)
             try:
-                return self._generate_with_gpt(ingredients, diet_restrictions, cuisine_type)
+                recipe = self.cache.get(key)
+                if recipe is None:
+                    recipe = await self._async_inflight.do(key, lambda: self._agenerate_and_cache(key, ingredients, diet_restrictions, cuisine_type))
+                return copy.deepcopy(recipe)
             except Exception as e:
-                print(f"GPT API failed: {e}. Using fallback.")
+                logger.warning("GPT API failed: %s. Using fallback.", e)
         
         return self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type)
     
+    def fallback_recipe(self, ingredients, diet_restrictions="", cuisine_type=""):
+        """The recipe generate_recipe falls back to, for callers that give up waiting"""
+        return self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type)
+    
+    def _cache_key(self, ingredients, diet_restrictions, cuisine_type):
+        # Only the key is normalised; the prompt and fallback use the inputs as given
+        prompt = self._build_prompt(*normalise_inputs(ingredients, diet_restrictions, cuisine_type))
+        return hashlib.sha256(json.dumps([MODEL, SYSTEM_PROMPT, GENERATION_PARAMS, prompt], sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def _generate_and_cache(self, key, ingredients, diet_restrictions, cuisine_type):
+        # A call that finished just before this one may have filled the cache
+        recipe = self.cache.get(key)
+        if recipe is not None:
+            return recipe
+        try:
+            self._count()
+            recipe = self._generate_with_gpt(ingredients, diet_restrictions, cuisine_type)
+        except Exception:
+            self._count(failed=True)
+            raise
+        # Fallbacks are cheap to rebuild and should not outlive an outage
+        if recipe.get('source') == 'gpt':
+            self.cache.set(key, recipe)
+        return recipe
+    
+    async def _agenerate_and_cache(self, key, ingredients, diet_restrictions, cuisine_type):
+        recipe = self.cache.get(key)
+        if recipe is not None:
+            return recipe
+        try:
+            self._count()
+            messages = self._messages(ingredients, diet_restrictions, cuisine_type)
+            if hasattr(self.client, 'acomplete'):
+                recipe_text = await self.client.acomplete(messages, model=MODEL, **GENERATION_PARAMS)
+            else:
+                recipe_text = await asyncio.to_thread(self.client.complete, messages, model=MODEL, **GENERATION_PARAMS)
+            recipe = self._parse_recipe_response(recipe_text, ingredients)
+        except Exception:
+            self._count(failed=True)
+            raise
+        if recipe.get('source') == 'gpt':
+            self.cache.set(key, recipe)
+        return recipe
+    
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({
+            "coalesced": self._inflight.coalesced + self._async_inflight.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+        })
+        return stats
+    
+    def _messages(self, ingredients, diet_restrictions, cuisine_type):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._build_prompt(ingredients, diet_restrictions, cuisine_type)}
+        ]
+    
+    def stream_recipe(self, ingredients, diet_restrictions="", cuisine_type=""):
+        """Yield (event, data) pairs as a recipe is generated
+        
+        Title, ingredient, instruction and field events arrive as soon as the
+        model has finished writing them (see IncrementalRecipeParser). The
+        last event is always ('recipe', full recipe), which is authoritative:
+        if generation fails part way it carries the fallback recipe, after an
+        ('error', ...) event.
+        """
+        if self.available:
+            key = self._cache_key(ingredients, diet_restrictions, cuisine_type)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield from self._recipe_events(copy.deepcopy(cached))
+                return
+            
+            parser = IncrementalRecipeParser()
+            messages = self._messages(ingredients, diet_restrictions, cuisine_type)
+            try:
+                self._count()
+                if hasattr(self.client, 'stream'):
+                    deltas = self.client.stream(messages, model=MODEL, **GENERATION_PARAMS)
+                else:
+                    deltas = [self.client.complete(messages, model=MODEL, **GENERATION_PARAMS)]
+                for delta in deltas:
+                    yield from parser.feed(delta)
+                
+                recipe = self._parse_recipe_response(parser.text(), ingredients)
+                if recipe.get('source') == 'gpt':
+                    self.cache.set(key, recipe)
+                yield ('recipe', copy.deepcopy(recipe))
+                return
+            except Exception as e:
+                self._count(failed=True)
+                logger.warning("GPT streaming failed: %s. Using fallback.", e)
+                if parser.buffer:
+                    yield ('error', {"error": "Generation was interrupted, sending a fallback recipe"})
+                    yield ('recipe', self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type))
+                    return
+        
+        yield from self._recipe_events(self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type))
+    
+    async def astream_recipe(self, ingredients, diet_restrictions="", cuisine_type=""):
+        """stream_recipe as an async generator, for the ASGI app"""
+        if self.available:
+            key = self._cache_key(ingredients, diet_restrictions, cuisine_type)
+            cached = self.cache.get(key)
+            if cached is not None:
+                for event in self._recipe_events(copy.deepcopy(cached)):
+                    yield event
+                return
+            
+            parser = IncrementalRecipeParser()
+            messages = self._messages(ingredients, diet_restrictions, cuisine_type)
+            try:
+                self._count()
+                async for delta in self._adeltas(messages):
+                    for event in parser.feed(delta):
+                        yield event
+                
+                recipe = self._parse_recipe_response(parser.text(), ingredients)
+                if recipe.get('source') == 'gpt':
+                    self.cache.set(key, recipe)
+                yield ('recipe', copy.deepcopy(recipe))
+                return
+            except Exception as e:
+                self._count(failed=True)
+                logger.warning("GPT streaming failed: %s. Using fallback.", e)
+                if parser.buffer:
+                    yield ('error', {"error": "Generation was interrupted, sending a fallback recipe"})
+                    yield ('recipe', self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type))
+                    return
+        
+        for event in self._recipe_events(self._generate_fallback_recipe(ingredients, diet_restrictions, cuisine_type)):
+            yield event
+    
+    async def _adeltas(self, messages):
+        """Text deltas from the client, using its async methods when it has them"""
+        params = dict(GENERATION_PARAMS, model=MODEL)
+        if hasattr(self.client, 'astream'):
+            async for delta in self.client.astream(messages, **params):
+                yield delta
+        elif hasattr(self.client, 'acomplete'):
+            yield await self.client.acomplete(messages, **params)
+        elif hasattr(self.client, 'stream'):
+            # A blocking stream is drained one delta at a time off the loop
+            deltas = iter(self.client.stream(messages, **params))
+            while True:
+                delta = await asyncio.to_thread(next, deltas, None)
+                if delta is None:
+                    return
+                yield delta
+        else:
+            yield await asyncio.to_thread(self.client.complete, messages, **params)
+    
+    def _recipe_events(self, recipe):
+        """The events stream_recipe would emit for an already complete recipe"""
+        yield ('title', recipe.get('title'))
+        for ingredient in recipe.get('ingredients', []):
+            yield ('ingredient', ingredient)
+        for instruction in recipe.get('instructions', []):
+            yield ('instruction', instruction)
+        for key, value in recipe.items():
+            if key not in ('title', 'ingredients', 'instructions'):
+                yield ('field', {key: value})
+        yield ('recipe', recipe)
+    
     def _generate_with_gpt(self, ingredients, diet_restrictions, cuisine_type):
         """Generate recipe using GPT API"""
-        prompt = self._build_prompt(ingredients, diet_restrictions, cuisine_type)
-        
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a creative chef that generates practical, delicious recipes. Always respond with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=800
+        recipe_text = self.client.complete(
+            self._messages(ingredients, diet_restrictions, cuisine_type),
+            model=MODEL,
+            **GENERATION_PARAMS
         )
-        
-        recipe_text = response.choices[0].message.content
         return self._parse_recipe_response(recipe_text, ingredients)
     
     def _build_prompt(self, ingredients, diet_restrictions, cuisine_type):
@@ -108,7 +400,7 @@ class GPTRecipeGenerator:
              return recipe_data
         
      except (json.JSONDecodeError, KeyError) as e:
-         print(f"Failed to parse GPT response: {e}")
+         logger.warning("Failed to parse GPT response: %s", e)
     
      return self._generate_fallback_recipe(original_ingredients, "", "")
     
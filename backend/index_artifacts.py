@@ -0,0 +1,166 @@
+"""Versioned on-disk artefacts for the recipe matcher
+
+Build once per catalogue version with:
+
+    python index_artifacts.py [--recipes data/recipes.jsonl] [--out artifacts] [--dense]
+
+Pass --dense (with the same --dense-dim and --dense-lists as the app's
+DENSE_DIM and DENSE_LISTS) when the app runs with DENSE_RETRIEVAL=1.
+
+Each artefact lives in its own directory keyed by a hash of the recipe log
+and of the ingredient lexicon (data/lexicon.json), so workers only refit
+when the catalogue content or the lexicon changes. Arrays are stored
+as .npy files and loaded with mmap_mode='r', which lets every gunicorn worker
+share the same pages through the OS page cache. Saving an artefact removes
+the older ones beside it, which no later start would select.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+from recipe_log import RECIPE_LOG_PATH
+from dense_index import EMBEDDING_DIM
+
+# Bump whenever the set or layout of stored arrays changes
+ARTIFACT_VERSION = 2
+ARTIFACTS_DIR = 'artifacts'
+
+ARRAY_NAMES = [
+    'idf',
+    'vectors_data', 'vectors_indices', 'vectors_indptr',
+    'postings_indptr', 'postings_rows', 'postings_weights',
+    'diet_masks',
+    'recipe_clusters', 'cluster_similarities', 'cluster_centers', 'cluster_counts',
+    # Present only in artefacts built with dense retrieval
+    'dense_columns', 'dense_embeddings', 'dense_idf',
+    'dense_centroids', 'dense_list_offsets', 'dense_list_rows', 'dense_list_vectors',
+]
+
+logger = logging.getLogger(__name__)
+
+# Names artifact_path() gives artefact directories; nothing else is pruned
+_ARTIFACT_NAME = re.compile(r'^v\d+-[0-9a-f]{16}$')
+
+def catalogue_hash(recipes_path):
+    """SHA-256 of the recipe file contents"""
+    digest = hashlib.sha256()
+    with open(recipes_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def artifact_path(recipes_path, artifacts_dir=ARTIFACTS_DIR, lexicon=None):
+    """Directory holding the artefact for the current content of recipes_path and lexicon"""
+    try:
+        content_hash = catalogue_hash(recipes_path)
+    except OSError:
+        return None
+    if lexicon is not None:
+        content_hash = hashlib.sha256(f"{content_hash}:{lexicon.fingerprint}".encode('utf-8')).hexdigest()
+    return os.path.join(artifacts_dir, f"v{ARTIFACT_VERSION}-{content_hash[:16]}")
+
+def save_artifacts(path, arrays, vocabulary, manifest):
+    """Atomically write arrays, vocabulary and manifest to an artefact directory"""
+    parent = os.path.dirname(path) or '.'
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.building-', dir=parent)
+    try:
+        for name, array in arrays.items():
+            if array is not None:
+                np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(staging, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(staging, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(manifest, version=ARTIFACT_VERSION), f, indent=2)
+        os.rename(staging, path)
+    except OSError:
+        # Includes losing the rename race to another worker building the
+        # same artefact, in which case the published copy is used
+        shutil.rmtree(staging, ignore_errors=True)
+        return os.path.isdir(path)
+    prune_artifacts(path)
+    return True
+
+def prune_artifacts(keep):
+    """Remove the artefacts beside keep that were built for another log, lexicon or layout
+
+    Workers still mapping one keep its pages until they exit. Returns how
+    many were removed.
+    """
+    parent = os.path.dirname(keep) or '.'
+    stale = [name for name in os.listdir(parent) if _ARTIFACT_NAME.match(name) and name != os.path.basename(keep)]
+    for name in stale:
+        shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+    if stale:
+        logger.info("Removed %d stale index artefacts from %s", len(stale), parent)
+    return len(stale)
+
+def load_artifacts(path):
+    """Memory-map a saved artefact; returns (arrays, vocabulary, manifest) or None"""
+    if not os.path.isdir(path):
+        return None
+    try:
+        with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != ARTIFACT_VERSION:
+            return None
+        with open(os.path.join(path, 'vocabulary.json'), 'r', encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        arrays = {}
+        for name in ARRAY_NAMES:
+            array_file = os.path.join(path, f"{name}.npy")
+            arrays[name] = np.load(array_file, mmap_mode='r') if os.path.exists(array_file) else None
+        return arrays, vocabulary, manifest
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load index artefact %s: %s", path, e)
+        return None
+
+def build(recipes_path, artifacts_dir=ARTIFACTS_DIR, force=False, dense=None):
+    """Fit the matcher on the recipe log at recipes_path and write its artefact
+
+    dense holds DenseRetriever options to include the dense index. The
+    ingredient lexicon is the default one, as the app uses.
+    """
+    from lexicon import Lexicon
+    from matching_engine import RecipeMatcher
+    from recipe_loader import load_recipes
+
+    # Loading first imports the seed JSON if the log does not exist yet
+    store, _ = load_recipes(recipes_path)
+    lexicon = Lexicon()
+    path = artifact_path(recipes_path, artifacts_dir, lexicon)
+    if path is None:
+        raise FileNotFoundError(recipes_path)
+    if os.path.isdir(path):
+        if not force:
+            logger.info("Artefact already up to date: %s", path)
+            return path
+        shutil.rmtree(path)
+
+    matcher = RecipeMatcher(store, dense=dense, lexicon=lexicon)
+    if not matcher.save_artifacts(path):
+        raise RuntimeError(f"Failed to write artefact {path}")
+    logger.info("Wrote artefact for %d recipes to %s", len(store), path)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Build recipe matcher artefacts")
+    parser.add_argument('--recipes', default=RECIPE_LOG_PATH, help="Recipe log (JSON Lines)")
+    parser.add_argument('--out', default=ARTIFACTS_DIR, help="Artefact root directory")
+    parser.add_argument('--force', action='store_true', help="Rebuild even if an artefact exists")
+    parser.add_argument('--dense', action='store_true', help="Include the dense retrieval index")
+    parser.add_argument('--dense-dim', type=int, default=EMBEDDING_DIM, help="Dense embedding dimensions")
+    parser.add_argument('--dense-lists', type=int, help="IVF lists; default sqrt(recipes)")
+    args = parser.parse_args()
+    # Show the matcher's progress messages
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    dense = {'dim': args.dense_dim, 'n_lists': args.dense_lists} if args.dense else None
+    build(args.recipes, args.out, args.force, dense)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+from collections import deque
+
+def _on_word_boundaries(text, start, end):
+    """Whether text[start:end] starts a word and ends one, give or take a plural suffix"""
+    if start > 0 and text[start - 1].isalnum():
+        return False
+    for suffix in ('', 's', 'es'):
+        stop = end + len(suffix)
+        if text.startswith(suffix, end) and (stop == len(text) or not text[stop].isalnum()):
+            return True
+    return False
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over a fixed set of lowercase keywords
+
+    Keywords match anywhere in the text, as with `keyword in text`, but a
+    whole table is scanned in one pass linear in the length of the text.
+    When several keywords occur, longest() returns the longest one (the
+    leftmost on ties), so "sweet potato" beats "potatoes" regardless of the
+    order the table was written in. With whole_words, longest() and lookup()
+    only count keywords that start and end on word boundaries, allowing a
+    plural "s" or "es", so "egg" matches "2 eggs" but not "eggplant".
+    """
+
+    def __init__(self, keywords, whole_words=False):
+        self.whole_words = whole_words
+        # Accept a dict of keyword -> value or any iterable of keywords
+        self.values = dict(keywords) if isinstance(keywords, dict) else {keyword: keyword for keyword in keywords}
+        self._goto = [{}]
+        self._fail = [0]
+        # Keyword ending at each state, and the longest keyword that is a suffix of it
+        self._terminal = [None]
+        self._longest = [None]
+        # Every keyword that ends at each state, following failure links
+        self._outputs = [()]
+
+        for keyword in self.values:
+            self._insert(str(keyword).lower(), keyword)
+        self._link()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _insert(self, text, keyword):
+        state = 0
+        for ch in text:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._longest.append(None)
+                self._outputs.append(())
+            state = next_state
+        if text:
+            self._terminal[state] = keyword
+
+    def _link(self):
+        """Compute failure links and per-state outputs breadth first"""
+        queue = deque()
+        for state in self._goto[0].values():
+            queue.append(state)
+            self._finish(state)
+        while queue:
+            state = queue.popleft()
+            for ch, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._finish(child)
+                queue.append(child)
+
+    def _finish(self, state):
+        inherited = self._fail[state]
+        keyword = self._terminal[state]
+        # The state's own keyword is longer than any proper suffix of it
+        self._longest[state] = keyword if keyword is not None else self._longest[inherited]
+        self._outputs[state] = ((keyword,) if keyword is not None else ()) + self._outputs[inherited]
+
+    def _step(self, state, ch):
+        goto = self._goto
+        while state and ch not in goto[state]:
+            state = self._fail[state]
+        return goto[state].get(ch, 0)
+
+    def longest(self, text):
+        """The longest keyword occurring in text, or None"""
+        if self.whole_words:
+            return self._longest_whole_word(str(text).lower())
+        best = None
+        best_length = 0
+        state = 0
+        for ch in str(text).lower():
+            state = self._step(state, ch)
+            keyword = self._longest[state]
+            if keyword is not None and len(keyword) > best_length:
+                best = keyword
+                best_length = len(keyword)
+        return best
+
+    def _longest_whole_word(self, text):
+        best = None
+        best_length = 0
+        state = 0
+        for end, ch in enumerate(text, 1):
+            state = self._step(state, ch)
+            # A shorter keyword ending here may be a whole word when the longest is not
+            for keyword in self._outputs[state]:
+                length = len(str(keyword))
+                if length > best_length and _on_word_boundaries(text, end - length, end):
+                    best = keyword
+                    best_length = length
+        return best
+
+    def lookup(self, text, default=None):
+        """Value of the longest keyword occurring in text"""
+        keyword = self.longest(text)
+        return default if keyword is None else self.values[keyword]
+
+    def matches(self, text):
+        """Set of all keywords occurring in text"""
+        found = set()
+        state = 0
+        for ch in str(text).lower():
+            state = self._step(state, ch)
+            found.update(self._outputs[state])
+        return found
+
+    def contains_any(self, text):
+        """Whether any keyword occurs in text"""
+        state = 0
+        for ch in str(text).lower():
+            state = self._step(state, ch)
+            if self._outputs[state]:
+                return True
+        return False
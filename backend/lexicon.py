@@ -0,0 +1,218 @@
+"""Ingredient name normalisation
+
+Lexicon maps ingredient names onto one spelling before they are indexed or
+searched: tokens are lemmatised ("tomatoes" -> "tomato", "leaves" -> "leaf")
+and known phrases are replaced by their canonical name, longest phrase
+first, so "capsicum", "shimla mirch" and "bell peppers" all become
+"bell pepper". The synonyms, irregular lemmas and regional names live in
+data/lexicon.json and are compiled into token-tuple lookups once at load.
+
+At query time a SpellingIndex built from the fitted vocabulary corrects
+tokens it does not know ("chiken" -> "chicken"). It is a SymSpell-style
+deletion index: every dictionary word is stored under each string obtained
+by deleting up to max_distance characters, so a correction only looks up
+the deletes of the misspelt token, however large the dictionary is.
+
+Normalised names are kept in an LRU, since catalogues and queries repeat
+the same few thousand ingredient names.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from caching import LRUCache
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lexicon.json')
+# Normalised ingredient names kept, per spelling-index version
+NAME_CACHE_SIZE = 50000
+# Words shorter than this are never singularised or corrected
+MIN_LEMMA_LENGTH = 4
+MIN_CORRECTION_LENGTH = 4
+# Fitted terms seen in fewer recipes are left out of the spelling
+# dictionary: one-off terms are as likely to be typos themselves
+MIN_WORD_COUNT = 2
+
+_WORD = re.compile(r'\w+')
+_PLURAL_ES = ('ches', 'shes', 'xes', 'zes', 'sses')
+_SINGULAR_S = ('ss', 'us', 'is')
+# Distinguishes every SpellingIndex state for the name cache
+_versions = itertools.count(1)
+
+logger = logging.getLogger(__name__)
+
+def allowed_distance(length):
+    """Edits tolerated in a word of this length"""
+    if length < MIN_CORRECTION_LENGTH:
+        return 0
+    return 1 if length < 8 else 2
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (adjacent transpositions count once), or limit + 1 if above limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def deletes(word, distance):
+    """Every string made by deleting 1..distance characters from word"""
+    found = set()
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))}
+        found |= frontier
+    return found
+
+class SpellingIndex:
+    """Dictionary words under all their deletes, for constant-time correction
+
+    counts weights candidates at the same distance: the more frequent word
+    wins. version changes whenever a word is added.
+    """
+
+    def __init__(self, words=()):
+        self.counts = {}
+        self.deletes = {}
+        self.version = next(_versions)
+        for word, count in words:
+            self.add(word, count)
+
+    def __contains__(self, word):
+        return word in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, word, count=1):
+        if word in self.counts:
+            self.counts[word] += count
+            return
+        self.counts[word] = count
+        for delete in deletes(word, allowed_distance(len(word))):
+            self.deletes.setdefault(delete, []).append(word)
+        self.version = next(_versions)
+
+    def correct(self, token):
+        """The closest, then most frequent, dictionary word within allowed_distance, or None"""
+        limit = allowed_distance(len(token))
+        if limit == 0:
+            return None
+        candidates = set(self.deletes.get(token, ()))
+        for delete in deletes(token, limit):
+            if delete in self.counts:
+                candidates.add(delete)
+            candidates.update(self.deletes.get(delete, ()))
+
+        best, best_key = None, None
+        for candidate in candidates:
+            distance = edit_distance(token, candidate, limit)
+            if distance > limit:
+                continue
+            key = (distance, -self.counts[candidate], candidate)
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        return best
+
+class Lexicon:
+    """Compiled lemmas and synonym phrases from a lexicon JSON file
+
+    A missing or unreadable file gives an empty lexicon, which still
+    lowercases, tokenises and singularises.
+    """
+
+    def __init__(self, path=LEXICON_PATH, cache_size=NAME_CACHE_SIZE):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load lexicon %s: %s", path, e)
+            data = {}
+        # Artefacts fitted with a different lexicon have a different vocabulary
+        self.fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.lemmas = {word.lower(): lemma.lower() for word, lemma in data.get('lemmas', {}).items()}
+        self.invariant = {word.lower() for word in data.get('invariant', [])}
+
+        # Token tuple -> canonical tokens; canonical names map to themselves
+        # so that no shorter phrase inside them is rewritten
+        self.phrases = {}
+        for canonical, variants in data.get('synonyms', {}).items():
+            target = self._tokens(canonical)
+            for variant in [canonical] + list(variants):
+                key = self._tokens(variant)
+                if key:
+                    self.phrases.setdefault(key, target)
+        self.max_phrase = max((len(key) for key in self.phrases), default=1)
+        self.words = {token for key, target in self.phrases.items() for token in key + target}
+        self.cache = LRUCache(cache_size)
+
+    def lemma(self, token):
+        """Singular form of a token by the irregular table, then suffix rules"""
+        lemma = self.lemmas.get(token)
+        if lemma is not None:
+            return lemma
+        if len(token) < MIN_LEMMA_LENGTH or token in self.invariant or not token.endswith('s') or token.endswith(_SINGULAR_S):
+            return token
+        if token.endswith('ies'):
+            return token[:-3] + 'y'
+        if token.endswith('oes') or token.endswith(_PLURAL_ES):
+            return token[:-2]
+        return token[:-1]
+
+    def _tokens(self, text):
+        return tuple(self.lemma(token) for token in _WORD.findall(text.lower()))
+
+    def speller(self, terms, counts):
+        """SpellingIndex over fitted terms seen in at least MIN_WORD_COUNT recipes and the lexicon's own words"""
+        index = SpellingIndex((term, int(count)) for term, count in zip(terms, counts) if count >= MIN_WORD_COUNT)
+        for word in self.words:
+            index.add(word, 1)
+        return index
+
+    def _correct(self, token, speller):
+        if (len(token) < MIN_CORRECTION_LENGTH or token in speller or token in ENGLISH_STOP_WORDS
+                or not token.isalpha()):
+            return token
+        return speller.correct(token) or token
+
+    def normalise(self, name, speller=None):
+        """Canonical spelling of an ingredient name, with typos corrected if speller is given"""
+        key = (name, speller is not None)
+        version = speller.version if speller is not None else None
+        cached = self.cache.get(key, version)
+        if cached is not None:
+            return cached
+
+        tokens = [self.lemma(token) for token in _WORD.findall(name.lower())]
+        if speller is not None:
+            tokens = [self._correct(token, speller) for token in tokens]
+        normalised = []
+        i = 0
+        while i < len(tokens):
+            for length in range(min(self.max_phrase, len(tokens) - i), 0, -1):
+                target = self.phrases.get(tuple(tokens[i:i + length]))
+                if target is not None:
+                    normalised.extend(target)
+                    i += length
+                    break
+            else:
+                normalised.append(tokens[i])
+                i += 1
+        result = ' '.join(normalised)
+        self.cache.set(key, result, version)
+        return result
@@ -1,141 +1,975 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.cluster import KMeans
+import scipy.sparse as sp
 import numpy as np
+from index_artifacts import load_artifacts, save_artifacts
+from dense_index import DenseRetriever
+from clustering import RecipeClusters
+from keyword_matcher import KeywordMatcher
+from metrics import sampled, stage
+from recipe_store import grow_array
+import threading
+import logging
+import json
+import zlib
 import re
 
+_WHITESPACE = re.compile(r'\s+')
+
+logger = logging.getLogger(__name__)
+
+# Ingredients that rule a recipe out for each supported diet
+DIET_FILTERS = {
+    "vegetarian": ["chicken", "beef", "pork", "fish", "mutton", "lamb", "meat", "seafood"],
+    "vegan": ["chicken", "beef", "pork", "fish", "mutton", "lamb", "meat", "seafood", "eggs", "milk", "cheese", "butter", "cream", "yogurt", "ghee"],
+    "gluten-free": ["wheat", "bread", "pasta", "flour", "maida", "semolina"]
+}
+
+# One automaton over every forbidden ingredient, shared by all diets
+_FORBIDDEN_MATCHER = KeywordMatcher({ingredient for forbidden in DIET_FILTERS.values() for ingredient in forbidden})
+_FORBIDDEN_SETS = {diet: set(forbidden) for diet, forbidden in DIET_FILTERS.items()}
+
+# Terms first seen in recipes added after the last fit are hashed into this
+# many extra columns after the fitted vocabulary
+OOV_BUCKETS = 2 ** 18
+# Recipes analysed at a time when fitting, which bounds the transient text
+FIT_CHUNK_ROWS = 10000
+VECTORIZER_PARAMS = {'stop_words': 'english', 'lowercase': True, 'min_df': 1}
+
+# 'sparse' ranks by TF-IDF, 'dense' by ingredient embeddings (see
+# dense_index.py) and 'hybrid' by a blend of both
+RETRIEVAL_MODES = ('sparse', 'dense', 'hybrid')
+# Nearest neighbours fetched per dense query before diet and nutrition
+# filtering, at least this many and at least DENSE_OVERSAMPLE * top_n
+DENSE_CANDIDATES = 100
+DENSE_OVERSAMPLE = 4
+# Share of a hybrid score that comes from the dense similarity
+DENSE_WEIGHT = 0.5
+
+def ingredient_text(ingredients, lexicon=None):
+    """Flatten a recipe's ingredient list into a single lowercase string
+    
+    With a Lexicon each ingredient is normalised first, as the TF-IDF index
+    sees it; diets are checked against the plain text.
+    """
+    if lexicon is not None:
+        names = ingredients if isinstance(ingredients, list) else [ingredients]
+        return ' '.join(lexicon.normalise(str(name)) for name in names)
+    if isinstance(ingredients, list):
+        return ' '.join(map(str, ingredients)).lower()
+    return str(ingredients).lower()
+
+def diet_eligibility(texts):
+    """Map each supported diet to a boolean mask of the texts it allows"""
+    found = [_FORBIDDEN_MATCHER.matches(text) for text in texts]
+    return {
+        diet: np.array([not (forbidden & text_found) for text_found in found], dtype=bool)
+        for diet, forbidden in _FORBIDDEN_SETS.items()
+    }
+
+class StreamingTfidf:
+    """TfidfVectorizer.fit_transform computed one chunk of texts at a time
+    
+    partial_fit() keeps only term counts for each chunk, so the texts
+    themselves never have to be in memory together. finish() returns the
+    (vectors, vocabulary, idf) that fit_transform with the same analyzer
+    would give: smoothed idf, l2-normalised rows, columns in term order.
+    add_rows() normalises ingredient names with lexicon when one is given.
+    """
+    
+    def __init__(self, analyzer=None, lexicon=None):
+        self.analyzer = analyzer or TfidfVectorizer(**VECTORIZER_PARAMS).build_analyzer()
+        self.lexicon = lexicon
+        self.vocabulary = {}
+        self.n_rows = 0
+        self._indices = []
+        self._counts = []
+        self._row_lengths = []
+    
+    def partial_fit(self, texts):
+        indices, counts, lengths = [], [], []
+        for text in texts:
+            row_counts = {}
+            for token in self.analyzer(text):
+                column = self.vocabulary.setdefault(token, len(self.vocabulary))
+                row_counts[column] = row_counts.get(column, 0) + 1
+            indices.extend(row_counts)
+            counts.extend(row_counts.values())
+            lengths.append(len(row_counts))
+        self._indices.append(np.asarray(indices, dtype=np.int32))
+        self._counts.append(np.asarray(counts, dtype=np.float64))
+        self._row_lengths.append(np.asarray(lengths, dtype=np.int64))
+        self.n_rows += len(lengths)
+    
+    def add_rows(self, store, start, stop):
+        """partial_fit on store rows [start, stop), e.g. as a load_recipes callback"""
+        self.partial_fit([ingredient_text(store.ingredients(row), self.lexicon) for row in range(start, stop)])
+    
+    def finish(self):
+        if not self.vocabulary:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+        indices = np.concatenate(self._indices)
+        data = np.concatenate(self._counts)
+        indptr = np.zeros(self.n_rows + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(self._row_lengths), out=indptr[1:])
+        self._indices, self._counts, self._row_lengths = [], [], []
+        
+        # Renumber columns in sorted term order, as TfidfVectorizer does
+        terms = sorted(self.vocabulary)
+        order = np.empty(len(terms), dtype=np.int32)
+        order[[self.vocabulary[term] for term in terms]] = np.arange(len(terms), dtype=np.int32)
+        vocabulary = {term: column for column, term in enumerate(terms)}
+        
+        vectors = sp.csr_matrix((data, order[indices], indptr), shape=(self.n_rows, len(terms)))
+        vectors.sort_indices()
+        df = np.bincount(vectors.indices, minlength=len(terms))
+        idf = np.log((1 + self.n_rows) / (1 + df)) + 1
+        vectors.data *= idf[vectors.indices]
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        vectors.data /= np.repeat(norms, np.diff(vectors.indptr))
+        return vectors, vocabulary, idf
+
 class RecipeMatcher:
-    def __init__(self, recipes_df):
-        self.recipes_df = recipes_df
-        self.vectorizer = TfidfVectorizer(stop_words='english', lowercase=True, min_df=1)
-        self._fit_vectors()
-        self._fit_clusters()
+    def __init__(self, store, refit_threshold=0.1, artifact_path=None, fitted_rows=None, query_cache=None, nutrient_table=None, prefit=None, dense=None, cluster_count=None, lexicon=None):
+        self.store = store
+        # Rows [0, fitted_rows) of the store are fitted; later ones are added incrementally
+        self.fitted_rows = len(store) if fitted_rows is None else fitted_rows
+        self.refit_threshold = refit_threshold
+        self.vectorizer = TfidfVectorizer(**VECTORIZER_PARAMS)
+        self.analyzer = self.vectorizer.build_analyzer()
+        self._lock = threading.RLock()
+        self._refit_thread = None
+        # Optional caching.LRUCache of ranked results keyed by normalised query
+        self.query_cache = query_cache
+        self.nutrient_table = nutrient_table
+        # Bumped on every change to the indexed catalogue or its clusters
+        self.version = 0
+        # DenseRetriever keyword arguments to enable dense retrieval, or None
+        self.dense_options = dense
+        self.dense = None
+        # Clusters to fit, or None to pick the count from a sample
+        self.cluster_count = cluster_count
+        self.clusters = None
+        # Optional lexicon.Lexicon normalising ingredient names for indexing
+        # and queries; speller corrects query typos against the fitted terms
+        self.lexicon = lexicon
+        self.speller = None
+        
+        # Reuse a prebuilt artefact for this catalogue version when there is
+        # one; prefit is a StreamingTfidf the loader already fed every row
+        if not (artifact_path and self._load_artifacts(artifact_path)):
+            self._fit_vectors(prefit)
+            self._build_inverted_index()
+            self._build_speller()
+            self._build_diet_masks()
+            self._fit_clusters()
+            self._fit_dense()
+            if artifact_path:
+                self.save_artifacts(artifact_path)
+        elif dense is not None and self.dense is None:
+            logger.warning("Index artefact %s has no dense index; rebuild it with --dense to skip this fit", artifact_path)
+            self._fit_dense()
+        # Estimated nutrition per recipe, one sparse product for the catalogue
+        self.recipe_nutrition = nutrient_table.estimate_store(store, 0, self.fitted_rows) if nutrient_table is not None else None
+        # Catalogue mean per nutrient, so objective weights are unit-free
+        self.nutrient_scale = None
+        if self.recipe_nutrition is not None and len(self.recipe_nutrition):
+            self.nutrient_scale = np.maximum(self.recipe_nutrition.mean(axis=0), 1e-9)
+        self._reset_added()
+    
+    def _row_texts(self, start, stop, lexicon=None):
+        """Ingredient text of store rows [start, stop)"""
+        return [ingredient_text(self.store.ingredients(row), lexicon) for row in range(start, stop)]
     
-    def _fit_vectors(self):
+    def _fit_vectors(self, prefit=None):
         """Create TF-IDF vectors for ingredient matching"""
         try:
-            # Combine ingredients into strings for TF-IDF
-            ingredient_texts = []
-            for ingredients in self.recipes_df['ingredients']:
-                if isinstance(ingredients, list):
-                    ingredient_texts.append(' '.join(map(str, ingredients)).lower())
-                else:
-                    ingredient_texts.append(str(ingredients).lower())
-            
-            self.ingredient_vectors = self.vectorizer.fit_transform(ingredient_texts)
-            print(f"TF-IDF vectors created for {len(ingredient_texts)} recipes")
+            if prefit is None or prefit.n_rows != self.fitted_rows or prefit.lexicon is not self.lexicon:
+                prefit = StreamingTfidf(self.analyzer, self.lexicon)
+                for start in range(0, self.fitted_rows, FIT_CHUNK_ROWS):
+                    prefit.partial_fit(self._row_texts(start, min(start + FIT_CHUNK_ROWS, self.fitted_rows), self.lexicon))
+            
+            self.ingredient_vectors, self.vocabulary, self.idf = prefit.finish()
+            # Hashed terms are treated as rare as a term seen in one recipe
+            self.oov_idf = float(self.idf.max())
+            logger.info("TF-IDF vectors created for %s recipes", self.fitted_rows)
         except Exception as e:
-            print(f"Error in TF-IDF fitting: {e}")
+            logger.error("Error in TF-IDF fitting: %s", e)
             self.ingredient_vectors = None
+            self.vocabulary = None
+            self.idf = None
+            self.oov_idf = 1.0
+    
+    def save_artifacts(self, path):
+        """Write the fitted index to an artefact directory"""
+        if self.ingredient_vectors is None:
+            return False
+        
+        terms = self._terms()
+        diets = list(self.diet_masks)
+        arrays = {
+            'idf': self.idf,
+            'vectors_data': self.ingredient_vectors.data,
+            'vectors_indices': self.ingredient_vectors.indices,
+            'vectors_indptr': self.ingredient_vectors.indptr,
+            'postings_indptr': self.posting_indptr,
+            'postings_rows': self.posting_rows,
+            'postings_weights': self.posting_weights,
+            'diet_masks': np.vstack([self.diet_masks[diet] for diet in diets]) if diets else None,
+        }
+        if self.clusters is not None:
+            arrays.update(self.clusters.arrays())
+        if self.dense is not None:
+            arrays.update(self.dense.arrays())
+        manifest = {
+            'recipes': self.fitted_rows,
+            'terms': len(terms),
+            'diets': diets,
+            'clusters': 0 if self.clusters is None else self.clusters.n_clusters,
+            'dense_dim': None if self.dense is None else self.dense.dim,
+        }
+        return save_artifacts(path, arrays, terms, manifest)
+    
+    def _load_artifacts(self, path):
+        """Memory-map a saved index instead of fitting; False if it does not fit this catalogue"""
+        loaded = load_artifacts(path)
+        if loaded is None:
+            return False
+        
+        arrays, terms, manifest = loaded
+        # Plain ndarray views index faster than np.memmap and still share the mapped pages
+        arrays = {name: None if array is None else np.asarray(array) for name, array in arrays.items()}
+        if manifest.get('recipes') != self.fitted_rows or manifest.get('diets') != list(DIET_FILTERS):
+            logger.warning("Index artefact %s does not match the catalogue, refitting", path)
+            return False
+        
+        self.vocabulary = {term: column for column, term in enumerate(terms)}
+        self.idf = arrays['idf']
+        self.oov_idf = float(self.idf.max())
+        self.ingredient_vectors = sp.csr_matrix(
+            (arrays['vectors_data'], arrays['vectors_indices'], arrays['vectors_indptr']),
+            shape=(self.fitted_rows, len(terms)), copy=False
+        )
+        self.posting_indptr = arrays['postings_indptr']
+        self.posting_rows = arrays['postings_rows']
+        self.posting_weights = arrays['postings_weights']
+        
+        self.diet_masks = {}
+        self.diet_rows = {}
+        for i, diet in enumerate(manifest['diets']):
+            self.diet_masks[diet] = arrays['diet_masks'][i]
+            self.diet_rows[diet] = np.flatnonzero(self.diet_masks[diet])
+        
+        # Centroids and their counts are the whole model, so added recipes
+        # keep updating it as if it had been fitted here
+        self.clusters = RecipeClusters.from_arrays(arrays, terms)
+        self._build_speller()
+        
+        if self.dense_options is not None:
+            dense = DenseRetriever(self.store, normalise=self._dense_normaliser(), **self.dense_options)
+            self.dense = dense if dense.load(arrays) else None
+        logger.info("Loaded index artefact for %s recipes from %s", self.fitted_rows, path)
+        return True
+    
+    def _vectorize(self, texts, query=False):
+        """TF-IDF encode texts against the fitted vocabulary plus hashed OOV columns"""
+        n_terms = len(self.vocabulary)
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            for token in self.analyzer(text):
+                column = self.vocabulary.get(token)
+                if column is None:
+                    column = n_terms + zlib.crc32(token.encode('utf-8')) % OOV_BUCKETS
+                    # Unseen query terms match nothing; dropping them keeps
+                    # scores identical to a plain TfidfVectorizer transform
+                    if query and column not in self.oov_columns:
+                        continue
+                rows.append(row)
+                columns.append(column)
+        
+        # Group repeated (row, column) pairs into term counts
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        order = np.lexsort((columns, rows))
+        rows, columns = rows[order], columns[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        starts = np.flatnonzero(first)
+        weights = np.diff(np.append(starts, len(rows))).astype(np.float64)
+        rows, columns = rows[starts], columns[starts]
+        
+        in_vocab = columns < n_terms
+        weights[in_vocab] *= self.idf[columns[in_vocab]]
+        weights[~in_vocab] *= self.oov_idf
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(texts)))
+        norms[norms == 0] = 1.0
+        weights /= norms[rows]
+        
+        indptr = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(texts)), out=indptr[1:])
+        return sp.csr_matrix((weights, columns, indptr), shape=(len(texts), n_terms + OOV_BUCKETS))
+    
+    def _build_inverted_index(self):
+        """Build term -> recipe posting lists from the TF-IDF matrix"""
+        if self.ingredient_vectors is None:
+            self.posting_indptr = None
+            self.posting_rows = None
+            self.posting_weights = None
+            return
+        
+        # Column t of the CSC form lists every recipe containing term t
+        postings = self.ingredient_vectors.tocsc()
+        postings.sort_indices()
+        self.posting_indptr = postings.indptr
+        self.posting_rows = postings.indices.astype(np.int32)
+        self.posting_weights = postings.data
+        logger.info("Inverted index built for %s terms", len(self.posting_indptr) - 1)
+    
+    def _score_candidates(self, user_vector):
+        """Score only the recipes in the union of the query terms' posting lists"""
+        n_terms = len(self.vocabulary)
+        in_vocab = user_vector.indices < n_terms
+        terms = user_vector.indices[in_vocab]
+        starts = self.posting_indptr[terms]
+        ends = self.posting_indptr[terms + 1]
+        
+        rows = [self.posting_rows[start:end] for start, end in zip(starts, ends)]
+        contributions = [
+            self.posting_weights[start:end] * weight
+            for start, end, weight in zip(starts, ends, user_vector.data[in_vocab])
+        ]
+        
+        # Recipes added since the last fit are few, so score them directly
+        if self.added_vectors is not None:
+            added = (self.added_vectors @ user_vector.T).tocoo()
+            rows.append((added.row + self.fitted_rows).astype(np.int32))
+            contributions.append(added.data)
+        
+        if sum(len(r) for r in rows) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        
+        rows = np.concatenate(rows)
+        candidates, positions = np.unique(rows, return_inverse=True)
+        scores = np.bincount(positions, weights=np.concatenate(contributions), minlength=len(candidates))
+        return candidates, scores
+    
+    def _build_diet_masks(self):
+        """Precompute per-recipe eligibility for every supported diet"""
+        self.diet_masks = {}
+        self.diet_rows = {}
+        if self.fitted_rows == 0:
+            return
+        
+        chunks = [
+            diet_eligibility(self._row_texts(start, min(start + FIT_CHUNK_ROWS, self.fitted_rows)))
+            for start in range(0, self.fitted_rows, FIT_CHUNK_ROWS)
+        ]
+        for diet in DIET_FILTERS:
+            mask = np.concatenate([chunk[diet] for chunk in chunks])
+            self.diet_masks[diet] = mask
+            self.diet_rows[diet] = np.flatnonzero(mask)
+    
+    def _terms(self):
+        """Fitted terms in column order"""
+        terms = [None] * len(self.vocabulary)
+        for term, column in self.vocabulary.items():
+            terms[column] = term
+        return terms
     
     def _fit_clusters(self):
         """Cluster recipes for better organization"""
         try:
-            if len(self.recipes_df) >= 3 and self.ingredient_vectors is not None:
-                n_clusters = min(5, len(self.recipes_df))
-                self.cluster_model = KMeans(n_clusters=n_clusters, random_state=42)
-                self.recipe_clusters = self.cluster_model.fit_predict(self.ingredient_vectors)
-                print(f"Recipes clustered into {n_clusters} groups")
+            if self.fitted_rows >= 3 and self.ingredient_vectors is not None:
+                self.clusters = RecipeClusters.fit(self.ingredient_vectors, self._terms(), self.cluster_count)
+                logger.info("Recipes clustered into %s groups", self.clusters.n_clusters)
             else:
-                self.cluster_model = None
-                self.recipe_clusters = None
+                self.clusters = None
+        except Exception as e:
+            logger.error("Error in clustering: %s", e)
+            self.clusters = None
+    
+    @property
+    def recipe_clusters(self):
+        """Cluster id of every indexed row, or None without clusters"""
+        return None if self.clusters is None else self.clusters.labels
+    
+    def _dense_normaliser(self):
+        return None if self.lexicon is None else self.lexicon.normalise
+    
+    def _build_speller(self):
+        """Spelling index over the fitted terms, weighted by how many recipes use them"""
+        self.speller = None
+        if self.lexicon is None or self.vocabulary is None:
+            return
+        self.speller = self.lexicon.speller(self._terms(), np.diff(self.posting_indptr))
+        logger.info("Spelling index built over %s words", len(self.speller))
+    
+    def _fit_dense(self):
+        """Fit ingredient embeddings and the ANN index when dense retrieval is enabled"""
+        self.dense = None
+        if self.dense_options is None or not self.fitted_rows:
+            return
+        try:
+            self.dense = DenseRetriever(self.store, normalise=self._dense_normaliser(), **self.dense_options).fit(self.fitted_rows)
+            logger.info("Dense index built over %s recipes in %s lists", self.fitted_rows, self.dense.index.n_lists)
+        except Exception as e:
+            logger.error("Error in dense index fitting: %s", e)
+            self.dense = None
+    
+    def _reset_added(self):
+        """Start with no rows added since the last fit"""
+        self.added_rows = 0
+        # Vector of each added row, stacked into added_vectors when read
+        self._added_parts = []
+        self._added_stack = None
+        # Buffers with spare room behind the per-row arrays that grow with
+        # every added recipe (nutrition, diet masks, diet rows)
+        self._append_buffers = {}
+        self.oov_columns = set()
+    
+    @property
+    def added_vectors(self):
+        """CSR matrix of the rows added since the fit, or None"""
+        if not self._added_parts:
+            return None
+        stack = self._added_stack
+        if stack is None or stack.shape[0] != len(self._added_parts):
+            stack = self._added_stack = sp.vstack(self._added_parts, format='csr')
+        return stack
+    
+    def added_vector(self, row):
+        """Vector of one store row added since the fit"""
+        return self._added_parts[row - self.fitted_rows]
+    
+    def _append(self, name, array, value):
+        """array with value appended, written into a buffer grown geometrically
+        
+        Appending one row at a time copies O(1) amortised per row instead of
+        the whole array; the result is a view of the buffer.
+        """
+        size = len(array)
+        buffer = grow_array(self._append_buffers.get(name, array), size + 1)
+        buffer[size] = value
+        self._append_buffers[name] = buffer
+        return buffer[:size + 1]
+    
+    @property
+    def num_recipes(self):
+        return self.fitted_rows + self.added_rows
+    
+    def get_nutrition(self, row):
+        """Precomputed nutrition estimate for a store row, or None"""
+        with self._lock:
+            if self.recipe_nutrition is None or row >= len(self.recipe_nutrition):
+                return None
+            nutrition = self.nutrient_table.to_dict(self.recipe_nutrition[row])
+        nutrition['source'] = "estimated"
+        return nutrition
+    
+    def get_recipe(self, row):
+        """Return the recipe stored at a matcher row as a dict"""
+        return self.store.get(row)
+    
+    def add_recipe(self, recipe):
+        """Make a saved recipe searchable immediately, without refitting
+        
+        The recipe is appended to the store, encoded with the fitted
+        vocabulary (unknown terms go to hashed columns) and joined to its
+        nearest existing cluster. A full refit is scheduled in the background
+        once drift() passes refit_threshold. Returns False if the recipe id is
+        already in the store.
+        """
+        with self._lock:
+            if recipe.get('id') is not None and self.store.has_id(recipe.get('id')):
+                return False
+            
+            row = self.store.append(recipe)
+            self._index_row(row)
+            self.version += 1
+            
+            if self.vocabulary is None or self.drift() > self.refit_threshold:
+                self._schedule_refit()
+        return True
+    
+    def _index_row(self, row):
+        """Index a store row on top of the current fit"""
+        self.added_rows += 1
+        if self.recipe_nutrition is not None:
+            self.recipe_nutrition = self._append('nutrition', self.recipe_nutrition, self.nutrient_table.estimate_store(self.store, row, row + 1)[0])
+        if self.dense is not None:
+            self.dense.add_row(row)
+        if self.vocabulary is None:
+            return
+        
+        text = ingredient_text(self.store.ingredients(row))
+        normalised = text if self.lexicon is None else ingredient_text(self.store.ingredients(row), self.lexicon)
+        vector = self._vectorize([normalised])
+        self.oov_columns.update(int(c) for c in vector.indices if c >= len(self.vocabulary))
+        if self.speller is not None:
+            # New terms become corrections for later queries
+            for token in self.analyzer(normalised):
+                if token not in self.vocabulary:
+                    self.speller.add(token)
+        self._added_parts.append(vector)
+        
+        for diet, eligible in diet_eligibility([text]).items():
+            self.diet_masks[diet] = self._append(('mask', diet), self.diet_masks[diet], eligible[0])
+            if eligible[0]:
+                self.diet_rows[diet] = self._append(('rows', diet), self.diet_rows[diet], row)
+        
+        if self.clusters is not None:
+            # Hashed columns are unknown to the centroids
+            self.clusters.add(row, vector[:, :len(self.vocabulary)])
+    
+    def drift(self):
+        """How far the catalogue has moved from the last fit
+        
+        The larger of the share of recipes added since the fit and the share
+        of new terms relative to the fitted vocabulary.
+        """
+        if not self.fitted_rows or not self.vocabulary:
+            return 1.0 if self.added_rows else 0.0
+        return max(self.added_rows / self.fitted_rows, len(self.oov_columns) / len(self.vocabulary))
+    
+    def _schedule_refit(self):
+        """Start a background refit unless one is already running"""
+        if self._refit_thread is not None and self._refit_thread.is_alive():
+            return
+        logger.info("Index drift %.2f exceeds %s, scheduling refit", self.drift(), self.refit_threshold)
+        self._refit_thread = threading.Thread(target=self._refit, daemon=True)
+        self._refit_thread.start()
+    
+    def _refit(self):
+        """Refit vectors and clusters on the full catalogue and swap them in"""
+        try:
+            with self._lock:
+                snapshot_rows = self.num_recipes
+            
+            fresh = RecipeMatcher(
+                self.store, self.refit_threshold, fitted_rows=snapshot_rows,
+                query_cache=self.query_cache, nutrient_table=self.nutrient_table,
+                dense=self.dense_options, cluster_count=self.cluster_count, lexicon=self.lexicon
+            )
+            
+            with self._lock:
+                # Recipes added while the refit ran go on top of the new fit
+                for row in range(snapshot_rows, self.num_recipes):
+                    fresh._index_row(row)
+                for name, value in vars(fresh).items():
+                    if name not in ('_lock', '_refit_thread', 'version'):
+                        setattr(self, name, value)
+                self.version += 1
+            logger.info("Refit complete for %s recipes", self.num_recipes)
         except Exception as e:
-            print(f"Error in clustering: {e}")
-            self.cluster_model = None
-            self.recipe_clusters = None
+            logger.error("Error in background refit: %s", e)
     
     def preprocess_ingredients(self, user_ingredients):
-        """Clean and preprocess user ingredients"""
+        """Clean and preprocess user ingredients
+        
+        With a lexicon, names are normalised as the index was and misspelt
+        words are corrected against the fitted terms.
+        """
         processed = []
         for ingredient in user_ingredients:
             # Remove extra spaces and convert to lowercase
-            clean_ing = re.sub(r'\s+', ' ', str(ingredient).strip().lower())
+            clean_ing = _WHITESPACE.sub(' ', str(ingredient).strip().lower())
+            if self.lexicon is not None:
+                clean_ing = self.lexicon.normalise(clean_ing, self.speller)
             processed.append(clean_ing)
         return processed
     
-    def find_similar_recipes(self, user_ingredients, top_n=5, diet_filter=None):
+    def cache_version(self):
+        """Identifies the scoring state; equal across workers that indexed the same recipes"""
+        with self._lock:
+            return f"{self.fitted_rows}:{self.num_recipes}"
+    
+    def _query_key(self, ingredients, top_n, diet_filter, nutrition=None, nutrition_weights=None, retrieval='sparse'):
+        diet = diet_filter.lower() if isinstance(diet_filter, str) and diet_filter else None
+        return json.dumps(
+            [ingredients, diet, top_n, nutrition or None, nutrition_weights or None, retrieval],
+            ensure_ascii=False, separators=(',', ':'), sort_keys=True
+        )
+    
+    def _cached_rows(self, key, version):
+        """(rows, scores) cached for key, or None on a miss"""
+        cached = self.query_cache.get(key, version)
+        if cached is None:
+            return None
+        ids, scores = cached
+        # Results are cached by recipe id since row order can differ between workers
+        rows = [self.store.row_of(recipe_id) for recipe_id in ids]
+        if any(row is None for row in rows):
+            return None
+        return np.array(rows, dtype=np.int64), np.array(scores, dtype=np.float64)
+    
+    def _cache_rows(self, key, version, rows, scores):
+        ids = self.store.ids[rows]
+        if (ids < 0).any():
+            return
+        self.query_cache.set(key, [ids.tolist(), np.asarray(scores, dtype=np.float64).tolist()], version)
+    
+    def _normalised_query(self, user_ingredients):
+        """Preprocessed ingredients; deduplicated and sorted when results are cached"""
+        ingredients = self.preprocess_ingredients(user_ingredients)
+        if self.query_cache is not None:
+            # Score the same set the cache key describes, so hits and misses agree
+            ingredients = sorted(set(ingredients))
+        return ingredients
+    
+    def retrieval_mode(self, retrieval):
+        """Validate a retrieval mode, None meaning 'sparse'; raises ValueError"""
+        mode = 'sparse' if retrieval is None else str(retrieval).lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval} (expected one of {', '.join(RETRIEVAL_MODES)})")
+        if mode != 'sparse' and self.dense is None:
+            raise ValueError("Dense retrieval is not enabled on this server")
+        return mode
+    
+    def _dense_scores(self, ingredients, top_n, diet_filter, candidates=None, similarities=None):
+        """Nearest recipes by embedding, blended with sparse (candidates, similarities) if given"""
+        query = self.dense.encode_query(ingredients)
+        if not query.any():
+            # No known ingredient: nothing to add to the sparse scores
+            if candidates is None:
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            return candidates, (1 - DENSE_WEIGHT) * similarities
+        
+        diet = diet_filter.lower() if diet_filter else None
+        allowed = self.diet_masks.get(diet)
+        rows, scores = self.dense.search(query, max(DENSE_CANDIDATES, DENSE_OVERSAMPLE * top_n), allowed=allowed)
+        if candidates is None:
+            return rows, scores.astype(np.float64)
+        
+        # Every row either side found is scored on both
+        union = np.union1d(candidates, rows)
+        sparse = np.zeros(len(union))
+        sparse[np.searchsorted(union, candidates)] = similarities
+        dense = self.dense.similarities(query, union).astype(np.float64)
+        return union, (1 - DENSE_WEIGHT) * sparse + DENSE_WEIGHT * dense
+    
+    def nutrient_bounds(self, nutrition):
+        """Parse {'calories': {'max': 600}, 'protein': {'min': 30}} into (columns, lows, highs)
+        
+        Bounds may also be given as [min, max] with null for an open end.
+        Raises ValueError for unknown nutrients or malformed bounds.
+        """
+        if not nutrition:
+            return None
+        if self.recipe_nutrition is None:
+            raise ValueError("Nutrition data is not available")
+        if not isinstance(nutrition, dict):
+            raise ValueError("nutrition must map nutrient names to bounds")
+        
+        columns, lows, highs = [], [], []
+        for nutrient, bounds in nutrition.items():
+            if nutrient not in self.nutrient_table.nutrients:
+                raise ValueError(f"Unknown nutrient '{nutrient}'")
+            if isinstance(bounds, dict):
+                low, high = bounds.get('min'), bounds.get('max')
+            elif isinstance(bounds, (list, tuple)) and len(bounds) == 2:
+                low, high = bounds
+            else:
+                raise ValueError(f"Bounds for '{nutrient}' must be {{'min': x, 'max': y}} or [min, max]")
+            try:
+                lows.append(-np.inf if low is None else float(low))
+                highs.append(np.inf if high is None else float(high))
+            except (TypeError, ValueError):
+                raise ValueError(f"Bounds for '{nutrient}' must be numbers")
+            columns.append(self.nutrient_table.nutrients.index(nutrient))
+        return np.array(columns), np.array(lows), np.array(highs)
+    
+    def nutrient_weights(self, nutrition_weights):
+        """Parse {'protein': 0.5, 'calories': -0.2} into a weight per nutrient column
+        
+        Weights apply to values divided by the catalogue mean, so a weight of
+        0.5 adds 0.5 to the score of a recipe with average protein.
+        """
+        if not nutrition_weights:
+            return None
+        if self.recipe_nutrition is None or self.nutrient_scale is None:
+            raise ValueError("Nutrition data is not available")
+        if not isinstance(nutrition_weights, dict):
+            raise ValueError("nutrition_weights must map nutrient names to numbers")
+        
+        weights = np.zeros(len(self.nutrient_table.nutrients))
+        for nutrient, weight in nutrition_weights.items():
+            if nutrient not in self.nutrient_table.nutrients:
+                raise ValueError(f"Unknown nutrient '{nutrient}'")
+            column = self.nutrient_table.nutrients.index(nutrient)
+            try:
+                weights[column] = float(weight) / self.nutrient_scale[column]
+            except (TypeError, ValueError):
+                raise ValueError(f"Weight for '{nutrient}' must be a number")
+        return weights
+    
+    def _within_bounds(self, values, bounds):
+        columns, lows, highs = bounds
+        selected = values[:, columns]
+        return ((selected >= lows) & (selected <= highs)).all(axis=1)
+    
+    def find_similar_rows(self, user_ingredients, top_n=5, diet_filter=None, nutrition=None, nutrition_weights=None, retrieval=None):
+        """Rank store rows against user's ingredients; returns (rows, scores)
+        
+        nutrition holds per-nutrient bounds every result must satisfy and
+        nutrition_weights adds a weighted nutrient term to the score; see
+        nutrient_bounds and nutrient_weights for their formats. retrieval is
+        one of RETRIEVAL_MODES; the dense modes need the matcher built with
+        dense options.
+        """
+        top_n = int(top_n)
+        if top_n <= 0 or self.ingredient_vectors is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        bounds = self.nutrient_bounds(nutrition)
+        weights = self.nutrient_weights(nutrition_weights)
+        mode = self.retrieval_mode(retrieval)
+        
+        # Preprocess user ingredients
+        with stage('normalise'):
+            user_ingredients = self._normalised_query(user_ingredients)
+        user_text = ' '.join(user_ingredients)
+        
+        key = None
+        if self.query_cache is not None:
+            key = self._query_key(user_ingredients, top_n, diet_filter, nutrition, nutrition_weights, mode)
+            cached = self._cached_rows(key, self.cache_version())
+            if cached is not None:
+                return cached
+        
+        with self._lock:
+            version = self.cache_version()
+            if mode == 'dense':
+                with stage('score'):
+                    candidates, similarities = self._dense_scores(user_ingredients, top_n, diet_filter)
+            else:
+                # Transform user input
+                with stage('vectorise'):
+                    user_vector = self._vectorize([user_text], query=True)
+                
+                # Rows are L2-normalised, so summing posting weights gives the
+                # cosine similarity; an empty union falls through to the padding
+                # in _select_top, which serves unmatched eligible recipes
+                with stage('score'):
+                    candidates, similarities = self._score_candidates(user_vector)
+                    if mode == 'hybrid':
+                        candidates, similarities = self._dense_scores(user_ingredients, top_n, diet_filter, candidates, similarities)
+            
+            with stage('top_k'):
+                rows, scores = self._select_top(candidates, similarities, top_n, diet_filter, bounds, weights)
+        
+        if key is not None:
+            self._cache_rows(key, version, rows, scores)
+        return rows, scores
+    
+    def find_similar_recipes(self, user_ingredients, top_n=5, diet_filter=None, nutrition=None, nutrition_weights=None, retrieval=None):
         """Find recipes similar to user's ingredients"""
         try:
-            if self.ingredient_vectors is None or len(self.recipes_df) == 0:
-                print("No recipes available for matching")
+            if self.ingredient_vectors is None or self.num_recipes == 0:
+                logger.warning("No recipes available for matching")
                 return self._get_fallback_recipes()
             
-            # Preprocess user ingredients
-            user_ingredients = self.preprocess_ingredients(user_ingredients)
-            user_text = ' '.join(user_ingredients)
-            
-            # Transform user input
-            user_vector = self.vectorizer.transform([user_text])
+            rows, scores = self.find_similar_rows(user_ingredients, top_n, diet_filter, nutrition, nutrition_weights, retrieval)
             
-            # Calculate similarities
-            similarities = cosine_similarity(user_vector, self.ingredient_vectors)
-            similar_indices = similarities.argsort()[0][-top_n:][::-1]
-            
-            # Get similar recipes
             results = []
-            for idx in similar_indices:
-                if idx < len(self.recipes_df):
-                    recipe = self.recipes_df.iloc[idx].to_dict()
-                    recipe['similarity_score'] = float(similarities[0][idx])
-                    results.append(recipe)
-            
-            # Apply diet filter if specified
-            if diet_filter:
-                results = self._filter_by_diet(results, diet_filter)
+            for idx, score in zip(rows, scores):
+                recipe = self.store.get(idx)
+                recipe['similarity_score'] = float(score)
+                if nutrition or nutrition_weights:
+                    recipe['nutrition'] = self.get_nutrition(idx)
+                results.append(recipe)
             
-            print(f"Found {len(results)} matching recipes")
+            sampled(logger, logging.INFO, "Found %d matching recipes", len(results))
             return results
             
         except Exception as e:
-            print(f"Error in recipe matching: {e}")
+            logger.error("Error in recipe matching: %s", e)
             return self._get_fallback_recipes()
     
-    def _filter_by_diet(self, recipes, diet):
-        """Filter recipes by dietary restrictions"""
-        diet_filters = {
-            "vegetarian": ["chicken", "beef", "pork", "fish", "mutton", "lamb", "meat", "seafood"],
-            "vegan": ["chicken", "beef", "pork", "fish", "mutton", "lamb", "meat", "seafood", "eggs", "milk", "cheese", "butter", "cream", "yogurt", "ghee"],
-            "gluten-free": ["wheat", "bread", "pasta", "flour", "maida", "semolina"]
-        }
+    def find_similar_rows_batch(self, queries):
+        """Rank store rows for many queries at once; returns a (rows, scores) pair per query
+        
+        Each query is a dict with 'ingredients' and optional 'top_n' (default 5)
+        and 'diet_filter'. All queries are encoded into one sparse matrix and
+        scored with a single sparse product against the posting lists.
+        Queries answered by the query cache are left out of the product, and
+        queries with a dense 'retrieval' mode are answered one at a time.
+        """
+        empty = (np.empty(0, dtype=np.int64), np.empty(0))
+        if self.ingredient_vectors is None:
+            return [empty for _ in queries]
+        if not queries:
+            return []
         
-        if diet.lower() in diet_filters:
-            filtered_recipes = []
-            forbidden_ingredients = diet_filters[diet.lower()]
+        results = [None] * len(queries)
+        for i, query in enumerate(queries):
+            if self.retrieval_mode(query.get('retrieval')) != 'sparse':
+                results[i] = self.find_similar_rows(
+                    query.get('ingredients', []), query.get('top_n', 5), query.get('diet_filter'),
+                    query.get('nutrition'), query.get('nutrition_weights'), query.get('retrieval')
+                )
+        with stage('normalise'):
+            ingredient_lists = [self._normalised_query(query.get('ingredients', [])) for query in queries]
+        keys = [None] * len(queries)
+        if self.query_cache is not None:
+            version = self.cache_version()
+            for i, query in enumerate(queries):
+                if results[i] is not None:
+                    continue
+                keys[i] = self._query_key(
+                    ingredient_lists[i], int(query.get('top_n', 5)), query.get('diet_filter'),
+                    query.get('nutrition'), query.get('nutrition_weights')
+                )
+                results[i] = self._cached_rows(keys[i], version)
+        pending = [i for i in range(len(queries)) if results[i] is None]
+        if not pending:
+            return results
+        
+        texts = [' '.join(ingredient_lists[i]) for i in pending]
+        
+        with self._lock:
+            version = self.cache_version()
+            with stage('vectorise'):
+                query_vectors = self._vectorize(texts, query=True)
             
-            for recipe in recipes:
-                recipe_ingredients = ' '.join(map(str, recipe.get('ingredients', []))).lower()
-                has_forbidden = any(ingredient in recipe_ingredients for ingredient in forbidden_ingredients)
-                
-                if not has_forbidden:
-                    filtered_recipes.append(recipe)
+            # The posting lists are the CSR form of the transposed TF-IDF matrix
+            with stage('score'):
+                n_terms = len(self.vocabulary)
+                postings = sp.csr_matrix(
+                    (self.posting_weights, self.posting_rows, self.posting_indptr),
+                    shape=(n_terms, self.fitted_rows), copy=False
+                )
+                similarities = query_vectors[:, :n_terms] @ postings
+                if self.added_vectors is not None:
+                    similarities = sp.hstack([similarities, query_vectors @ self.added_vectors.T], format='csr')
             
-            return filtered_recipes
+            with stage('top_k'):
+                for position, i in enumerate(pending):
+                    top_n = int(queries[i].get('top_n', 5))
+                    if top_n <= 0:
+                        results[i] = empty
+                        continue
+                    start, end = similarities.indptr[position], similarities.indptr[position + 1]
+                    results[i] = self._select_top(
+                        similarities.indices[start:end], similarities.data[start:end],
+                        top_n, queries[i].get('diet_filter'),
+                        self.nutrient_bounds(queries[i].get('nutrition')),
+                        self.nutrient_weights(queries[i].get('nutrition_weights'))
+                    )
         
-        return recipes
+        for i in pending:
+            if keys[i] is not None:
+                self._cache_rows(keys[i], version, *results[i])
+        return results
     
-    def get_recipe_clusters(self):
-        """Get recipes grouped by clusters"""
-        if self.cluster_model is None:
-            return {"error": "Not enough recipes for clustering"}
+    def find_similar_recipes_batch(self, queries):
+        """Find recipes for many ingredient queries in one vectorised pass"""
+        try:
+            if self.ingredient_vectors is None or self.num_recipes == 0:
+                logger.warning("No recipes available for matching")
+                return [self._get_fallback_recipes() for _ in queries]
+            
+            results = []
+            for query, (rows, scores) in zip(queries, self.find_similar_rows_batch(queries)):
+                recipes = []
+                for idx, score in zip(rows, scores):
+                    recipe = self.store.get(idx)
+                    recipe['similarity_score'] = float(score)
+                    if query.get('nutrition') or query.get('nutrition_weights'):
+                        recipe['nutrition'] = self.get_nutrition(idx)
+                    recipes.append(recipe)
+                results.append(recipes)
+            
+            sampled(logger, logging.INFO, "Answered %d batched queries", len(results))
+            return results
+            
+        except Exception as e:
+            logger.error("Error in batch recipe matching: %s", e)
+            return [self._get_fallback_recipes() for _ in queries]
+    
+    def _select_top(self, rows, scores, top_n, diet_filter=None, bounds=None, weights=None):
+        """Pick the top_n eligible rows by score, padding with unmatched eligible rows"""
+        diet = diet_filter.lower() if diet_filter else None
+        if diet in self.diet_masks:
+            eligible = self.diet_masks[diet][rows]
+            rows, scores = rows[eligible], scores[eligible]
+            eligible_rows = self.diet_rows[diet]
+        else:
+            eligible_rows = None
+        
+        # Nutrition masks and weights only touch the candidates, so they cost
+        # about as much as the diet mask above
+        if bounds is not None or weights is not None:
+            values = self.recipe_nutrition[rows]
+            if bounds is not None:
+                keep = self._within_bounds(values, bounds)
+                rows, scores, values = rows[keep], scores[keep], values[keep]
+            if weights is not None:
+                scores = scores + values @ weights
+        
+        if len(rows) > top_n:
+            top = np.argpartition(-scores, top_n - 1)[:top_n]
+            rows, scores = rows[top], scores[top]
         
+        # Highest score first, ties broken by catalogue order
+        order = np.lexsort((rows, -scores))
+        rows, scores = rows[order], scores[order]
+        
+        missing = top_n - len(rows)
+        if missing > 0:
+            # Recipes sharing no term with the query still count as results
+            # when there are not enough scored ones
+            if bounds is not None:
+                # Only padding needs the constraint mask over the whole catalogue
+                eligible = self._within_bounds(self.recipe_nutrition[:self.num_recipes], bounds)
+                if diet in self.diet_masks:
+                    eligible &= self.diet_masks[diet]
+                pool = np.flatnonzero(eligible)[:top_n + len(rows)]
+            elif eligible_rows is None:
+                pool = np.arange(min(self.num_recipes, top_n + len(rows)))
+            else:
+                pool = eligible_rows[:top_n + len(rows)]
+            padding = pool[~np.isin(pool, rows)][:missing]
+            rows = np.concatenate([rows, padding])
+            scores = np.concatenate([scores, np.zeros(len(padding))])
+        
+        return rows, scores
+    
+    def catalogue_state(self):
+        """Consistent (version, num_recipes) pair for cache keys"""
+        with self._lock:
+            return self.version, self.num_recipes
+    
+    def cluster_summaries(self):
+        """Size, top terms and representative rows of every cluster, or None without clusters"""
+        with self._lock:
+            if self.clusters is None:
+                return None
+            return self.clusters.summaries()
+    
+    def cluster_page(self, cluster_id, start, limit):
+        """(summary, member rows [start, start + limit)) of one cluster; None for an unknown id"""
+        with self._lock:
+            if self.clusters is None or not 0 <= cluster_id < self.clusters.n_clusters:
+                return None
+            return self.clusters.summary(cluster_id), self.clusters.members(cluster_id, start, start + limit)
+    
+    def get_recipe_clusters(self):
+        """Get cluster summaries with their representative recipes"""
         try:
-            clusters = {}
-            for i, cluster_id in enumerate(self.recipe_clusters):
-                if i < len(self.recipes_df):
-                    if cluster_id not in clusters:
-                        clusters[cluster_id] = []
-                    clusters[cluster_id].append(self.recipes_df.iloc[i].to_dict())
-            
-            return clusters
+            summaries = self.cluster_summaries()
+            if summaries is None:
+                return {"error": "Not enough recipes for clustering"}
+            for summary in summaries:
+                summary['representatives'] = [self.get_recipe(row) for row in summary['representatives']]
+            return {"clusters": summaries}
         except Exception as e:
             return {"error": f"Clustering error: {str(e)}"}
     
     def _get_fallback_recipes(self):
         """Return some sample recipes if matching fails"""
-        print("Using fallback recipes")
-        if len(self.recipes_df) > 0:
+        logger.warning("Using fallback recipes")
+        if self.num_recipes > 0:
             # Return first few recipes as fallback
-            return self.recipes_df.head(3).to_dict('records')
+            return self.store.records(0, 3)
         else:
             # Ultimate fallback
             return [
@@ -174,17 +1008,15 @@ class CookingTimePredictor:
             # Dairy
             'cheese': 5, 'milk': 2, 'cream': 3, 'yogurt': 2, 'butter': 2
         }
+        self._time_matcher = KeywordMatcher(self.ingredient_times)
     
     def predict_time(self, ingredients, difficulty='medium'):
         """Predict cooking time based on ingredients and difficulty"""
         base_time = 10  # Base prep time
         
         for ingredient in ingredients:
-            ingredient_lower = str(ingredient).lower()
-            for key, time in self.ingredient_times.items():
-                if key in ingredient_lower:
-                    base_time += time
-                    break
+            # The longest listed ingredient wins, so "sweet potato" beats "potatoes"
+            base_time += self._time_matcher.lookup(ingredient, 0)
         
         # Adjust for difficulty
         time_multipliers = {
@@ -0,0 +1,272 @@
+"""Latency histograms, counters and logging for the API
+
+Timers feed fixed-bucket histograms held in process; recording one is a
+perf_counter() pair, a bisect and a short locked update. Counters can also
+be read from callbacks at collection time, which is how existing cache hit
+and miss counts are exported without touching the caches' hot path.
+
+/api/metrics renders the Prometheus text format. gunicorn runs several
+worker processes, so with METRICS_DIR set every process writes a snapshot
+of its metrics to METRICS_DIR/metrics-<pid>-<start>.json every FLUSH_INTERVAL
+seconds and at exit, and a scrape of any worker merges all the snapshots.
+Snapshots of exited workers are kept so totals never go backwards; empty
+the directory when deploying. Without METRICS_DIR each worker reports only
+itself.
+
+configure_logging() sends log records through a queue to a background
+thread, so request threads never block on writing stdout, and sampled()
+logs only LOG_SAMPLE_RATE of the per-request messages.
+"""
+import atexit
+import bisect
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+METRIC_PREFIX = 'pantry_'
+# Upper bounds in seconds, from sub-millisecond scoring to model calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FLUSH_INTERVAL = 5.0
+
+_sample_rate = 1.0
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Timer:
+    """Context manager observing the time spent inside it; cheaper than @contextmanager"""
+    __slots__ = ('registry', 'name', 'labels', 'started')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+class Registry:
+    """Histograms and counters of one process, plus the merge across processes"""
+
+    def __init__(self, directory=None, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # name -> (help, buckets) / help
+        self._histogram_help = {}
+        self._counter_help = {}
+        # (name, labels) -> [bucket counts..., +Inf count] and sum
+        self._histograms = {}
+        self._sums = {}
+        self._counters = {}
+        self._callbacks = []
+        self._flusher = None
+        self._instance = self._instance_name()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A forked child starts counting from zero; the parent reports its own
+        self._lock = threading.Lock()
+        self._histograms, self._sums, self._counters = {}, {}, {}
+        self._flusher = None
+        self._instance = self._instance_name()
+
+    @staticmethod
+    def _instance_name():
+        # A worker reusing an exited worker's pid must not replace its snapshot
+        return f"{os.getpid()}-{time.time_ns()}"
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._histogram_help[name] = (help_text, tuple(buckets))
+
+    def counter(self, name, help_text, callback=None):
+        """Declare a counter; callback() -> {labels dict as tuple: value} is read at collection"""
+        self._counter_help[name] = help_text
+        if callback is not None:
+            self._callbacks.append((name, callback))
+
+    def observe(self, name, seconds, **labels):
+        buckets = self._histogram_help[name][1]
+        key = (name, _label_key(labels))
+        position = bisect.bisect_left(buckets, seconds)
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(buckets) + 1)
+                self._sums[key] = 0.0
+            counts[position] += 1
+            self._sums[key] += seconds
+        self._start_flusher()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._start_flusher()
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def snapshot(self):
+        """This process's metrics as JSON-serialisable lists"""
+        counters = {}
+        for name, callback in self._callbacks:
+            try:
+                for labels, value in callback().items():
+                    counters[(name, _label_key(dict(labels)))] = value
+            except Exception as e:
+                logging.getLogger(__name__).warning("Metrics callback for %s failed: %s", name, e)
+        with self._lock:
+            counters.update(self._counters)
+            return {
+                'histograms': [
+                    [name, list(labels), list(counts), self._sums[(name, labels)]]
+                    for (name, labels), counts in self._histograms.items()
+                ],
+                'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            }
+
+    def _snapshot_path(self, instance):
+        return os.path.join(self.directory, f"metrics-{instance}.json")
+
+    def flush(self):
+        """Write this process's snapshot for the other workers to merge"""
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, staging = tempfile.mkstemp(prefix='.metrics-', dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(staging, self._snapshot_path(self._instance))
+        except OSError as e:
+            logging.getLogger(__name__).warning("Could not write metrics snapshot: %s", e)
+
+    def _start_flusher(self):
+        if self._flusher is not None or not self.directory:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='metrics-flush')
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def collect(self):
+        """Snapshots of every process in directory, this one's taken live"""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = self._snapshot_path(self._instance)
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path, 'r') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def render(self):
+        """Merged metrics in the Prometheus text exposition format"""
+        histograms, sums, counters = {}, {}, {}
+        for snapshot in self.collect():
+            for name, labels, counts, total in snapshot.get('histograms', []):
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    merged[i] += count
+                sums[key] = sums.get(key, 0.0) + total
+            for name, labels, value in snapshot.get('counters', []):
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+
+        lines = []
+        for name, (help_text, buckets) in sorted(self._histogram_help.items()):
+            full = METRIC_PREFIX + name
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} histogram")
+            for key in sorted(k for k in histograms if k[0] == name):
+                labels, counts = key[1], histograms[key]
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f"{full}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {sums[key]!r}")
+                lines.append(f"{full}_count{_format_labels(labels)} {cumulative}")
+        for name, help_text in sorted(self._counter_help.items()):
+            full = METRIC_PREFIX + name
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} counter")
+            for key in sorted(k for k in counters if k[0] == name):
+                lines.append(f"{full}{_format_labels(key[1])} {_format_value(counters[key])}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry(os.environ.get('METRICS_DIR') or None)
+REGISTRY.histogram('http_request_duration_seconds', "Time to handle an API request, by route, method and status")
+REGISTRY.histogram('stage_duration_seconds', "Time spent in one stage of request handling")
+
+def stage(name):
+    """Time a block as one stage of handling a request, e.g. with stage('score'):"""
+    return REGISTRY.timer('stage_duration_seconds', stage=name)
+
+def sampled(logger, level, message, *args):
+    """Log a per-request message on about LOG_SAMPLE_RATE of calls"""
+    if logger.isEnabledFor(level) and (_sample_rate >= 1.0 or random.random() < _sample_rate):
+        logger.log(level, message, *args)
+
+def configure_logging(level='INFO', sample_rate=1.0):
+    """Log to stdout from a background thread, at level, sampling sampled() calls at sample_rate"""
+    global _sample_rate
+    _sample_rate = max(0.0, min(1.0, float(sample_rate)))
+    root = logging.getLogger()
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'))
+    
+    def start_listener():
+        listener = logging.handlers.QueueListener(records, output)
+        listener.start()
+        atexit.register(listener.stop)
+    
+    start_listener()
+    if hasattr(os, 'register_at_fork'):
+        # The writer thread does not survive a fork (gunicorn --preload)
+        os.register_at_fork(after_in_child=start_listener)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
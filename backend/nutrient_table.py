@@ -0,0 +1,175 @@
+import json
+import logging
+import re
+import threading
+import numpy as np
+import scipy.sparse as sp
+from keyword_matcher import KeywordMatcher
+
+NUTRIENTS_PATH = 'data/nutrients.json'
+
+_FRACTIONS = {'½': ' 1/2', '¼': ' 1/4', '¾': ' 3/4', '⅓': ' 1/3', '⅔': ' 2/3', '⅛': ' 1/8'}
+_NUMBER = r'\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?'
+# Leading quantity (optionally a range such as "2-3"), then the rest of the text
+_QUANTITY = re.compile(rf'^\s*({_NUMBER})(?:\s*(?:-|to)\s*({_NUMBER}))?\s*(.*)$', re.DOTALL)
+
+logger = logging.getLogger(__name__)
+
+def _number(text):
+    """Value of '2', '1.5', '1/2' or '1 1/2'"""
+    total = 0.0
+    for part in text.split():
+        if '/' in part:
+            numerator, denominator = part.split('/')
+            total += float(numerator) / float(denominator) if float(denominator) else 0.0
+        else:
+            total += float(part)
+    return total
+
+def parse_amount(text):
+    """Split '200 g chicken' or '1 1/2 cups' into (quantity, unit word, rest)
+
+    quantity is None when the text has no leading number, and the unit word
+    is returned as written (lowercase) for the caller to resolve.
+    """
+    text = str(text).lower()
+    for fraction, replacement in _FRACTIONS.items():
+        text = text.replace(fraction, replacement)
+
+    quantity = None
+    match = _QUANTITY.match(text)
+    if match:
+        low, high, text = match.groups()
+        quantity = _number(low) if high is None else (_number(low) + _number(high)) / 2
+
+    # Units may be glued to the number ("200g") or abbreviated with a dot ("tbsp.")
+    word, _, rest = text.strip().partition(' ')
+    return quantity, word.rstrip('.,'), rest.strip()
+
+class NutrientTable:
+    """Ingredient-by-nutrient matrix loaded once from a data file
+
+    Rows hold per-gram nutrient values. A recipe becomes a sparse vector of
+    grams per ingredient row, so its nutrition is one vector-matrix product
+    and a whole catalogue is one sparse-dense matmul.
+    """
+
+    def __init__(self, path=NUTRIENTS_PATH):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load nutrient table %s: %s", path, e)
+            data = {"nutrients": ['calories', 'protein', 'carbs', 'fat'], "units": {}, "ingredients": {}}
+
+        self.nutrients = data['nutrients']
+        self.names = list(data['ingredients'])
+        entries = [data['ingredients'][name] for name in self.names]
+        self.matrix = np.array([entry['per_100g'] for entry in entries], dtype=np.float64).reshape(-1, len(self.nutrients)) / 100
+        self.portions = np.array([entry.get('portion_g', 100) for entry in entries], dtype=np.float64)
+        self.densities = np.array([entry.get('density', 1.0) for entry in entries], dtype=np.float64)
+
+        units = data.get('units', {})
+        self.mass_units = units.get('mass', {})
+        self.volume_units = units.get('volume', {})
+        self.count_units = set(units.get('count', []))
+
+        # Recipes matching fewer ingredients than this get a flat allowance
+        # for oil and seasonings
+        base = data.get('base', {})
+        self.min_matched = base.get('min_matched', 0)
+        self.base = np.array(base.get('values', [0] * len(self.nutrients)), dtype=np.float64)
+
+        keywords = {}
+        for row, entry in enumerate(entries):
+            for keyword in [self.names[row]] + entry.get('aliases', []):
+                keywords.setdefault(keyword.lower(), row)
+        self._matcher = KeywordMatcher(keywords)
+        # Resolved (row, grams) per distinct ingredient text
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, ingredient):
+        """(table row, grams) for a recipe ingredient, or (-1, 0.0) if unknown"""
+        if isinstance(ingredient, dict):
+            text = f"{ingredient.get('amount', '')} {ingredient.get('name', '')}"
+        else:
+            text = str(ingredient)
+        cached = self._resolved.get(text)
+        if cached is not None:
+            return cached
+
+        quantity, unit, rest = parse_amount(text)
+        is_unit = unit in self.mass_units or unit in self.volume_units or unit in self.count_units
+        # A bare word that doubles as a unit ("cloves") is the ingredient itself
+        name = rest if is_unit and rest else f"{unit} {rest}"
+        row = self._matcher.lookup(name)
+        if row is None:
+            resolved = (-1, 0.0)
+        else:
+            quantity = 1.0 if quantity is None else quantity
+            if unit in self.mass_units:
+                grams = quantity * self.mass_units[unit]
+            elif unit in self.volume_units:
+                grams = quantity * self.volume_units[unit] * self.densities[row]
+            else:
+                grams = quantity * self.portions[row]
+            resolved = (row, float(grams))
+
+        with self._lock:
+            if len(self._resolved) < 100000:
+                self._resolved[text] = resolved
+        return resolved
+
+    def ingredient_matrix(self, ingredient_lists):
+        """Sparse (recipes x table rows) matrix of grams, plus matched counts per recipe"""
+        recipe_index, rows, grams = [], [], []
+        for i, ingredients in enumerate(ingredient_lists):
+            for ingredient in ingredients if isinstance(ingredients, list) else [ingredients]:
+                row, amount = self.resolve(ingredient)
+                if row >= 0:
+                    recipe_index.append(i)
+                    rows.append(row)
+                    grams.append(amount)
+        return self._grams_matrix(np.array(recipe_index, dtype=np.int64), np.array(rows, dtype=np.int64),
+                                  np.array(grams, dtype=np.float64), len(ingredient_lists))
+
+    def _grams_matrix(self, recipe_index, rows, grams, n_recipes):
+        matrix = sp.csr_matrix((grams, (recipe_index, rows)), shape=(n_recipes, len(self.names)))
+        return matrix, np.bincount(recipe_index, minlength=n_recipes)
+
+    def _totals(self, grams_matrix, matched):
+        totals = np.asarray(grams_matrix @ self.matrix)
+        totals[matched < self.min_matched] += self.base
+        return totals
+
+    def estimate_batch(self, ingredient_lists):
+        """(recipes x nutrients) array for many ingredient lists in one product"""
+        return self._totals(*self.ingredient_matrix(ingredient_lists))
+
+    def estimate(self, ingredients):
+        """Nutrient totals for one recipe as a dict"""
+        return self.to_dict(self.estimate_batch([ingredients])[0])
+
+    def estimate_store(self, store, start=0, stop=None):
+        """(recipes x nutrients) array for store rows [start, stop)
+
+        Ingredients are resolved once per interned id used by those rows, so
+        estimating one new row costs its own ingredients rather than the whole
+        vocabulary, then the rows are a single sparse product against the table.
+        """
+        stop = len(store) if stop is None else stop
+        names = store.ingredient_names
+
+        offsets = store.ingredient_offsets[start:stop + 1]
+        ingredient_ids = store.ingredient_ids[offsets[0]:offsets[-1]]
+        recipe_index = np.repeat(np.arange(stop - start), np.diff(offsets))
+        used, positions = np.unique(ingredient_ids, return_inverse=True)
+        resolved = np.array([self.resolve(names[i]) for i in used], dtype=np.float64).reshape(-1, 2)
+        rows = resolved[positions, 0].astype(np.int64)
+        matched = rows >= 0
+        grams = resolved[positions, 1]
+        return self._totals(*self._grams_matrix(recipe_index[matched], rows[matched], grams[matched], stop - start))
+
+    def to_dict(self, totals):
+        return {name: round(float(value), 1) for name, value in zip(self.nutrients, totals)}
@@ -1,58 +1,224 @@
 import requests
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from caching import LRUCache, SQLiteCache
+from circuit_breaker import CircuitBreaker
+from keyword_matcher import KeywordMatcher
+from metrics import stage
+from nutrient_table import NutrientTable, parse_amount
 from dotenv import load_dotenv
 
 load_dotenv()
 
+EDAMAM_BASE_URL = 'https://api.edamam.com'
+NUTRITION_CACHE_PATH = 'data/nutrition_cache.sqlite'
+# Nutrition facts for a line do not change, so cached lines live for 30 days
+NUTRITION_CACHE_TTL = 30 * 24 * 3600
+# (connect, read) seconds per line request
+EDAMAM_TIMEOUT = (2, 5)
+MAX_PARALLEL_LINES = 8
+# Prefetched ingredients are looked up per this many grams and scaled
+PREFETCH_GRAMS = 100
+NUTRIENT_FIELDS = ['calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar', 'sodium']
+
+logger = logging.getLogger(__name__)
+
+def ingredient_line(ingredient):
+    """Edamam ingredient line for a recipe ingredient"""
+    if isinstance(ingredient, dict):
+        return f"{ingredient.get('amount', '1 portion')} {ingredient.get('name', 'ingredient')}"
+    # Generated recipes list "200g chicken breast"; only bare names need a portion
+    if parse_amount(ingredient)[0] is not None:
+        return str(ingredient)
+    return f"1 portion {ingredient}"
+
+def normalise_line(line):
+    return ' '.join(str(line).lower().split())
+
 class NutritionAnalyzer:
-    def __init__(self):
+    def __init__(self, base_url=None, session=None, cache=None, breaker=None, nutrient_table=None):
         self.edamam_app_id = os.getenv('EDAMAM_APP_ID')
         self.edamam_app_key = os.getenv('EDAMAM_APP_KEY')
         self.available = bool(self.edamam_app_id and self.edamam_app_key)
+        self.base_url = (base_url or os.getenv('EDAMAM_BASE_URL') or EDAMAM_BASE_URL).rstrip('/')
+        
+        # One pooled session keeps connections to Edamam alive between requests
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL_LINES)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+        
+        if cache is None:
+            cache_path = os.getenv('NUTRITION_CACHE_PATH', NUTRITION_CACHE_PATH)
+            backend = None
+            if cache_path:
+                try:
+                    backend = SQLiteCache(cache_path, ttl=NUTRITION_CACHE_TTL)
+                except Exception as e:
+                    logger.warning("Nutrition cache unavailable, using memory only: %s", e)
+            cache = LRUCache(max_entries=4096, ttl=NUTRITION_CACHE_TTL, backend=backend)
+        self.cache = cache
+        self.breaker = breaker or CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_LINES)
+        self.nutrient_table = nutrient_table or NutrientTable()
     
-    def analyze_recipe(self, recipe_title, ingredients):
-        """Analyze nutrition using Edamam API or fallback estimation"""
+    def analyze_recipe(self, recipe_title, ingredients, prefetched=None):
+        """Analyze nutrition using Edamam API or fallback estimation
+        
+        prefetched is the result of prefetch() for ingredients the recipe was
+        built from; lines using them are scaled from it instead of fetched.
+        """
         
         if self.available:
-            nutrition_data = self._call_edamam_api(ingredients)
+            nutrition_data = self._call_edamam_api(ingredients, prefetched)
             if nutrition_data:
                 return nutrition_data
         
         # Fallback to estimated nutrition
         return self._estimate_nutrition(ingredients)
     
-    def _call_edamam_api(self, ingredients):
-        """Call Edamam Nutrition Analysis API"""
-        try:
-            # Format ingredients for API
-            ingredient_lines = []
-            for ing in ingredients:
-                if isinstance(ing, dict):
-                    ingredient_lines.append(f"{ing.get('amount', '1 portion')} {ing.get('name', 'ingredient')}")
+    def prefetch(self, ingredient_names):
+        """Nutrition per PREFETCH_GRAMS g for bare ingredient names, keyed by name
+        
+        Meant to run while a recipe using them is still being written, so
+        analyze_recipe only has to fetch the lines it cannot derive from this.
+        """
+        if not self.available:
+            return {}
+        lines = {normalise_line(name): f"{PREFETCH_GRAMS} g {normalise_line(name)}" for name in ingredient_names}
+        
+        prefetched = {}
+        missing = []
+        for name, line in lines.items():
+            cached = self.cache.get(line)
+            if cached is None:
+                missing.append(name)
+            else:
+                prefetched[name] = cached
+        
+        if missing and self.breaker.allow():
+            for name, nutrition in zip(missing, self._fetch_lines([lines[name] for name in missing])):
+                if nutrition is not None:
+                    self.cache.set(lines[name], nutrition)
+                    prefetched[name] = nutrition
+        return prefetched
+    
+    def _scaled_line(self, line, names, prefetched):
+        """Nutrition for a line such as '200g chicken' from prefetched 'chicken', or None"""
+        name = names.longest(line)
+        quantity, unit, _ = parse_amount(line)
+        if name is None or quantity is None:
+            return None
+        if unit in self.nutrient_table.mass_units:
+            grams = quantity * self.nutrient_table.mass_units[unit]
+        else:
+            # Cups, spoons and counts need the ingredient's density or portion size
+            row, grams = self.nutrient_table.resolve(line)
+            if row < 0:
+                return None
+        scale = grams / PREFETCH_GRAMS
+        return {field: round(prefetched[name].get(field, 0) * scale, 1) for field in NUTRIENT_FIELDS}
+    
+    def _call_edamam_api(self, ingredients, prefetched=None):
+        """Sum per-line nutrition from the cache, fetching only the lines it lacks"""
+        lines = list(dict.fromkeys(normalise_line(ingredient_line(ing)) for ing in ingredients))
+        counts = {}
+        for ing in ingredients:
+            line = normalise_line(ingredient_line(ing))
+            counts[line] = counts.get(line, 0) + 1
+        
+        line_nutrition = {}
+        missing = []
+        for line in lines:
+            cached = self.cache.get(line)
+            if cached is None:
+                missing.append(line)
+            else:
+                line_nutrition[line] = cached
+        
+        if missing and prefetched:
+            # Derived lines are not cached; the cache only holds Edamam's
+            # answers. Names match whole words, so "egg" does not price "1 eggplant"
+            names = KeywordMatcher(prefetched, whole_words=True)
+            still_missing = []
+            for line in missing:
+                scaled = self._scaled_line(line, names, prefetched)
+                if scaled is None:
+                    still_missing.append(line)
                 else:
-                    ingredient_lines.append(f"1 portion {ing}")
-            
-            url = "https://api.edamam.com/api/nutrition-details"
-            params = {
-                'app_id': self.edamam_app_id,
-                'app_key': self.edamam_app_key
-            }
-            
-            payload = {
-                'title': "Generated Recipe",
-                'ingr': ingredient_lines
-            }
-            
-            response = requests.post(url, params=params, json=payload, timeout=10)
+                    line_nutrition[line] = scaled
+            missing = still_missing
+        
+        if missing:
+            if not self.breaker.allow():
+                logger.warning("Edamam circuit open, estimating nutrition")
+                return None
+            for line, nutrition in zip(missing, self._fetch_lines(missing)):
+                if nutrition is None:
+                    # A partial sum would understate the recipe
+                    return None
+                self.cache.set(line, nutrition)
+                line_nutrition[line] = nutrition
+        
+        total = {field: 0 for field in NUTRIENT_FIELDS}
+        for line, nutrition in line_nutrition.items():
+            for field in NUTRIENT_FIELDS:
+                total[field] += nutrition.get(field, 0) * counts[line]
+        total['source'] = "edamam"
+        return total
+    
+    def _fetch_lines(self, lines):
+        """Nutrition, or None, for each line, fetched in parallel
+        
+        While the breaker is half-open the first line is its trial call, and
+        the rest are only sent once that succeeds.
+        """
+        fetched = []
+        if self.breaker.probing:
+            fetched.append(self._fetch_line(lines[0]))
+            if fetched[0] is None:
+                return fetched + [None] * (len(lines) - 1)
+            lines = lines[1:]
+        return fetched + list(self._executor.map(self._fetch_line, lines))
+    
+    def _fetch_line(self, line):
+        """Nutrition for one ingredient line from Edamam, or None on failure"""
+        # Stop the rest of a batch once the breaker has tripped
+        if self.breaker.state == 'open':
+            return None
+        try:
+            with stage('edamam'):
+                response = self.session.get(
+                    f"{self.base_url}/api/nutrition-data",
+                    params={
+                        'app_id': self.edamam_app_id,
+                        'app_key': self.edamam_app_key,
+                        'ingr': line
+                    },
+                    timeout=EDAMAM_TIMEOUT
+                )
             
+            # 555 means Edamam could not parse the line; it has no nutrition
+            if response.status_code == 555:
+                self.breaker.record_success()
+                return {field: 0 for field in NUTRIENT_FIELDS}
             if response.status_code == 200:
-                return self._parse_edamam_response(response.json())
+                nutrition = self._parse_edamam_response(response.json())
+                if nutrition:
+                    self.breaker.record_success()
+                    nutrition.pop('source', None)
+                    return nutrition
             else:
-                print(f"Edamam API error: {response.status_code}")
+                logger.warning("Edamam API error: %s", response.status_code)
                 
         except Exception as e:
-            print(f"Edamam API call failed: {e}")
+            logger.warning("Edamam API call failed: %s", e)
         
+        self.breaker.record_failure()
         return None
     
     def _parse_edamam_response(self, data):
@@ -71,122 +237,122 @@ class NutritionAnalyzer:
                 "source": "edamam"
             }
         except Exception as e:
-            print(f"Error parsing Edamam response: {e}")
+            logger.error("Error parsing Edamam response: %s", e)
             return None
     
     def _estimate_nutrition(self, ingredients):
-        """Estimate nutrition based on common ingredients"""
-        nutrition_map = {
-            # Proteins
-            'chicken': {'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6},
-            'beef': {'calories': 250, 'protein': 26, 'carbs': 0, 'fat': 15},
-            'fish': {'calories': 206, 'protein': 22, 'carbs': 0, 'fat': 12},
-            'eggs': {'calories': 72, 'protein': 6, 'carbs': 0.4, 'fat': 5},
-            'paneer': {'calories': 265, 'protein': 18, 'carbs': 2, 'fat': 20},
-            'tofu': {'calories': 76, 'protein': 8, 'carbs': 2, 'fat': 4},
-            
-            # Grains
-            'rice': {'calories': 130, 'protein': 2.7, 'carbs': 28, 'fat': 0.3},
-            'pasta': {'calories': 131, 'protein': 5, 'carbs': 25, 'fat': 1},
-            'bread': {'calories': 265, 'protein': 9, 'carbs': 49, 'fat': 3},
-            
-            # Vegetables
-            'tomatoes': {'calories': 18, 'protein': 0.9, 'carbs': 3.9, 'fat': 0.2},
-            'onion': {'calories': 40, 'protein': 1.1, 'carbs': 9, 'fat': 0.1},
-            'potatoes': {'calories': 77, 'protein': 2, 'carbs': 17, 'fat': 0.1},
-            'carrots': {'calories': 41, 'protein': 0.9, 'carbs': 10, 'fat': 0.2},
-            'spinach': {'calories': 23, 'protein': 2.9, 'carbs': 3.6, 'fat': 0.4},
-            'broccoli': {'calories': 34, 'protein': 2.8, 'carbs': 7, 'fat': 0.4},
-            
-            # Dairy
-            'milk': {'calories': 42, 'protein': 3.4, 'carbs': 5, 'fat': 1},
-            'cheese': {'calories': 113, 'protein': 7, 'carbs': 0.9, 'fat': 9},
-            'butter': {'calories': 717, 'protein': 0.9, 'carbs': 0.1, 'fat': 81},
-            'cream': {'calories': 345, 'protein': 2.1, 'carbs': 2.9, 'fat': 37},
-            
-            # Legumes
-            'lentils': {'calories': 116, 'protein': 9, 'carbs': 20, 'fat': 0.4},
-            'beans': {'calories': 132, 'protein': 9, 'carbs': 24, 'fat': 0.5},
-            'chickpeas': {'calories': 139, 'protein': 7, 'carbs': 23, 'fat': 2},
-        }
-        
-        total = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0}
-        ingredient_count = 0
-        
-        for ingredient in ingredients:
-            ing_name = str(ingredient['name'] if isinstance(ingredient, dict) else ingredient).lower()
-            for key, nutrition in nutrition_map.items():
-                if key in ing_name:
-                    total['calories'] += nutrition['calories']
-                    total['protein'] += nutrition['protein']
-                    total['carbs'] += nutrition['carbs']
-                    total['fat'] += nutrition['fat']
-                    ingredient_count += 1
-                    break
-        
-        # Add base calories for oil/seasonings if few ingredients matched
-        if ingredient_count < 2:
-            total['calories'] += 200
-            total['protein'] += 8
-            total['carbs'] += 15
-            total['fat'] += 10
-        
+        """Estimate nutrition from the nutrient table, using amounts where given"""
+        total = self.nutrient_table.estimate(ingredients)
         total['source'] = "estimated"
         return total
 
+PLAN_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MEAL_TYPES = ['Breakfast', 'Lunch', 'Dinner']
+# Candidates scored once per plan; enough for 21 meals without early repeats
+CANDIDATE_POOL_SIZE = 60
+# A recipe is not served again until this many days have passed
+REPEAT_WINDOW_DAYS = 3
+# Meal objective: similarity + COVERAGE_WEIGHT * pantry coverage, minus
+# penalties for repeating a recipe or a cluster already served that day
+COVERAGE_WEIGHT = 0.5
+REUSE_PENALTY = 0.3
+SAME_DAY_CLUSTER_PENALTY = 0.2
+
 class MealPlanner:
     def __init__(self, recipe_matcher):
         self.recipe_matcher = recipe_matcher
+        self.store = recipe_matcher.store
+        # Cleaned name per interned ingredient id, extended as the store grows
+        self._clean_names = []
+        self._ids_by_clean_name = {}
+        self._basic_ids = set()
+        self._lock = threading.Lock()
     
-    def generate_weekly_plan(self, available_ingredients, diet_preference=None):
-        """Generate a weekly meal plan"""
-        days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        meal_types = ['Breakfast', 'Lunch', 'Dinner']
-        
-        plan = {}
-        shopping_list = set()
+    def _sync_ingredients(self):
+        """Classify ingredient ids interned since the last plan"""
+        with self._lock:
+            names = self.store.ingredient_names
+            for ingredient_id in range(len(self._clean_names), len(names)):
+                clean_name = self._clean_ingredient_name(names[ingredient_id])
+                self._clean_names.append(clean_name)
+                # Unnamed ingredients never go on the shopping list
+                if not clean_name or self._is_basic_ingredient(clean_name):
+                    self._basic_ids.add(ingredient_id)
+                self._ids_by_clean_name.setdefault(clean_name, []).append(ingredient_id)
+    
+    def generate_weekly_plan(self, available_ingredients, diet_preference=None, repeat_window=REPEAT_WINDOW_DAYS):
+        """Generate a weekly meal plan from one scored candidate pool"""
+        self._sync_ingredients()
         
         # Get available ingredients in lowercase for comparison
-        available_ingredients_lower = [ing.lower() for ing in available_ingredients]
+        available_ingredients_lower = {' '.join(str(ing).lower().split()) for ing in available_ingredients}
+        pantry_ids = set()
+        for name in available_ingredients_lower:
+            pantry_ids.update(self._ids_by_clean_name.get(name, ()))
         
-        for day in days:
+        rows, scores = self.recipe_matcher.find_similar_rows(
+            available_ingredients,
+            top_n=CANDIDATE_POOL_SIZE,
+            diet_filter=diet_preference
+        )
+        candidates = self._score_candidates(rows, scores, pantry_ids)
+        
+        plan = {}
+        used_ids = set()
+        last_served = {}
+        times_served = {}
+        
+        for day_index, day in enumerate(PLAN_DAYS):
             plan[day] = {}
-            for meal_type in meal_types:
-                # Get recipe suggestions based on available ingredients
-                recipes = self.recipe_matcher.find_similar_recipes(
-                    available_ingredients, 
-                    top_n=3, 
-                    diet_filter=diet_preference
-                )
+            clusters_today = {}
+            for meal_type in MEAL_TYPES:
+                if not candidates:
+                    continue
+                fresh = [c for c in candidates if day_index - last_served.get(c['row'], -repeat_window) >= repeat_window]
+                # A small pool cannot fill the week without repeats; relax the window then
+                choice = max(fresh or candidates, key=lambda c: (
+                    c['value']
+                    - REUSE_PENALTY * times_served.get(c['row'], 0)
+                    - SAME_DAY_CLUSTER_PENALTY * clusters_today.get(c['cluster'], 0),
+                    -c['row']
+                ))
+                
+                row = choice['row']
+                last_served[row] = day_index
+                times_served[row] = times_served.get(row, 0) + 1
+                if choice['cluster'] is not None:
+                    clusters_today[choice['cluster']] = clusters_today.get(choice['cluster'], 0) + 1
+                used_ids |= choice['ingredient_ids']
                 
-                if recipes:
-                    selected_recipe = recipes[0]  # Pick the best match
-                    plan[day][meal_type] = selected_recipe
-                    
-                    # Add missing ingredients to shopping list
-                    recipe_ingredients = selected_recipe.get('ingredients', [])
-                    
-                    for ingredient in recipe_ingredients:
-                        # Handle both string and object formats
-                        if isinstance(ingredient, dict):
-                            ing_name = ingredient.get('name', '')
-                        else:
-                            ing_name = str(ingredient)
-                        
-                        # Clean the ingredient name
-                        ing_name_clean = self._clean_ingredient_name(ing_name)
-                        
-                        # Check if this ingredient is not in available ingredients
-                        if (ing_name_clean and 
-                            ing_name_clean not in available_ingredients_lower and
-                            not self._is_basic_ingredient(ing_name_clean)):
-                            shopping_list.add(ing_name)
+                selected_recipe = self.store.get(row)
+                selected_recipe['similarity_score'] = choice['similarity']
+                plan[day][meal_type] = selected_recipe
         
+        # Everything the week uses that is neither in the pantry nor a staple
+        shopping_ids = used_ids - pantry_ids - self._basic_ids
+        names = self.store.ingredient_names
         return {
             'weekly_plan': plan,
-            'shopping_list': sorted(list(shopping_list))
+            'shopping_list': sorted({names[i] for i in shopping_ids})
         }
     
+    def _score_candidates(self, rows, scores, pantry_ids):
+        """Per-candidate ingredient sets, cluster and base objective value"""
+        clusters = self.recipe_matcher.recipe_clusters
+        candidates = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            ingredient_ids = set(self.store.ingredient_row(row).tolist())
+            needed = ingredient_ids - self._basic_ids
+            coverage = len(needed & pantry_ids) / len(needed) if needed else 1.0
+            candidates.append({
+                'row': row,
+                'similarity': score,
+                'ingredient_ids': ingredient_ids,
+                'cluster': int(clusters[row]) if clusters is not None and row < len(clusters) else None,
+                'value': score + COVERAGE_WEIGHT * coverage,
+            })
+        return candidates
+    
     def _clean_ingredient_name(self, ingredient_name):
         """Clean ingredient name for comparison"""
         if not ingredient_name:
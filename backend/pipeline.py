@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import sampled
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """One step of a Pipeline
+
+    fn is called with a dict holding the pipeline inputs and the results of
+    the stages (or inputs) listed in after. If it raises or runs past timeout
+    seconds the stage result is default and the pipeline carries on; a
+    callable default is called with the same dict to build the fallback.
+    """
+
+    def __init__(self, name, fn, after=(), timeout=None, default=None):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.default = default
+
+class PipelineResult:
+    def __init__(self):
+        self.results = {}
+        # Stage name -> 'timeout' or the error message, for stages that fell back
+        self.errors = {}
+        self.timings = {}
+
+    @property
+    def partial(self):
+        return bool(self.errors)
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+class Pipeline:
+    """Run dependent stages on a thread pool, overlapping the independent ones
+
+    A stage starts as soon as every stage it comes after has finished, so a
+    pipeline takes about as long as its slowest chain rather than the sum of
+    its stages. A stage that times out is abandoned, not interrupted: its
+    thread finishes in the background and the result is discarded.
+
+    arun() does the same from an event loop: coroutine stages run on the
+    loop (and are cancelled on timeout), plain functions on the pool.
+    """
+
+    def __init__(self, stages, executor=None):
+        self.stages = list(stages)
+        self.executor = executor or ThreadPoolExecutor(max_workers=max(1, len(self.stages)))
+
+    def run(self, **inputs):
+        result = PipelineResult()
+        values = dict(inputs)
+        pending = list(self.stages)
+        # future -> (stage, start time, deadline or None)
+        running = {}
+
+        while pending or running:
+            for stage in self._ready(pending, values):
+                running[self.executor.submit(stage.fn, dict(values))] = self._timing(stage)
+            if not running:
+                self._unresolved(result, values, pending)
+                break
+
+            done, _ = wait(running, timeout=self._wait_timeout(running), return_when=FIRST_COMPLETED)
+            self._collect(result, values, running, done)
+        return result
+
+    async def arun(self, **inputs):
+        loop = asyncio.get_running_loop()
+        result = PipelineResult()
+        values = dict(inputs)
+        pending = list(self.stages)
+        running = {}
+
+        while pending or running:
+            for stage in self._ready(pending, values):
+                if asyncio.iscoroutinefunction(stage.fn):
+                    task = asyncio.ensure_future(stage.fn(dict(values)))
+                else:
+                    task = asyncio.ensure_future(loop.run_in_executor(self.executor, stage.fn, dict(values)))
+                running[task] = self._timing(stage)
+            if not running:
+                self._unresolved(result, values, pending)
+                break
+
+            done, _ = await asyncio.wait(running, timeout=self._wait_timeout(running), return_when=asyncio.FIRST_COMPLETED)
+            self._collect(result, values, running, done)
+        return result
+
+    def _ready(self, pending, values):
+        """Remove and return the pending stages whose inputs are all available"""
+        ready = [stage for stage in pending if all(name in values for name in stage.after)]
+        for stage in ready:
+            pending.remove(stage)
+        return ready
+
+    def _timing(self, stage):
+        started = time.monotonic()
+        return stage, started, started + stage.timeout if stage.timeout is not None else None
+
+    def _wait_timeout(self, running):
+        deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _collect(self, result, values, running, done):
+        """Record finished stages, then give up on any past their deadline"""
+        now = time.monotonic()
+        for future in done:
+            stage, started, _ = running.pop(future)
+            try:
+                value = future.result()
+            except Exception as e:
+                sampled(logger, logging.WARNING, "Pipeline stage %s failed: %s", stage.name, e)
+                self._fail(result, values, stage, str(e), now - started)
+            else:
+                result.results[stage.name] = values[stage.name] = value
+                result.timings[stage.name] = now - started
+
+        for future, (stage, started, deadline) in list(running.items()):
+            if deadline is not None and now >= deadline:
+                del running[future]
+                future.cancel()
+                sampled(logger, logging.WARNING, "Pipeline stage %s timed out after %ss", stage.name, stage.timeout)
+                self._fail(result, values, stage, 'timeout', now - started)
+
+    def _unresolved(self, result, values, pending):
+        # A cycle, or a stage after something that is neither a stage nor an input
+        for stage in pending:
+            self._fail(result, values, stage, 'unresolved dependencies', 0.0)
+
+    def _fail(self, result, values, stage, error, elapsed):
+        default = stage.default(dict(values)) if callable(stage.default) else stage.default
+        result.results[stage.name] = values[stage.name] = default
+        result.errors[stage.name] = error
+        result.timings[stage.name] = elapsed
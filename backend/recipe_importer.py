@@ -0,0 +1,274 @@
+"""Stream large public recipe dumps into the recipe log
+
+    python recipe_importer.py dump.jsonl [--log data/recipes.jsonl] [--chunk-size 5000]
+
+Dumps may be JSON Lines or one top-level JSON array, optionally gzipped.
+Neither is read whole: lines are parsed one at a time and arrays element
+by element, so memory stays bounded by the chunk size. Each record is
+validated and mapped from the common dataset schemas (RecipeNLG, Food.com,
+Recipe1M) onto the catalogue's before being appended to the log in
+batches, which assigns fresh ids.
+"""
+import argparse
+import gzip
+import json
+import logging
+import re
+import time
+from recipe_log import RecipeLog, RECIPE_LOG_PATH
+
+READ_BLOCK = 1 << 16
+# An array element that is still incomplete after this many characters is malformed
+MAX_ELEMENT_CHARS = 1 << 24
+# Seconds between progress lines during a long load
+PROGRESS_INTERVAL = 5.0
+MAX_INGREDIENTS = 100
+DEFAULT_COOKING_TIME = 30
+DIFFICULTIES = {'easy', 'medium', 'hard'}
+
+# Source fields tried in order for each catalogue field. RecipeNLG's NER
+# column holds bare ingredient names, which is what matching expects.
+FIELD_ALIASES = {
+    'title': ['title', 'name', 'recipe_name', 'Name'],
+    'ingredients': ['NER', 'ingredients', 'RecipeIngredientParts', 'ingredient_list'],
+    'instructions': ['instructions', 'directions', 'steps', 'RecipeInstructions', 'method'],
+    'cooking_time': ['cooking_time', 'minutes', 'total_time', 'TotalTime', 'cook_time', 'CookTime', 'ready_in_minutes'],
+    'difficulty': ['difficulty', 'level'],
+    'dietary_tags': ['dietary_tags', 'diets', 'tags', 'Keywords'],
+    'cuisine': ['cuisine', 'cuisines'],
+}
+
+_R_VECTOR = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_ISO_DURATION = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+_LEADING_NUMBER = re.compile(r'^\s*(\d+(?:\.\d+)?)')
+
+logger = logging.getLogger(__name__)
+
+class InvalidRecipe(ValueError):
+    """A dump record that cannot become a catalogue recipe"""
+
+class LoadStats:
+    """Record counts and throughput for a streaming load"""
+
+    def __init__(self, label):
+        self.label = label
+        self.records = 0
+        self.skipped = {}
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    def skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+    def progress(self):
+        """Log a progress line at most every PROGRESS_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            logger.info("%s: %d records (%.0f records/s)", self.label, self.records, self.rate)
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        skipped = f", skipped {sum(self.skipped.values())} {self.skipped}" if self.skipped else ""
+        logger.info("%s: %d records in %.1fs (%.0f records/s)%s", self.label, self.records, elapsed, self.rate, skipped)
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+def iter_json_lines(f):
+    """Yield each line's JSON value, or InvalidRecipe for lines that do not parse"""
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield InvalidRecipe('invalid json')
+
+def iter_json_array(f, block_size=READ_BLOCK):
+    """Yield the elements of a top-level JSON array, reading block_size characters at a time"""
+    decoder = json.JSONDecoder()
+    buffer, pos = '', 0
+    started = False
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number cut off at the end of the block would decode short
+                if end < len(buffer) or eof:
+                    yield value
+                    pos = end
+                    continue
+            except ValueError:
+                if eof:
+                    raise ValueError(f"Invalid JSON array element near: {buffer[pos:pos + 80]!r}")
+            if len(buffer) - pos > MAX_ELEMENT_CHARS:
+                raise ValueError(f"JSON array element longer than {MAX_ELEMENT_CHARS} characters")
+        elif eof:
+            raise ValueError("Truncated JSON array")
+
+        chunk = f.read(block_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def iter_dump(path):
+    """Raw records from a JSON Lines or JSON array dump, by its first character"""
+    with open_dump(path) as f:
+        first = ''
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                first = ch
+                break
+        f.seek(0)
+        yield from (iter_json_array(f) if first == '[' else iter_json_lines(f))
+
+def _field(record, name):
+    for key in FIELD_ALIASES[name]:
+        value = record.get(key)
+        if value not in (None, '', []):
+            return value
+    return None
+
+def _clean(text):
+    return ' '.join(str(text).split())
+
+def _as_list(value, separator):
+    """List of cleaned strings from a list, a JSON-encoded list, an R c(...) vector or delimited text"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith('['):
+            try:
+                value = json.loads(text)
+            except ValueError:
+                value = [text]
+        elif text.startswith('c(') or text.startswith('"'):
+            # Food.com stores lists as R vectors: c("a", "b")
+            value = [item.replace('\\"', '"') for item in _R_VECTOR.findall(text)]
+        else:
+            value = text.split(separator)
+    if not isinstance(value, list):
+        value = [value]
+
+    items = []
+    for item in value:
+        if isinstance(item, dict):
+            # Recipe1M wraps each line as {"text": ...}
+            item = item.get('text') or item.get('name') or ''
+        item = _clean(item)
+        if item:
+            items.append(item)
+    return items
+
+def parse_minutes(value):
+    """Minutes from a number, '45 mins' or an ISO 8601 duration such as 'PT1H30M'"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().upper()
+    match = _ISO_DURATION.match(text)
+    if match and text != 'P':
+        days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+        return days * 1440 + hours * 60 + minutes + seconds // 60
+    match = _LEADING_NUMBER.match(text)
+    return int(float(match.group(1))) if match else None
+
+def normalise_record(record):
+    """Map a dump record onto the catalogue schema, or raise InvalidRecipe"""
+    if isinstance(record, InvalidRecipe):
+        raise record
+    if not isinstance(record, dict):
+        raise InvalidRecipe('not an object')
+
+    title = _clean(_field(record, 'title') or '')
+    if not title:
+        raise InvalidRecipe('missing title')
+    ingredients = [ingredient.lower() for ingredient in _as_list(_field(record, 'ingredients'), ',')]
+    if not ingredients:
+        raise InvalidRecipe('no ingredients')
+    if len(ingredients) > MAX_INGREDIENTS:
+        raise InvalidRecipe('too many ingredients')
+    instructions = _as_list(_field(record, 'instructions'), '\n')
+    if not instructions:
+        raise InvalidRecipe('no instructions')
+
+    cooking_time = parse_minutes(_field(record, 'cooking_time'))
+    difficulty = str(_field(record, 'difficulty') or 'medium').lower()
+    recipe = {
+        "title": title,
+        "ingredients": ingredients,
+        "instructions": instructions,
+        "cooking_time": cooking_time if cooking_time and cooking_time > 0 else DEFAULT_COOKING_TIME,
+        "difficulty": difficulty if difficulty in DIFFICULTIES else 'medium',
+        "dietary_tags": [tag.lower() for tag in _as_list(_field(record, 'dietary_tags'), ',')],
+    }
+    cuisine = _field(record, 'cuisine')
+    if isinstance(cuisine, list):
+        cuisine = cuisine[0] if cuisine else None
+    if cuisine:
+        recipe['cuisine'] = _clean(cuisine).lower()
+    return recipe
+
+def iter_recipes(path, stats=None):
+    """Valid, normalised recipes from a dump; invalid records are counted in stats"""
+    for record in iter_dump(path):
+        try:
+            recipe = normalise_record(record)
+        except InvalidRecipe as e:
+            if stats is not None:
+                stats.skip(str(e))
+            continue
+        yield recipe
+
+def import_dump(path, log_path=RECIPE_LOG_PATH, chunk_size=5000):
+    """Append every valid recipe in a dump to the recipe log; returns the LoadStats"""
+    log = RecipeLog(log_path)
+    stats = LoadStats(f"Importing {path}")
+    batch = []
+    for recipe in iter_recipes(path, stats):
+        batch.append(recipe)
+        if len(batch) >= chunk_size:
+            log.append_many(batch)
+            stats.records += len(batch)
+            stats.progress()
+            batch = []
+    if batch:
+        log.append_many(batch)
+        stats.records += len(batch)
+    stats.report()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a recipe dataset into the recipe log")
+    parser.add_argument('dump', help="JSON Lines or JSON array file, optionally .gz")
+    parser.add_argument('--log', default=RECIPE_LOG_PATH, help="Recipe log path")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Recipes per log write")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    import_dump(args.dump, args.log, args.chunk_size)
+
+if __name__ == '__main__':
+    main()
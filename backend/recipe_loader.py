@@ -1,65 +1,103 @@
-import pandas as pd
-import json
+import logging
 import os
+from recipe_importer import LoadStats
+from recipe_log import RecipeLog, RECIPE_LOG_PATH
+from recipe_store import RecipeStore
+from metrics import sampled
 
-def load_recipes():
-    """Load recipes from JSON file"""
+logger = logging.getLogger(__name__)
+
+# The catalogue lives in the recipe log; this JSON file seeds it on first start
+RECIPES_PATH = 'data/sample_recipes.json'
+# Recipes read from the log per step; bounds memory beyond the store itself
+LOAD_CHUNK_SIZE = 10000
+
+def load_recipes(log_path=RECIPE_LOG_PATH, on_chunk=None, chunk_size=LOAD_CHUNK_SIZE):
+    """Stream the recipe log into a RecipeStore
+    
+    Returns (store, position); pass position to read_new_recipes() to pick up
+    recipes saved after this load. on_chunk(store, start, stop) is called
+    as each chunk of rows lands, so indexing can proceed alongside loading.
+    """
+    log = RecipeLog(log_path)
+    store = RecipeStore()
     try:
-        with open('data/sample_recipes.json', 'r', encoding='utf-8') as f:
-            recipes = json.load(f)
-        print(f"Successfully loaded {len(recipes)} recipes from JSON file")
-        return pd.DataFrame(recipes)
-    except FileNotFoundError:
-        print("Recipe file not found, creating sample data...")
-        # Return comprehensive sample data if file doesn't exist
-        sample_recipes = [
-            {
-                "id": 1,
-                "title": "Quick Vegetable Stir Fry",
-                "ingredients": ["mixed vegetables", "soy sauce", "garlic", "oil", "rice"],
-                "instructions": ["Heat oil in pan", "Add garlic and stir-fry", "Add vegetables and cook", "Add soy sauce", "Serve with rice"],
-                "cooking_time": 20,
-                "difficulty": "easy",
-                "dietary_tags": ["vegetarian", "vegan"],
-                "cuisine": "asian"
-            },
-            {
-                "id": 2,
-                "title": "Classic Chicken Curry",
-                "ingredients": ["chicken", "onion", "tomatoes", "spices", "oil", "rice"],
-                "instructions": ["Heat oil and sauté onions", "Add chicken and brown", "Add tomatoes and spices", "Simmer until cooked", "Serve with rice"],
-                "cooking_time": 40,
-                "difficulty": "medium",
-                "dietary_tags": ["non-vegetarian"],
-                "cuisine": "indian"
-            }
-        ]
-        return pd.DataFrame(sample_recipes)
+        if not log.exists():
+            if os.path.exists(RECIPES_PATH):
+                log.import_json(RECIPES_PATH)
+            else:
+                seed_sample_recipes(log)
+        
+        stats = LoadStats(f"Loading {log_path}")
+        for chunk in log.iter_chunks(chunk_size=chunk_size):
+            start = len(store)
+            for recipe in chunk:
+                # One unreadable record must not cost the rest of the catalogue
+                try:
+                    store.append(recipe)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    stats.skip('invalid record')
+                    continue
+                stats.records += 1
+            if on_chunk is not None:
+                on_chunk(store, start, len(store))
+            stats.progress()
+        stats.report()
+        
+        if log.skipped:
+            log.compact()
+        return store, log.position
     except Exception as e:
-        print(f"Error loading recipes: {e}")
-        return pd.DataFrame()
+        # Keep what loaded; the next sync resumes after it
+        logger.error("Error loading recipes: %s", e)
+        return store, log.position
+
+def seed_sample_recipes(log):
+    """Start an empty log with a couple of sample recipes"""
+    logger.info("Recipe file not found, creating sample data...")
+    # Comprehensive sample data for when no recipe file exists
+    sample_recipes = [
+        {
+            "id": 1,
+            "title": "Quick Vegetable Stir Fry",
+            "ingredients": ["mixed vegetables", "soy sauce", "garlic", "oil", "rice"],
+            "instructions": ["Heat oil in pan", "Add garlic and stir-fry", "Add vegetables and cook", "Add soy sauce", "Serve with rice"],
+            "cooking_time": 20,
+            "difficulty": "easy",
+            "dietary_tags": ["vegetarian", "vegan"],
+            "cuisine": "asian"
+        },
+        {
+            "id": 2,
+            "title": "Classic Chicken Curry",
+            "ingredients": ["chicken", "onion", "tomatoes", "spices", "oil", "rice"],
+            "instructions": ["Heat oil and sauté onions", "Add chicken and brown", "Add tomatoes and spices", "Simmer until cooked", "Serve with rice"],
+            "cooking_time": 40,
+            "difficulty": "medium",
+            "dietary_tags": ["non-vegetarian"],
+            "cuisine": "indian"
+        }
+    ]
+    for recipe in sample_recipes:
+        log.append(recipe)
 
-def save_recipe(new_recipe):
-    """Save a new recipe to the JSON file"""
+def read_new_recipes(position, log_path=RECIPE_LOG_PATH):
+    """Recipes saved (by any worker) since position, and the position after them
+    
+    Costs one stat() when nothing has been saved.
+    """
     try:
-        with open('data/sample_recipes.json', 'r', encoding='utf-8') as f:
-            recipes = json.load(f)
-    except FileNotFoundError:
-        recipes = []
+        return RecipeLog(log_path).read(position)
     except Exception as e:
-        print(f"Error reading recipe file: {e}")
-        recipes = []
-    
-    # Assign new ID
-    new_id = max([r['id'] for r in recipes]) + 1 if recipes else 1
-    new_recipe['id'] = new_id
-    recipes.append(new_recipe)
-    
+        logger.error("Error reading recipe log: %s", e)
+        return [], position
+
+def save_recipe(new_recipe, log_path=RECIPE_LOG_PATH):
+    """Append a new recipe to the recipe log, assigning its ID"""
     try:
-        with open('data/sample_recipes.json', 'w', encoding='utf-8') as f:
-            json.dump(recipes, f, indent=2, ensure_ascii=False)
-        print(f"Recipe saved with ID: {new_id}")
+        new_recipe = RecipeLog(log_path).append(new_recipe)
+        sampled(logger, logging.INFO, "Recipe saved with ID: %s", new_recipe['id'])
         return new_recipe
     except Exception as e:
-        print(f"Error saving recipe: {e}")
+        logger.error("Error saving recipe: %s", e)
         return None
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""Append-only recipe catalogue in JSON Lines, shared by worker processes
+
+One recipe per line. A save appends a single line with one write() and
+fsyncs it, so its cost does not depend on the size of the catalogue, and a
+crash can at worst leave a torn last line, which readers skip and the next
+writer truncates. Writers serialise on an flock()ed lock file, which is
+also what makes id allocation atomic across gunicorn workers: ids increase
+along the file, so the next one comes from the last line.
+
+Readers take no lock. read() returns the records after a position and the
+position to resume from, which lets workers tail the file for recipes
+saved elsewhere. Compaction rewrites the file under a new inode, and a
+reader whose position names the old inode starts again from the top.
+
+    python recipe_log.py import data/sample_recipes.json
+    python recipe_log.py compact
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+RECIPE_LOG_PATH = 'data/recipes.jsonl'
+# Bytes read per step when scanning back from the end of the file
+TAIL_BLOCK = 4096
+# Records per chunk when streaming the log
+READ_CHUNK_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+class RecipeLog:
+    def __init__(self, path=RECIPE_LOG_PATH):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        # Lines the last read() could not use: torn, invalid or duplicate ids
+        self.skipped = 0
+        # Where the last read() stopped
+        self.position = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, recipe):
+        """Assign the next id to recipe and durably append it; returns the recipe"""
+        return self.append_many([recipe])[0]
+
+    def append_many(self, recipes):
+        """append() for a batch, with one write and one fsync for all of them"""
+        with self._locked():
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = self._recover_tail(fd)
+                last_id = self._last_id(fd, size) or 0
+                lines = []
+                for recipe in recipes:
+                    last_id += 1
+                    recipe['id'] = last_id
+                    lines.append(json.dumps(recipe, ensure_ascii=False) + '\n')
+                data = ''.join(lines).encode('utf-8')
+                written = 0
+                try:
+                    # write() can stop short, e.g. when the disk fills up
+                    while written < len(data):
+                        count = os.write(fd, data[written:])
+                        if count == 0:
+                            raise OSError(f"Short write appending to {self.path}")
+                        written += count
+                except OSError:
+                    # Take back the part of the batch that did land
+                    os.ftruncate(fd, size)
+                    raise
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return recipes
+
+    def _recover_tail(self, fd):
+        """Truncate a torn last line left by a crashed writer; returns the file size"""
+        size = os.fstat(fd).st_size
+        if size == 0 or os.pread(fd, 1, size - 1) == b'\n':
+            return size
+        end = self._last_newline(fd, size)
+        logger.warning("Recipe log %s: dropping %d bytes of an incomplete record", self.path, size - end)
+        os.ftruncate(fd, end)
+        os.fsync(fd)
+        return end
+
+    def _last_newline(self, fd, size):
+        """Offset just past the last newline before size, or 0"""
+        end = size
+        while end > 0:
+            start = max(0, end - TAIL_BLOCK)
+            index = os.pread(fd, end - start, start).rfind(b'\n')
+            if index >= 0:
+                return start + index + 1
+            end = start
+        return 0
+
+    def _last_id(self, fd, size):
+        """Id of the last parseable record, scanning back from size"""
+        end = size
+        while end > 0:
+            start = self._last_newline(fd, end - 1)
+            try:
+                return int(json.loads(os.pread(fd, end - start, start))['id'])
+            except (ValueError, KeyError, TypeError):
+                end = start
+        return None
+
+    def read(self, position=None):
+        """(records after position, new position); position None reads everything
+
+        Positions are (inode, offset) pairs. Only complete lines are read, so a
+        record being appended concurrently is picked up by the next call.
+        """
+        records = [record for chunk in self.iter_chunks(position) for record in chunk]
+        return records, self.position
+
+    def iter_chunks(self, position=None, chunk_size=READ_CHUNK_SIZE):
+        """Yield lists of at most chunk_size records after position
+
+        The file is read a line at a time, so memory is bounded by the chunk
+        size rather than the log. Once exhausted, self.position is where the
+        next read should resume and self.skipped counts the lines passed over.
+        """
+        self.skipped = 0
+        self.position = position
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        offset = position[1] if position is not None and position[0] == stat.st_ino else 0
+        self.position = (stat.st_ino, offset)
+        if offset == stat.st_size:
+            return
+
+        chunk = []
+        last_id = None
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn, or still being written
+                    self.skipped += 1
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                    recipe_id = int(record['id'])
+                except (ValueError, KeyError, TypeError):
+                    self.skipped += 1
+                    continue
+                # Ids increase along the log, so anything else is a duplicate
+                if last_id is not None and recipe_id <= last_id:
+                    self.skipped += 1
+                    continue
+                last_id = recipe_id
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    self.position = (stat.st_ino, offset)
+                    yield chunk
+                    chunk = []
+        self.position = (stat.st_ino, offset)
+        if chunk:
+            yield chunk
+
+    def import_json(self, json_path):
+        """One-time import of a JSON array of recipes into an empty log
+
+        Records keep their ids and are written in id order, so appends carry
+        on from the highest one. Returns the number imported, or 0 if the log
+        already had records.
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            recipes = json.load(f)
+        with self._locked():
+            if self.exists() and os.path.getsize(self.path) > 0:
+                return 0
+            next_id = max([r['id'] for r in recipes if isinstance(r.get('id'), int)], default=0) + 1
+            for recipe in recipes:
+                if not isinstance(recipe.get('id'), int):
+                    recipe['id'] = next_id
+                    next_id += 1
+            self._rewrite(sorted(recipes, key=lambda r: r['id']))
+        logger.info("Imported %d recipes from %s into %s", len(recipes), json_path, self.path)
+        return len(recipes)
+
+    def compact(self):
+        """Rewrite the log without torn, invalid or duplicate lines; returns lines dropped"""
+        with self._locked():
+            for _ in self.iter_chunks():
+                pass
+            dropped = self.skipped
+            if dropped:
+                self._rewrite(record for chunk in self.iter_chunks() for record in chunk)
+                logger.warning("Compacted recipe log %s: dropped %d lines", self.path, dropped)
+        return dropped
+
+    def _rewrite(self, records):
+        """Atomically replace the log with records (caller holds the lock)"""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(self.path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the recipe log")
+    parser.add_argument('command', choices=['import', 'compact'])
+    parser.add_argument('source', nargs='?', default='data/sample_recipes.json', help="JSON file to import")
+    parser.add_argument('--log', default=RECIPE_LOG_PATH, help="Recipe log path")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    log = RecipeLog(args.log)
+    if args.command == 'import':
+        if not log.import_json(args.source):
+            print(f"{args.log} already has recipes; nothing imported")
+    else:
+        log.compact()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import json
+import numpy as np
+
+DIFFICULTIES = ['easy', 'medium', 'hard']
+
+def grow_array(array, needed):
+    """Return array with room for at least `needed` entries (rows, for 2-D arrays)
+
+    Capacity at least doubles, so appending n entries copies O(n) in total.
+    """
+    if needed <= len(array):
+        return array
+    grown = np.empty((max(needed, 2 * len(array), 16),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def _integer(value, default, dtype):
+    """value as an int that fits dtype, or default if it is not one"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    limits = np.iinfo(dtype)
+    return number if limits.min <= number <= limits.max else default
+
+class RecipeStore:
+    """Columnar, append-only recipe catalogue
+
+    Scalar fields live in typed numpy columns, ingredient lists are interned
+    ids in CSR-style offsets, and each recipe is kept pre-serialised as JSON
+    so materialising a result is a slice of one byte buffer.
+    """
+
+    def __init__(self, recipes=()):
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._cooking_times = np.empty(0, dtype=np.int32)
+        self._difficulty_codes = np.empty(0, dtype=np.int8)
+        self._cuisine_codes = np.empty(0, dtype=np.int16)
+        self._ingredient_offsets = np.zeros(1, dtype=np.int64)
+        self._ingredient_ids = np.empty(0, dtype=np.int32)
+        self._blob_offsets = np.zeros(1, dtype=np.int64)
+        self._blob = bytearray()
+
+        self.difficulties = list(DIFFICULTIES)
+        self.cuisines = []
+        self.ingredient_names = []
+        self._difficulty_lookup = {name: code for code, name in enumerate(self.difficulties)}
+        self._cuisine_lookup = {}
+        self._ingredient_lookup = {}
+        self._rows_by_id = {}
+
+        for recipe in recipes:
+            self.append(recipe)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def cooking_times(self):
+        return self._cooking_times[:self._size]
+
+    @property
+    def difficulty_codes(self):
+        return self._difficulty_codes[:self._size]
+
+    @property
+    def cuisine_codes(self):
+        """Index into self.cuisines per recipe, -1 when no cuisine is set"""
+        return self._cuisine_codes[:self._size]
+
+    @property
+    def ingredient_offsets(self):
+        return self._ingredient_offsets[:self._size + 1]
+
+    @property
+    def ingredient_ids(self):
+        return self._ingredient_ids[:self._ingredient_offsets[self._size]]
+
+    def _intern(self, value, names, lookup):
+        """Return the code for value, adding it to the enum if new"""
+        code = lookup.get(value)
+        if code is None:
+            code = len(names)
+            names.append(value)
+            lookup[value] = code
+        return code
+
+    def intern_ingredient(self, name):
+        return self._intern(name, self.ingredient_names, self._ingredient_lookup)
+
+    def lookup_ingredient(self, name):
+        """Interned id of an ingredient name, or None if no recipe uses it"""
+        return self._ingredient_lookup.get(name)
+
+    def append(self, recipe):
+        """Add a recipe and return its row"""
+        row = self._size
+        ingredients = recipe.get('ingredients', [])
+        if not isinstance(ingredients, list):
+            ingredients = [ingredients]
+        ingredient_ids = [
+            self.intern_ingredient(ingredient.get('name', '') if isinstance(ingredient, dict) else str(ingredient))
+            for ingredient in ingredients
+        ]
+        blob = json.dumps(recipe, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        size = row + 1
+        self._ids = grow_array(self._ids, size)
+        self._cooking_times = grow_array(self._cooking_times, size)
+        self._difficulty_codes = grow_array(self._difficulty_codes, size)
+        self._cuisine_codes = grow_array(self._cuisine_codes, size)
+        self._ingredient_offsets = grow_array(self._ingredient_offsets, size + 1)
+        self._blob_offsets = grow_array(self._blob_offsets, size + 1)
+
+        recipe_id = recipe.get('id')
+        # Saved recipes come from clients, so values that are not integers
+        # are stored as -1 (id) or 0 (cooking time) rather than rejected
+        self._ids[row] = _integer(recipe_id, -1, np.int64)
+        self._cooking_times[row] = _integer(recipe.get('cooking_time') or 0, 0, np.int32)
+        difficulty = recipe.get('difficulty')
+        self._difficulty_codes[row] = -1 if difficulty is None else self._intern(str(difficulty), self.difficulties, self._difficulty_lookup)
+        cuisine = recipe.get('cuisine')
+        self._cuisine_codes[row] = -1 if cuisine is None else self._intern(str(cuisine), self.cuisines, self._cuisine_lookup)
+
+        start = self._ingredient_offsets[row]
+        self._ingredient_ids = grow_array(self._ingredient_ids, start + len(ingredient_ids))
+        self._ingredient_ids[start:start + len(ingredient_ids)] = ingredient_ids
+        self._ingredient_offsets[row + 1] = start + len(ingredient_ids)
+
+        self._blob += blob
+        self._blob_offsets[row + 1] = len(self._blob)
+
+        if recipe_id is not None:
+            self._rows_by_id[recipe_id] = row
+        # Publish the row only once every column holds it
+        self._size = size
+        return row
+
+    def has_id(self, recipe_id):
+        return recipe_id in self._rows_by_id
+
+    def row_of(self, recipe_id):
+        return self._rows_by_id.get(recipe_id)
+
+    def row_after_id(self, recipe_id):
+        """First row whose id is greater than recipe_id
+
+        Ids increase along the recipe log and rows are appended in log order,
+        so the ids column is sorted.
+        """
+        return int(np.searchsorted(self.ids, recipe_id, side='right'))
+
+    def get_json(self, row):
+        """Pre-serialised JSON bytes of the recipe at row"""
+        return bytes(self._blob[self._blob_offsets[row]:self._blob_offsets[row + 1]])
+
+    def get(self, row):
+        """Recipe at row as a fresh dict"""
+        return json.loads(self._blob[self._blob_offsets[row]:self._blob_offsets[row + 1]])
+
+    def records(self, start=0, stop=None):
+        """Recipes in [start, stop) as dicts"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return [self.get(row) for row in range(start, stop)]
+
+    def json_array(self, start=0, stop=None):
+        """Recipes in [start, stop) as the bytes of a JSON array"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return b'[' + b','.join(self.get_json(row) for row in range(start, stop)) + b']'
+
+    def ingredient_row(self, row):
+        """Interned ingredient ids of the recipe at row"""
+        return self._ingredient_ids[self._ingredient_offsets[row]:self._ingredient_offsets[row + 1]]
+
+    def ingredients(self, row):
+        """Ingredient names of the recipe at row"""
+        return [self.ingredient_names[i] for i in self.ingredient_row(row)]
+
+    def memory_usage(self):
+        """Approximate bytes held by the columns, offsets and JSON blob"""
+        arrays = [
+            self._ids, self._cooking_times, self._difficulty_codes, self._cuisine_codes,
+            self._ingredient_offsets, self._ingredient_ids, self._blob_offsets,
+        ]
+        interned = sum(len(name) for name in self.ingredient_names + self.cuisines + self.difficulties)
+        return sum(a.nbytes for a in arrays) + len(self._blob) + interned
@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, request
+from metrics import stage
+
+# Brotli is optional; without it clients get gzip
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+def _accepted_encodings(header):
+    """Content codings the client accepts, ignoring any with q=0"""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def _if_none_match_tags(header):
+    """Entity tags listed in an If-None-Match header, with weak prefixes stripped"""
+    return {tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip() for tag in header.split(',') if tag.strip()}
+
+class EncodedResponse:
+    """A JSON body encoded once, with pre-compressed variants and strong ETags"""
+
+    def __init__(self, body, status=200):
+        self.status = status
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # Each encoding is a distinct representation, so each gets its own tag
+        self.variants = {'identity': (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants['gzip'] = (gzip.compress(body, compresslevel=6, mtime=0), f'"{digest}-gzip"')
+            if brotli is not None:
+                self.variants['br'] = (brotli.compress(body, quality=5), f'"{digest}-br"')
+
+    def _negotiate(self, accept_encoding):
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+    def to_response(self):
+        """Serve the best variant for the current request, or a 304 if the client has it"""
+        encoding = self._negotiate(request.headers.get('Accept-Encoding', ''))
+        body, etag = self.variants[encoding]
+
+        if_none_match = _if_none_match_tags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(body, status=self.status, mimetype='application/json')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Let clients keep the body but revalidate it on every poll
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+class ResponseCache:
+    """Bounded LRU of encoded responses, cleared whenever the catalogue version changes"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, build):
+        """Return the EncodedResponse for key at version, calling build() on a miss"""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return encoded
+            self.misses += 1
+
+        with stage('serialise'):
+            encoded = build()
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = encoded
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return encoded
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
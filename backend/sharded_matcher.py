@@ -0,0 +1,591 @@
+"""Scatter-gather TF-IDF matching across worker processes
+
+ShardedMatcher splits a fitted RecipeMatcher's catalogue into contiguous
+row ranges, one per worker process. Each shard's posting lists, diet masks
+and nutrition estimates are copied once into multiprocessing.shared_memory
+blocks that its worker attaches to, so scoring runs on N cores without
+N private copies of the index.
+
+A query is encoded once by the coordinator, scattered to every shard,
+scored there against the shard's postings and filtered down to the shard's
+top_n; the coordinator merges the per-shard lists with a heap. Scores
+match RecipeMatcher.find_similar_rows exactly, since rows are scored with
+the same global vocabulary and idf. Ties go to the earlier row, including
+at the top_n cut-off, where the matcher's pick among tied rows is arbitrary.
+
+Recipes added after sharding are sent to the shard holding the fewest
+rows, which scores them directly as the matcher does its added rows. When
+the matcher finishes a background refit, the shards are rebuilt from it.
+
+The matcher's lock is held only to encode queries and to pad results;
+each shard's pipe has its own lock, held from sending a request to reading
+its reply. Requests take the pipes in shard order and release each as its
+reply arrives, so concurrent queries pipeline through the shards instead
+of waiting for one another's whole scatter-gather.
+
+Workers are started with the forkserver method (spawn where it is missing),
+so like any multiprocessing child they import the main module; run the app
+under gunicorn or flask rather than python app.py when sharding.
+"""
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.sparse as sp
+
+from matching_engine import OOV_BUCKETS
+from metrics import sampled, stage
+
+logger = logging.getLogger(__name__)
+
+def _attach(name):
+    try:
+        # Workers must not unlink blocks the coordinator owns
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument
+        return shared_memory.SharedMemory(name=name)
+
+class SharedArrays:
+    """Numpy arrays published in shared memory, one block per array
+
+    spec() describes the blocks for attach() in another process. Only the
+    creating process unlinks them, in close().
+    """
+
+    def __init__(self, arrays=None, spec=None):
+        self.blocks = []
+        self.arrays = {}
+        self._spec = {}
+        self._owner = spec is None
+        if spec is None:
+            for name, array in arrays.items():
+                if array is None:
+                    continue
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+                view[...] = array
+                self._add(name, block, view)
+        else:
+            for name, (block_name, shape, dtype) in spec.items():
+                block = _attach(block_name)
+                self._add(name, block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+
+    def _add(self, name, block, view):
+        self.blocks.append(block)
+        self.arrays[name] = view
+        self._spec[name] = (block.name, view.shape, view.dtype.str)
+
+    def spec(self):
+        return dict(self._spec)
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec=spec)
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def close(self):
+        # Views must go before the buffers they point into can be released
+        self.arrays = {}
+        for block in self.blocks:
+            block.close()
+            if self._owner:
+                try:
+                    block.unlink()
+                except FileNotFoundError:
+                    pass
+        self.blocks = []
+
+class Shard:
+    """One worker's rows [start, stop) of the catalogue"""
+
+    def __init__(self, spec, start, stop, n_terms, diets):
+        self.shared = SharedArrays.attach(spec)
+        arrays = self.shared.arrays
+        self.start = start
+        self.fitted_size = stop - start
+        self.n_terms = n_terms
+        self.posting_indptr = arrays['posting_indptr']
+        self.posting_rows = arrays['posting_rows']
+        self.posting_weights = arrays['posting_weights']
+        masks = arrays.get('diet_masks')
+        self.diet_masks = {diet: masks[i] for i, diet in enumerate(diets)} if masks is not None else {}
+        self.nutrition = arrays.get('nutrition')
+        # Recipes added since sharding, scored directly
+        self.added_rows = []
+        self.added_indices = []
+        self.added_data = []
+        self.added_diets = {diet: [] for diet in diets}
+        self.added_nutrition = []
+        self._added = None
+
+    def add(self, row, indices, data, diets, nutrition):
+        self.added_rows.append(row)
+        self.added_indices.append(np.asarray(indices))
+        self.added_data.append(np.asarray(data))
+        for diet in self.added_diets:
+            self.added_diets[diet].append(bool(diets.get(diet, True)))
+        if nutrition is not None:
+            self.added_nutrition.append(nutrition)
+        self._added = None
+
+    def _added_matrix(self):
+        if self._added is None:
+            lengths = [len(indices) for indices in self.added_indices]
+            self._added = sp.csr_matrix(
+                (np.concatenate(self.added_data), np.concatenate(self.added_indices), np.concatenate([[0], np.cumsum(lengths)])),
+                shape=(len(self.added_rows), self.n_terms + OOV_BUCKETS)
+            )
+        return self._added
+
+    def _score(self, indices, data):
+        """(local positions, scores) of the rows sharing a term with the query
+
+        Positions below the shard's fitted size are rows start + position;
+        the rest index the added recipes.
+        """
+        in_vocab = indices < self.n_terms
+        terms = indices[in_vocab]
+        starts = self.posting_indptr[terms]
+        ends = self.posting_indptr[terms + 1]
+        rows = [self.posting_rows[s:e] for s, e in zip(starts, ends)]
+        contributions = [self.posting_weights[s:e] * w for s, e, w in zip(starts, ends, data[in_vocab])]
+
+        if self.added_rows:
+            query = sp.csr_matrix((data, indices, [0, len(indices)]), shape=(1, self.n_terms + OOV_BUCKETS))
+            added = (self._added_matrix() @ query.T).tocoo()
+            rows.append(added.row + self.fitted_size)
+            contributions.append(added.data)
+
+        if sum(len(r) for r in rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        positions, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(positions))
+        return positions, scores
+
+    def search_many(self, queries):
+        """search() for each (indices, data, top_n, diet, bounds, weights) query
+
+        Several queries are scored with one sparse product against the
+        postings, as RecipeMatcher.find_similar_rows_batch does.
+        """
+        if len(queries) == 1:
+            return [self.search(*queries[0])]
+        matrix = sp.csr_matrix(
+            (np.concatenate([query[1] for query in queries]), np.concatenate([query[0] for query in queries]),
+             np.concatenate([[0], np.cumsum([len(query[0]) for query in queries])])),
+            shape=(len(queries), self.n_terms + OOV_BUCKETS)
+        )
+        postings = sp.csr_matrix(
+            (self.posting_weights, self.posting_rows, self.posting_indptr),
+            shape=(self.n_terms, self.fitted_size), copy=False
+        )
+        similarities = matrix[:, :self.n_terms] @ postings
+        if self.added_rows:
+            similarities = sp.hstack([similarities, matrix @ self._added_matrix().T], format='csr')
+        results = []
+        for i, query in enumerate(queries):
+            start, end = similarities.indptr[i], similarities.indptr[i + 1]
+            results.append(self._select(similarities.indices[start:end], similarities.data[start:end], *query[2:]))
+        return results
+
+    def search(self, indices, data, top_n, diet, bounds, weights):
+        """This shard's top_n eligible (rows, scores), best first, as catalogue rows"""
+        positions, scores = self._score(indices, data)
+        return self._select(positions, scores, top_n, diet, bounds, weights)
+
+    def _select(self, positions, scores, top_n, diet, bounds, weights):
+        """Filter scored local positions and keep the best top_n as catalogue rows"""
+        fitted = positions < self.fitted_size
+        added = positions[~fitted] - self.fitted_size
+
+        if diet in self.diet_masks:
+            eligible = np.empty(len(positions), dtype=bool)
+            eligible[fitted] = self.diet_masks[diet][positions[fitted]]
+            eligible[~fitted] = np.asarray(self.added_diets[diet], dtype=bool)[added]
+            positions, scores, fitted = positions[eligible], scores[eligible], fitted[eligible]
+            added = positions[~fitted] - self.fitted_size
+
+        if (bounds is not None or weights is not None) and self.nutrition is not None:
+            values = np.empty((len(positions), self.nutrition.shape[1]))
+            values[fitted] = self.nutrition[positions[fitted]]
+            if len(added):
+                values[~fitted] = np.asarray(self.added_nutrition)[added]
+            if bounds is not None:
+                columns, lows, highs = bounds
+                keep = ((values[:, columns] >= lows) & (values[:, columns] <= highs)).all(axis=1)
+                positions, scores, values, fitted = positions[keep], scores[keep], values[keep], fitted[keep]
+            if weights is not None:
+                scores = scores + values @ weights
+
+        rows = positions.astype(np.int64) + self.start
+        if not fitted.all():
+            rows[~fitted] = np.asarray(self.added_rows, dtype=np.int64)[positions[~fitted] - self.fitted_size]
+        if len(rows) > top_n:
+            # Keep every row tied at the cut-off so the earliest can win
+            threshold = np.partition(scores, len(scores) - top_n)[len(scores) - top_n]
+            keep = scores >= threshold
+            rows, scores = rows[keep], scores[keep]
+        order = np.lexsort((rows, -scores))[:top_n]
+        return rows[order], scores[order]
+
+    def close(self):
+        self.posting_indptr = self.posting_rows = self.posting_weights = self.nutrition = None
+        self.diet_masks = {}
+        self.shared.close()
+
+def _shard_worker(conn):
+    """Serve one shard over a pipe until told to close"""
+    shard = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        kind = message[0]
+        try:
+            if kind == 'load':
+                if shard is not None:
+                    shard.close()
+                spec, start, stop, n_terms, diets = message[1:]
+                shard = Shard(spec, start, stop, n_terms, diets)
+                conn.send(('ok', None))
+            elif kind == 'add':
+                shard.add(*message[1:])
+            elif kind == 'search':
+                conn.send(('ok', shard.search_many(message[1])))
+            elif kind == 'close':
+                break
+        except Exception as e:
+            if kind != 'add':
+                conn.send(('error', f"{type(e).__name__}: {e}"))
+            else:
+                logger.warning("Shard worker failed to add a recipe: %s", e)
+    if shard is not None:
+        shard.close()
+    conn.close()
+
+class ShardedMatcher:
+    """Serve a RecipeMatcher's sparse searches from n_shards worker processes
+
+    The matcher stays the source of truth (recipes are still added to it)
+    and answers everything sharding does not cover: dense retrieval modes,
+    clusters and nutrition lookups.
+    """
+
+    def __init__(self, matcher, n_shards=None):
+        self.matcher = matcher
+        self.n_shards = max(1, n_shards or os.cpu_count() or 1)
+        # Forking this process is unsafe once the app runs threads (the
+        # metrics listener, the pipeline pool), so workers come from a
+        # single-threaded fork server that has already imported this module
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if self._context.get_start_method() == 'forkserver':
+            self._context.set_forkserver_preload([__name__])
+        self._workers = []
+        # One per worker, held from a request to its reply
+        self._pipe_locks = []
+        # Bumped whenever the shards are rebuilt; queries encoded against an
+        # older fit are encoded again
+        self._generation = 0
+        self._shared = []
+        self._published = None
+        self._shard_rows = []
+        self._bounds = []
+        with self.matcher._lock:
+            self._start_workers()
+            self._publish()
+
+    def _start_workers(self):
+        for _ in range(self.n_shards):
+            parent, child = self._context.Pipe()
+            process = self._context.Process(target=_shard_worker, args=(child,), daemon=True)
+            process.start()
+            child.close()
+            self._workers.append((process, parent))
+            self._pipe_locks.append(threading.Lock())
+
+    def _publish(self):
+        """Copy the matcher's current fit into shared memory and load it into the shards"""
+        matcher = self.matcher
+        self._published = matcher.posting_rows
+
+        n_rows = matcher.fitted_rows
+        edges = np.linspace(0, n_rows, self.n_shards + 1).astype(np.int64)
+        self._bounds = list(zip(edges[:-1], edges[1:]))
+        self._shard_rows = [int(stop - start) for start, stop in self._bounds]
+        diets = list(matcher.diet_masks)
+        vectors = matcher.ingredient_vectors
+
+        fresh = []
+        for start, stop in self._bounds:
+            postings = vectors[start:stop].tocsc()
+            postings.sort_indices()
+            fresh.append(SharedArrays({
+                'posting_indptr': postings.indptr.astype(np.int64),
+                'posting_rows': postings.indices.astype(np.int32),
+                'posting_weights': postings.data.astype(np.float64),
+                'diet_masks': np.vstack([matcher.diet_masks[diet][start:stop] for diet in diets]) if diets else None,
+                'nutrition': matcher.recipe_nutrition[start:stop] if matcher.recipe_nutrition is not None else None,
+            }))
+
+        # Queries already sent finish on the old blocks; later ones see the
+        # new generation and are encoded again against this fit
+        for lock in self._pipe_locks:
+            lock.acquire()
+        try:
+            sent = 0
+            try:
+                for shared, (start, stop), (_, conn) in zip(fresh, self._bounds, self._workers):
+                    conn.send(('load', shared.spec(), int(start), int(stop), len(matcher.vocabulary), diets))
+                    sent += 1
+            finally:
+                self._generation += 1
+                self._gather(range(sent))
+        finally:
+            for lock in self._pipe_locks:
+                lock.release()
+        for shared in self._shared:
+            shared.close()
+        self._shared = fresh
+
+        # Recipes the matcher added on top of this fit
+        for row in range(matcher.fitted_rows, matcher.num_recipes):
+            self._add_row(row)
+        logger.info("Sharded %s recipes across %s worker processes (%.1f MB shared)",
+                    n_rows, self.n_shards, sum(shared.nbytes() for shared in self._shared) / 1e6)
+
+    def _sync(self):
+        """Rebuild the shards if the matcher has been refitted since they were built"""
+        if self.matcher.posting_rows is not self._published:
+            self._publish()
+
+    def _receive(self, shard):
+        """(status, payload) of one shard's reply; call with its pipe lock held"""
+        try:
+            return self._workers[shard][1].recv()
+        except (EOFError, OSError) as e:
+            return 'error', f"{type(e).__name__}: {e}"
+
+    def _gather(self, shards):
+        # Every reply is read, even after an error, so none is left in a
+        # pipe to be taken for the answer to the next request
+        results, errors = [], []
+        for shard in shards:
+            status, payload = self._receive(shard)
+            if status != 'ok':
+                errors.append(payload)
+            results.append(payload)
+        if errors:
+            raise RuntimeError(f"Shard worker error: {errors[0]}")
+        return results
+
+    def _exchange(self, message, generation):
+        """Every shard's reply to message, or None if the shards were rebuilt after generation
+
+        Pipes are taken in shard order, and each is released as soon as its
+        reply is read so the next request can start on that shard.
+        """
+        held = sent = 0
+        results, errors = [], []
+        try:
+            for lock, (_, conn) in zip(self._pipe_locks, self._workers):
+                lock.acquire()
+                held += 1
+                if self._generation != generation:
+                    break
+                conn.send(message)
+                sent += 1
+        finally:
+            for shard in range(held):
+                if shard < sent:
+                    status, payload = self._receive(shard)
+                    if status != 'ok':
+                        errors.append(payload)
+                    results.append(payload)
+                self._pipe_locks[shard].release()
+        if errors:
+            raise RuntimeError(f"Shard worker error: {errors[0]}")
+        return results if sent == len(self._workers) else None
+
+    def _add_row(self, row):
+        """Send a matcher row added since the fit to the smallest shard"""
+        matcher = self.matcher
+        vector = matcher.added_vector(row)
+        shard = int(np.argmin(self._shard_rows))
+        self._shard_rows[shard] += 1
+        diets = {diet: bool(mask[row]) for diet, mask in matcher.diet_masks.items()}
+        nutrition = matcher.recipe_nutrition[row] if matcher.recipe_nutrition is not None else None
+        with self._pipe_locks[shard]:
+            self._workers[shard][1].send(('add', row, vector.indices, vector.data, diets, nutrition))
+
+    def add_recipe(self, recipe):
+        """RecipeMatcher.add_recipe, then route the new row to a shard"""
+        with self.matcher._lock:
+            added = self.matcher.add_recipe(recipe)
+            if added and self.matcher.vocabulary is not None:
+                if self.matcher.posting_rows is self._published:
+                    self._add_row(self.matcher.num_recipes - 1)
+        return added
+
+    def _scatter(self, specs, generation):
+        """Every shard's results for query specs, or None if the shards were rebuilt since generation"""
+        with stage('score'):
+            return self._exchange(('search', specs), generation)
+
+    def _merge(self, specs, per_shard):
+        """Merge each query's per-shard results into its global top_n"""
+        merged = []
+        for i, spec in enumerate(specs):
+            top_n = spec[2]
+            # Each shard's list is sorted by (-score, row), so a heap merge
+            # of them is too
+            streams = [zip(-scores, rows) for rows, scores in (results[i] for results in per_shard)]
+            best = list(heapq.merge(*streams))[:top_n]
+            merged.append((
+                np.array([row for _, row in best], dtype=np.int64),
+                np.array([-score for score, _ in best], dtype=np.float64),
+            ))
+        return merged
+
+    def _spec(self, vector, top_n, diet_filter, nutrition, nutrition_weights):
+        diet = diet_filter.lower() if diet_filter else None
+        return (vector.indices, vector.data, top_n, diet,
+                self.matcher.nutrient_bounds(nutrition), self.matcher.nutrient_weights(nutrition_weights))
+
+    def find_similar_rows(self, user_ingredients, top_n=5, diet_filter=None, nutrition=None, nutrition_weights=None, retrieval=None):
+        """RecipeMatcher.find_similar_rows, scored across the shards"""
+        return self.find_similar_rows_batch([{
+            'ingredients': user_ingredients, 'top_n': top_n, 'diet_filter': diet_filter,
+            'nutrition': nutrition, 'nutrition_weights': nutrition_weights, 'retrieval': retrieval,
+        }])[0]
+
+    def find_similar_rows_batch(self, queries):
+        """RecipeMatcher.find_similar_rows_batch with one scatter for all uncached queries"""
+        matcher = self.matcher
+        empty = (np.empty(0, dtype=np.int64), np.empty(0))
+        if matcher.ingredient_vectors is None:
+            return [empty for _ in queries]
+
+        results = [None] * len(queries)
+        keys = [None] * len(queries)
+        ingredient_lists = [None] * len(queries)
+        for i, query in enumerate(queries):
+            mode = matcher.retrieval_mode(query.get('retrieval'))
+            top_n = int(query.get('top_n', 5))
+            if mode != 'sparse':
+                results[i] = matcher.find_similar_rows(
+                    query.get('ingredients', []), top_n, query.get('diet_filter'),
+                    query.get('nutrition'), query.get('nutrition_weights'), mode
+                )
+            elif top_n <= 0:
+                results[i] = empty
+        sparse = [i for i in range(len(queries)) if results[i] is None]
+        with stage('normalise'):
+            for i in sparse:
+                ingredient_lists[i] = matcher._normalised_query(queries[i].get('ingredients', []))
+        if matcher.query_cache is not None:
+            version = matcher.cache_version()
+            for i in sparse:
+                keys[i] = matcher._query_key(
+                    ingredient_lists[i], int(queries[i].get('top_n', 5)), queries[i].get('diet_filter'),
+                    queries[i].get('nutrition'), queries[i].get('nutrition_weights')
+                )
+                results[i] = matcher._cached_rows(keys[i], version)
+        pending = [i for i in range(len(queries)) if results[i] is None]
+        if not pending:
+            return results
+
+        while True:
+            with matcher._lock:
+                self._sync()
+                generation = self._generation
+                version = matcher.cache_version()
+                with stage('vectorise'):
+                    vectors = matcher._vectorize([' '.join(ingredient_lists[i]) for i in pending], query=True)
+                    specs = [
+                        self._spec(vectors[position], int(queries[i].get('top_n', 5)), queries[i].get('diet_filter'),
+                                   queries[i].get('nutrition'), queries[i].get('nutrition_weights'))
+                        for position, i in enumerate(pending)
+                    ]
+            per_shard = self._scatter(specs, generation)
+            if per_shard is not None:
+                break
+
+        with stage('top_k'):
+            merged = self._merge(specs, per_shard)
+            with matcher._lock:
+                for (rows, scores), spec, i in zip(merged, specs, pending):
+                    # Filters were applied in the shards; this only pads short
+                    # results with unmatched eligible rows as the matcher does
+                    results[i] = matcher._select_top(rows, scores, spec[2], spec[3], spec[4])
+
+        for i in pending:
+            if keys[i] is not None:
+                matcher._cache_rows(keys[i], version, *results[i])
+        return results
+
+    def _recipes(self, rows, scores, with_nutrition):
+        recipes = []
+        for idx, score in zip(rows, scores):
+            recipe = self.matcher.store.get(idx)
+            recipe['similarity_score'] = float(score)
+            if with_nutrition:
+                recipe['nutrition'] = self.matcher.get_nutrition(idx)
+            recipes.append(recipe)
+        return recipes
+
+    def find_similar_recipes(self, user_ingredients, top_n=5, diet_filter=None, nutrition=None, nutrition_weights=None, retrieval=None):
+        """RecipeMatcher.find_similar_recipes, scored across the shards"""
+        try:
+            if self.matcher.ingredient_vectors is None or self.matcher.num_recipes == 0:
+                logger.warning("No recipes available for matching")
+                return self.matcher._get_fallback_recipes()
+            rows, scores = self.find_similar_rows(user_ingredients, top_n, diet_filter, nutrition, nutrition_weights, retrieval)
+            results = self._recipes(rows, scores, nutrition or nutrition_weights)
+            sampled(logger, logging.INFO, "Found %d matching recipes", len(results))
+            return results
+        except Exception as e:
+            logger.error("Error in sharded recipe matching: %s", e)
+            return self.matcher._get_fallback_recipes()
+
+    def find_similar_recipes_batch(self, queries):
+        """RecipeMatcher.find_similar_recipes_batch, scored across the shards"""
+        try:
+            if self.matcher.ingredient_vectors is None or self.matcher.num_recipes == 0:
+                logger.warning("No recipes available for matching")
+                return [self.matcher._get_fallback_recipes() for _ in queries]
+            results = [
+                self._recipes(rows, scores, query.get('nutrition') or query.get('nutrition_weights'))
+                for query, (rows, scores) in zip(queries, self.find_similar_rows_batch(queries))
+            ]
+            sampled(logger, logging.INFO, "Answered %d batched queries", len(results))
+            return results
+        except Exception as e:
+            logger.error("Error in sharded batch matching: %s", e)
+            return [self.matcher._get_fallback_recipes() for _ in queries]
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        for lock, (process, conn) in zip(self._pipe_locks, self._workers):
+            with lock:
+                try:
+                    conn.send(('close',))
+                except OSError:
+                    pass
+        for process, conn in self._workers:
+            process.join(timeout=5)
+            conn.close()
+        self._workers = []
+        self._pipe_locks = []
+        for shared in self._shared:
+            shared.close()
+        self._shared = []
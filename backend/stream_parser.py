@@ -0,0 +1,120 @@
+import json
+
+# Arrays whose elements are emitted one by one as they complete
+ITEM_FIELDS = {'ingredients': 'ingredient', 'instructions': 'instruction'}
+
+class IncrementalRecipeParser:
+    """Pull completed parts of a recipe out of a JSON object as it streams in
+
+    feed() takes the next chunk of model output and returns the events that
+    became complete, as (event, data) pairs:
+
+        ('title', 'Spicy Rice')
+        ('ingredient', {'name': 'rice', 'amount': '1 cup'})   one per element
+        ('instruction', 'Rinse the rice')                     one per element
+        ('field', {'cooking_time': 30})                       any other key
+
+    Text before the first '{' (a model preamble) is ignored. Values are only
+    decoded once their closing quote or bracket arrives, so nothing is
+    emitted from a half-written token.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.done = False
+        # One frame per open object/array: its kind, the key being filled
+        # (objects only), whether a key is expected next, and where the
+        # current value started
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._string_start = 0
+
+    def text(self):
+        return ''.join(self.buffer)
+
+    def feed(self, chunk):
+        events = []
+        for ch in chunk:
+            pos = len(self.buffer)
+            self.buffer.append(ch)
+            if self.done:
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._stack[-1]['key'] = json.loads(''.join(self.buffer[self._string_start:pos + 1]))
+                    else:
+                        self._end_value(pos + 1, events)
+                continue
+
+            if not self._stack:
+                if ch == '{':
+                    self._stack.append({'kind': '{', 'key': None, 'expect_key': True, 'start': None})
+                continue
+
+            frame = self._stack[-1]
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+                self._string_is_key = frame['kind'] == '{' and frame['expect_key']
+                if not self._string_is_key:
+                    frame['start'] = pos
+            elif ch in '{[':
+                frame['start'] = pos
+                self._stack.append({'kind': ch, 'key': None, 'expect_key': ch == '{', 'start': None})
+            elif ch in '}]':
+                self._end_scalar(pos, events)
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                else:
+                    self._end_value(pos + 1, events)
+            elif ch == ':':
+                frame['expect_key'] = False
+            elif ch == ',':
+                self._end_scalar(pos, events)
+                if frame['kind'] == '{':
+                    frame['expect_key'] = True
+            elif not ch.isspace() and frame['start'] is None:
+                # Numbers, true, false and null end at the next ',' or bracket
+                frame['start'] = pos
+        return events
+
+    def _end_scalar(self, end, events):
+        if self._stack and self._stack[-1]['start'] is not None:
+            self._end_value(end, events)
+
+    def _end_value(self, end, events):
+        """The value started in the innermost frame ends at end"""
+        frame = self._stack[-1]
+        start, frame['start'] = frame['start'], None
+        if start is None:
+            return
+        depth = len(self._stack)
+
+        if depth == 1:
+            key = frame['key']
+            # Array fields were already emitted element by element
+            if key in ITEM_FIELDS:
+                return
+            value = self._decode(start, end)
+            if value is not None or key is not None:
+                events.append(('title', value) if key == 'title' else ('field', {key: value}))
+        elif depth == 2 and frame['kind'] == '[' and self._stack[0]['key'] in ITEM_FIELDS:
+            value = self._decode(start, end)
+            if value is not None:
+                events.append((ITEM_FIELDS[self._stack[0]['key']], value))
+
+    def _decode(self, start, end):
+        try:
+            return json.loads(''.join(self.buffer[start:end]))
+        except ValueError:
+            return None
@@ -0,0 +1,92 @@
+"""GPTRecipeGenerator's cache and request coalescing against a fake OpenAI client
+
+    cd backend && python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from caching import LRUCache
+from gpt_generator import GPTRecipeGenerator
+
+RECIPE = {
+    "title": "Fake Recipe",
+    "ingredients": [{"name": "Chicken", "amount": "200 g"}],
+    "instructions": ["Cook it"],
+    "cooking_time": 20,
+}
+
+class FakeClient:
+    """complete() after delay seconds, recording each prompt it was sent"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def complete(self, messages, **params):
+        with self._lock:
+            self.prompts.append(messages[-1]['content'])
+        time.sleep(self.delay)
+        return json.dumps(RECIPE)
+
+def generator(client):
+    return GPTRecipeGenerator(client=client, cache=LRUCache(max_entries=16))
+
+class GenerationCacheTest(unittest.TestCase):
+    def test_equivalent_requests_share_one_call(self):
+        client = FakeClient()
+        gpt = generator(client)
+        first = gpt.generate_recipe(['Chicken', 'rice'], 'Halal', '')
+        second = gpt.generate_recipe([' rice', 'chicken', 'chicken'], 'halal', None)
+        self.assertEqual(first, second)
+        self.assertEqual(len(client.prompts), 1)
+        self.assertEqual(gpt.stats()['upstream_calls'], 1)
+
+    def test_prompt_uses_inputs_as_given(self):
+        client = FakeClient()
+        gpt = generator(client)
+        recipe = gpt.generate_recipe(['Rice', 'Chicken Thigh'], 'Halal', 'Thai')
+        self.assertIn("Rice, Chicken Thigh", client.prompts[0])
+        self.assertIn("Dietary restrictions: Halal", client.prompts[0])
+        # Original ingredients are checked as the caller wrote them
+        self.assertIn('Chicken Thigh', recipe['ingredients'])
+
+    def test_fallback_uses_inputs_as_given(self):
+        with mock.patch.dict(os.environ, {'OPENAI_API_KEY': ''}):
+            gpt = GPTRecipeGenerator(client=None, cache=LRUCache())
+        recipe = gpt.generate_recipe(['Tofu', 'bok choy'], '', 'thai')
+        self.assertEqual(recipe['title'], "Thai Tofu Bok Choy Special")
+        self.assertEqual([ing['name'] for ing in recipe['ingredients']], ['Tofu', 'bok choy'])
+
+    def test_concurrent_identical_requests_coalesce(self):
+        client = FakeClient(delay=0.2)
+        gpt = generator(client)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(gpt.generate_recipe(['egg'], '', ''))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(client.prompts), 1)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(gpt.stats()['coalesced'], 7)
+
+    def test_concurrent_distinct_requests_are_all_counted(self):
+        client = FakeClient(delay=0.01)
+        gpt = generator(client)
+        threads = [threading.Thread(target=gpt.generate_recipe, args=([f"ingredient {i}"], '', '')) for i in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(gpt.stats()['upstream_calls'], 32)
+
+if __name__ == '__main__':
+    unittest.main()
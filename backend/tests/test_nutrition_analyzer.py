@@ -0,0 +1,81 @@
+"""NutritionAnalyzer against a fake Edamam session
+
+    cd backend && python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from caching import LRUCache
+from circuit_breaker import CircuitBreaker
+from nutrition_analyzer import NutritionAnalyzer
+
+class FakeResponse:
+    def __init__(self, status_code, calories=0):
+        self.status_code = status_code
+        self.calories = calories
+
+    def json(self):
+        return {'calories': self.calories, 'totalNutrients': {'PROCNT': {'quantity': 1}}}
+
+class FakeSession:
+    """Answers every line with status, counting the lines it was asked for"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.lines = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        with self._lock:
+            self.lines.append(params['ingr'])
+        return FakeResponse(self.status, calories=len(params['ingr']))
+
+def analyzer(session, breaker=None):
+    with mock.patch.dict(os.environ, {'EDAMAM_APP_ID': 'id', 'EDAMAM_APP_KEY': 'key'}):
+        return NutritionAnalyzer(base_url='http://edamam.test', session=session, cache=LRUCache(), breaker=breaker)
+
+class EdamamCallTest(unittest.TestCase):
+    def test_lines_are_cached(self):
+        session = FakeSession()
+        nutrition = analyzer(session)
+        first = nutrition._call_edamam_api(['200 g rice', '1 egg', '1 egg'])
+        self.assertEqual(first['calories'], len('200 g rice') + 2 * len('1 egg'))
+        nutrition._call_edamam_api(['1 egg', '100 g oats'])
+        self.assertEqual(sorted(session.lines), ['1 egg', '100 g oats', '200 g rice'])
+
+    def test_half_open_breaker_sends_one_trial_line(self):
+        session = FakeSession(status=500)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        nutrition = analyzer(session, breaker)
+        self.assertIsNone(nutrition._call_edamam_api(['1 egg']))
+        self.assertEqual(breaker.state, 'open')
+
+        time.sleep(0.06)
+        session.lines.clear()
+        self.assertIsNone(nutrition._call_edamam_api([f"{i} g rice" for i in range(1, 11)]))
+        self.assertEqual(len(session.lines), 1)
+
+        time.sleep(0.06)
+        session.status = 200
+        session.lines.clear()
+        self.assertIsNotNone(nutrition._call_edamam_api([f"{i} g oats" for i in range(1, 11)]))
+        self.assertEqual(len(session.lines), 10)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_prefetched_names_match_whole_words(self):
+        session = FakeSession()
+        nutrition = analyzer(session)
+        prefetched = {'egg': {'calories': 150}, 'rice': {'calories': 130}}
+        total = nutrition._call_edamam_api(['100 g eggs', '200 g rice', '1 eggplant'], prefetched)
+        # Only the eggplant has to be fetched; "egg" must not price it
+        self.assertEqual(session.lines, ['1 eggplant'])
+        self.assertEqual(total['calories'], len('1 eggplant') + 150 + 2 * 130)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""GPTRecipeGenerator.stream_recipe against a fake streaming OpenAI client
+
+    cd backend && python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import unittest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from caching import LRUCache
+from gpt_generator import GPTRecipeGenerator
+
+RECIPE_TEXT = "Here you go: " + json.dumps({
+    "title": "Egg Fried Rice",
+    "ingredients": [{"name": "rice", "amount": "1 cup"}, {"name": "egg", "amount": "2"}],
+    "instructions": ["Fry the egg", "Add the rice"],
+    "cooking_time": 15,
+})
+
+class FakeStreamingClient:
+    """Streams RECIPE_TEXT in chunk_size pieces, failing after fail_after of them if set"""
+
+    def __init__(self, chunk_size=7, fail_after=None):
+        self.chunk_size = chunk_size
+        self.fail_after = fail_after
+        self.calls = 0
+        self.sent = 0
+
+    def stream(self, messages, **params):
+        self.calls += 1
+        for start in range(0, len(RECIPE_TEXT), self.chunk_size):
+            if self.fail_after is not None and self.sent >= self.fail_after:
+                raise ConnectionError("stream dropped")
+            self.sent += 1
+            yield RECIPE_TEXT[start:start + self.chunk_size]
+
+def generator(client):
+    return GPTRecipeGenerator(client=client, cache=LRUCache(max_entries=16))
+
+class RecipeStreamTest(unittest.TestCase):
+    def test_parts_arrive_before_the_stream_ends(self):
+        client = FakeStreamingClient()
+        events = []
+        for event, data in generator(client).stream_recipe(['rice', 'egg']):
+            events.append((event, data, client.sent))
+
+        kinds = [event for event, _, _ in events]
+        self.assertEqual(kinds[:5], ['title', 'ingredient', 'ingredient', 'instruction', 'instruction'])
+        self.assertEqual(kinds[-1], 'recipe')
+        total_chunks = client.sent
+        title = events[0]
+        self.assertEqual(title[1], "Egg Fried Rice")
+        self.assertLess(title[2], total_chunks // 2)
+
+        recipe = events[-1][1]
+        self.assertEqual(recipe['source'], 'gpt')
+        self.assertEqual(recipe['ingredients'][:2], ['1 cup rice', '2 egg'])
+
+    def test_cached_recipe_is_replayed_without_a_call(self):
+        client = FakeStreamingClient()
+        gpt = generator(client)
+        first = list(gpt.stream_recipe(['rice', 'egg']))
+        second = list(gpt.stream_recipe(['Egg', 'rice']))
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(first[-1], second[-1])
+        self.assertEqual(second[0], ('title', "Egg Fried Rice"))
+
+    def test_interrupted_stream_ends_with_the_fallback(self):
+        client = FakeStreamingClient(fail_after=5)
+        gpt = generator(client)
+        events = list(gpt.stream_recipe(['rice', 'egg']))
+        self.assertEqual(events[-2][0], 'error')
+        self.assertEqual(events[-1][0], 'recipe')
+        self.assertEqual(events[-1][1]['source'], 'fallback')
+        self.assertEqual(gpt.stats()['upstream_errors'], 1)
+        # Nothing half-generated is cached
+        client.fail_after = None
+        self.assertEqual(list(gpt.stream_recipe(['rice', 'egg']))[-1][1]['source'], 'gpt')
+
+if __name__ == '__main__':
+    unittest.main()
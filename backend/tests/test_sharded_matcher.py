@@ -0,0 +1,81 @@
+"""ShardedMatcher against RecipeMatcher on the sample catalogue
+
+    cd backend && python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from matching_engine import RecipeMatcher
+from recipe_store import RecipeStore
+import sharded_matcher
+from sharded_matcher import Shard, ShardedMatcher
+
+SAMPLE_RECIPES = os.path.join(BACKEND_DIR, 'data', 'sample_recipes.json')
+# top_n that makes the first shard fail
+FAILING_TOP_N = 13
+
+def failing_search_many(original):
+    def search_many(self, queries):
+        if self.start == 0 and any(query[2] == FAILING_TOP_N for query in queries):
+            raise ValueError("injected shard failure")
+        return original(self, queries)
+    return search_many
+
+def failing_shard_worker(conn):
+    """_shard_worker whose first shard fails queries for FAILING_TOP_N"""
+    Shard.search_many = failing_search_many(Shard.search_many)
+    sharded_matcher._shard_worker(conn)
+
+class ShardErrorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(SAMPLE_RECIPES, 'r', encoding='utf-8') as f:
+            cls.matcher = RecipeMatcher(RecipeStore(json.load(f)))
+
+    def setUp(self):
+        # Workers do not share this process's memory, so they are started
+        # with a target that patches their own Shard
+        with mock.patch.object(sharded_matcher, '_shard_worker', failing_shard_worker):
+            self.sharded = ShardedMatcher(self.matcher, n_shards=2)
+        self.addCleanup(self.sharded.close)
+
+    def assertSameRows(self, ingredients, top_n):
+        expected, _ = self.matcher.find_similar_rows(ingredients, top_n)
+        rows, _ = self.sharded.find_similar_rows(ingredients, top_n)
+        self.assertEqual(list(rows), list(expected))
+
+    def test_query_after_shard_error(self):
+        self.assertSameRows(['paneer'], 3)
+        with self.assertRaises(RuntimeError):
+            self.sharded.find_similar_rows(['chicken', 'rice'], FAILING_TOP_N)
+        # The healthy shard's reply to the failed query must not be read as this one's
+        self.assertSameRows(['paneer'], 3)
+        self.assertSameRows(['tomato', 'onion'], 5)
+
+    def test_concurrent_queries(self):
+        queries = [['paneer'], ['chicken', 'rice'], ['tomato', 'onion'], ['pasta', 'garlic'], ['egg']]
+        expected = {tuple(query): list(self.matcher.find_similar_rows(query, 5)[0]) for query in queries}
+        mismatches = []
+
+        def run(offset):
+            for i in range(40):
+                query = queries[(offset + i) % len(queries)]
+                rows = list(self.sharded.find_similar_rows(query, 5)[0])
+                if rows != expected[tuple(query)]:
+                    mismatches.append((query, rows))
+
+        threads = [threading.Thread(target=run, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mismatches, [])
+
+if __name__ == '__main__':
+    unittest.main()